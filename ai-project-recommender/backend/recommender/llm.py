@@ -1,14 +1,202 @@
 from flask import jsonify
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 import requests
+from requests.adapters import HTTPAdapter
+
+# One keep-alive connection pool shared by every LLMInterface
+_session = requests.Session()
+_session.mount('http://', HTTPAdapter(pool_maxsize=10))
+_session.mount('https://', HTTPAdapter(pool_maxsize=10))
+
+class LLMBusyError(Exception):
+    """Raised when too many callers already wait for a generation slot"""
+
+class _Slots:
+    """
+    Caps in-flight generations; callers beyond `max_queue` waiting for a slot are
+    rejected right away instead of queueing behind a long timeout.
+    """
+    def __init__(self, max_in_flight=2, max_queue=16):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+
+    @contextmanager
+    def hold(self, queue_timeout):
+        with self._lock:
+            if self._waiting + self._in_flight >= self.max_in_flight + self.max_queue:
+                self._rejected += 1
+                raise LLMBusyError("LLM queue is full")
+            self._waiting += 1
+        acquired = self._slots.acquire(timeout=queue_timeout)
+        with self._lock:
+            self._waiting -= 1
+            if acquired:
+                self._in_flight += 1
+            else:
+                self._rejected += 1
+        if not acquired:
+            raise LLMBusyError("Timed out waiting for an LLM slot")
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._completed += 1
+            self._slots.release()
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'in_flight': self._in_flight,
+                'waiting': self._waiting,
+                'max_in_flight': self.max_in_flight,
+                'max_queue': self.max_queue,
+                'completed': self._completed,
+                'rejected': self._rejected,
+            }
+
+_slots = _Slots()
+
+class _Backend:
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.failures = 0
+        self.open_until = 0.0
+        self.healthy = True
+        self.requests = 0
+
+    def available(self, now):
+        return self.healthy and (self.failures < _Router.FAILURE_THRESHOLD or now >= self.open_until)
+
+class _Router:
+    """
+    Least-outstanding-requests routing over several model URLs, with a circuit breaker on
+    connection errors and timeouts, sticky routing per key (e.g. a chat) and a background
+    health check of every backend.
+    """
+    FAILURE_THRESHOLD = 3
+    COOLDOWN = 30
+    HEALTH_INTERVAL = 10
+
+    def __init__(self, urls, max_sticky=10000):
+        self.backends = [_Backend(url) for url in urls]
+        self.max_sticky = max_sticky
+        self._sticky = OrderedDict()
+        self._lock = threading.Lock()
+        self._health_thread = None
+
+    def pick(self, key=None, exclude=()):
+        now = time.time()
+        with self._lock:
+            candidates = [b for b in self.backends if b.available(now) and b not in exclude]
+            if not candidates:
+                raise requests.exceptions.ConnectionError("No language model backend is available")
+            backend = self._sticky.get(key)
+            if backend not in candidates:
+                backend = min(candidates, key=lambda b: (b.outstanding, b.requests))
+            if key is not None:
+                self._sticky[key] = backend
+                self._sticky.move_to_end(key)
+                while len(self._sticky) > self.max_sticky:
+                    self._sticky.popitem(last=False)
+            backend.outstanding += 1
+            backend.requests += 1
+            return backend
+
+    def release(self, backend, error=None):
+        with self._lock:
+            backend.outstanding -= 1
+            if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+                backend.failures += 1
+                if backend.failures >= self.FAILURE_THRESHOLD:
+                    backend.open_until = time.time() + self.COOLDOWN
+            elif error is None:
+                backend.failures = 0
+
+    def check_health(self, timeout=2):
+        for backend in self.backends:
+            try:
+                healthy = _session.get(backend.url.rsplit('/api/', 1)[0] + '/api/tags', timeout=timeout).ok
+            except requests.exceptions.RequestException:
+                healthy = False
+            with self._lock:
+                backend.healthy = healthy
+                if healthy:
+                    backend.failures = 0
+
+    def start_health_checks(self, interval=HEALTH_INTERVAL, timeout=2):
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.check_health(timeout)
+
+        self._health_thread = threading.Thread(target=loop, name='llm-health', daemon=True)
+        self._health_thread.start()
+
+_routers = {}
+_routers_lock = threading.Lock()
+
+def _router_for(urls):
+    """Routers are shared per backend list, so every LLMInterface sees the same load"""
+    with _routers_lock:
+        if urls not in _routers:
+            _routers[urls] = _Router(urls)
+            if len(urls) > 1:
+                _routers[urls].start_health_checks()
+        return _routers[urls]
 
 class LLMInterface:
-    def __init__(self, model_url):
-        self.model_url = model_url
+    def __init__(self, model_url, queue_timeout=30, model='llama3', timeout=(5, 120)):
+        """`model_url` is one Ollama generate URL, or a list / comma-separated string of them"""
+        if isinstance(model_url, str):
+            model_url = model_url.split(',')
+        self.router = _router_for(tuple(url.strip() for url in model_url if url.strip()))
+        self.model_url = self.router.backends[0].url
+        self.model = model
+        self.queue_timeout = queue_timeout
+        # (connect, read) seconds, so a hung model server cannot hold a slot forever
+        self.timeout = timeout
 
-    def generate_response(self, prompt):
+    def generate_response(self, prompt, route_key=None):
         try:
-            response = requests.post(self.model_url, json={'prompt': prompt})
-            response.raise_for_status()
-            return response.json().get('response', '')
-        except requests.exceptions.RequestException as e:
-            return f"Error communicating with the language model: {str(e)}"
\ No newline at end of file
+            with _slots.hold(self.queue_timeout):
+                return self._generate(prompt, route_key)
+        except LLMBusyError:
+            return "The language model is busy. Please try again shortly."
+        except (requests.exceptions.RequestException, ValueError) as e:
+            return f"Error communicating with the language model: {str(e)}"
+
+    def _generate(self, prompt, route_key):
+        """Generate on the chosen backend, moving on to the next one if it cannot be reached"""
+        tried = []
+        while True:
+            backend = self.router.pick(route_key, tried)
+            error = None
+            try:
+                response = _session.post(backend.url, json={'model': self.model, 'prompt': prompt, 'stream': False},
+                                         timeout=self.timeout)
+                response.raise_for_status()
+                return response.json().get('response', '')
+            except Exception as e:
+                error = e
+                tried.append(backend)
+                if (not isinstance(e, requests.exceptions.ConnectionError)
+                        or len(tried) == len(self.router.backends)):
+                    raise
+            finally:
+                self.router.release(backend, error)
+
+    @staticmethod
+    def metrics():
+        """Queue figures of the slots shared by every LLMInterface"""
+        return _slots.metrics()
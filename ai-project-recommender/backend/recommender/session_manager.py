@@ -1,42 +1,75 @@
 from flask import session
+import threading
+import time
+from collections import OrderedDict
+
+def new_session():
+    return {
+        'stage': 'greeting',
+        'skill_level': None,
+        'interest_area': None,
+        'language': None,
+        'time_available': None,
+        'domain': None,
+        'recommended_projects': '',
+        'selected_project': None,
+        'problem_statements': '',
+        'selected_problem': None
+    }
+
+class MemorySessionStore:
+    """Bounded in-process session storage with LRU eviction and an idle TTL"""
+
+    def __init__(self, max_sessions=1000, ttl=21600):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._sessions.get(key)
+            if not entry or time.time() - entry[1] > self.ttl:
+                self._sessions.pop(key, None)
+                return None
+            self._sessions.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._sessions[key] = (value, time.time())
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._sessions.pop(key, None)
 
 class SessionManager:
-    def __init__(self):
-        self.user_sessions = {}
+    """
+    Per-user recommendation state. Any store with get/set/delete can be plugged in
+    (e.g. one shared across workers); the default is bounded and in-process.
+    """
+
+    def __init__(self, store=None):
+        self.store = store or MemorySessionStore()
 
     def get_session(self, user_id):
-        return self.user_sessions.setdefault(user_id, {
-            'stage': 'greeting',
-            'skill_level': None,
-            'interest_area': None,
-            'language': None,
-            'time_available': None,
-            'domain': None,
-            'recommended_projects': '',
-            'selected_project': None,
-            'problem_statements': '',
-            'selected_problem': None
-        })
+        user_session = self.store.get(user_id)
+        if user_session is None:
+            user_session = new_session()
+            self.store.set(user_id, user_session)
+        return user_session
 
     def clear_session(self, user_id):
-        if user_id in self.user_sessions:
-            del self.user_sessions[user_id]
+        self.store.delete(user_id)
 
     def update_session(self, user_id, key, value):
         session = self.get_session(user_id)
         session[key] = value
+        self.store.set(user_id, session)
 
     def reset_session(self, user_id):
-        if user_id in self.user_sessions:
-            self.user_sessions[user_id] = {
-                'stage': 'greeting',
-                'skill_level': None,
-                'interest_area': None,
-                'language': None,
-                'time_available': None,
-                'domain': None,
-                'recommended_projects': '',
-                'selected_project': None,
-                'problem_statements': '',
-                'selected_problem': None
-            }
\ No newline at end of file
+        if self.store.get(user_id) is not None:
+            self.store.set(user_id, new_session())
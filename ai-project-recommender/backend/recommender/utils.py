@@ -1,14 +1,23 @@
-from typing import List, Dict, Any
+import re
+from typing import List, Dict, Any, Optional
 
-def normalize_choice(text: str) -> str:
-    choices = {
-        '1': '1', 'one': '1', 'first': '1',
-        '2': '2', 'two': '2', 'second': '2',
-        '3': '3', 'three': '3', 'third': '3',
-        '4': '4', 'four': '4', 'fourth': '4',
-        '5': '5', 'five': '5', 'fifth': '5',
-    }
-    return choices.get(text.strip().lower(), None)
+CHOICES = {
+    '1': '1', 'one': '1', 'first': '1', '1st': '1',
+    '2': '2', 'two': '2', 'second': '2', '2nd': '2',
+    '3': '3', 'three': '3', 'third': '3', '3rd': '3',
+    '4': '4', 'four': '4', 'fourth': '4', '4th': '4',
+    '5': '5', 'five': '5', 'fifth': '5', '5th': '5',
+}
+FILLER_WORDS = {'the', 'option', 'number', 'project', 'idea', 'i', 'want', 'pick', 'take'}
+
+def normalize_choice(text: str) -> Optional[str]:
+    """'1'..'5' for a selection like "2", "#2", "3rd", "the second one" or "option two", else None"""
+    words = [word.lstrip('#') for word in re.findall(r"[a-z0-9#]+", (text or '').lower())]
+    words = [word for word in words if word not in FILLER_WORDS]
+    # "the second one": a trailing "one" is a pronoun, not a number
+    if len(words) > 1 and words[-1] == 'one':
+        words.pop()
+    return CHOICES.get(words[0]) if len(words) == 1 else None
 
 def extract_projects(text: str) -> List[str]:
     text = (text or '').strip()
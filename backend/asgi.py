@@ -0,0 +1,235 @@
+"""
+Async serving mode.
+
+/chatbot runs as an async view, so a pending Ollama generation holds no worker thread and a
+single process can keep hundreds of generations in flight. Every other route is served by
+the regular Flask app, unchanged. Run with:
+
+    uvicorn asgi:application --workers 2
+
+Each worker runs the Flask app's startup (see app.create_app) and opens its async MongoDB
+client on lifespan startup, and is ready at /readyz once it has warmed up the model. The turn
+itself is services.turns, the same pipeline the Flask view runs.
+"""
+import asyncio
+import os
+import time
+from contextlib import aclosing, asynccontextmanager
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from pymongo import AsyncMongoClient
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as flask_module
+from app import LLM_HEALTH_INTERVAL, MONGO_URI, OLLAMA_MODEL, OLLAMA_URLS, TurnIO, finish_generation
+from services import turns
+from services.chat_store import AsyncChatStore
+from services.metrics import MongoCommandMetrics
+from services.router import AsyncLLMRouter, build_async_llm_client
+from services.singleflight import AsyncCoalescingLLMClient, AsyncMongoFlightStore, AsyncSingleFlight
+
+# Shares each instance's generation slots with the app's sync client, which chat naming,
+# prefetches and warm-up still use, so the process stays within LLM_MAX_IN_FLIGHT
+llm_client = build_async_llm_client(
+    OLLAMA_URLS,
+    share_with=flask_module.llm_client,
+    model=OLLAMA_MODEL,
+    max_in_flight=int(os.getenv('LLM_MAX_IN_FLIGHT', '2')),
+    max_queue=int(os.getenv('ASYNC_LLM_MAX_QUEUE', '256')),
+    queue_timeout=float(os.getenv('LLM_QUEUE_TIMEOUT', '30')),
+    pool_size=int(os.getenv('LLM_POOL_SIZE', '10')),
+    keep_alive=flask_module.llm_client.keep_alive,
+    model_options=flask_module.LLM_MODEL_OPTIONS,
+    failure_threshold=int(os.getenv('LLM_FAILURE_THRESHOLD', '3')),
+    cooldown=float(os.getenv('LLM_BREAKER_COOLDOWN', '30'))
+)
+if flask_module.LLM_COALESCE:
+    # Flights are shared through MongoDB once open_mongo() has given them a store
+    llm_client = AsyncCoalescingLLMClient(llm_client, AsyncSingleFlight())
+
+# Opened by open_mongo() on lifespan startup, in the worker and on the loop that use them
+mongo_client = None
+chat_store = None
+
+
+def open_mongo():
+    global mongo_client, chat_store
+    mongo_client = AsyncMongoClient(MONGO_URI, event_listeners=[MongoCommandMetrics()])
+    db = mongo_client['ai_project_recommender']
+    chat_store = AsyncChatStore(db['chats'], db['messages'])
+    if flask_module.flight_store:
+        llm_client.flights.store = AsyncMongoFlightStore(db['llm_flights'])
+
+
+def session_email(request):
+    """Read the logged-in email from Flask's signed session cookie"""
+    flask_app = flask_module.app
+    cookie = request.cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if not cookie:
+        return None
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    try:
+        data = serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return None
+    return data.get('email')
+
+
+class AsyncTurnIO(TurnIO):
+    """
+    TurnIO returning awaitables, for turns.arun()/astream(). LLM calls and chat reads and writes
+    go through the async clients; the response cache, state store and prefetches have sync
+    backends, so those calls run in a worker thread to keep the loop free.
+    """
+    status_error = httpx.HTTPStatusError
+    timeout_error = httpx.TimeoutException
+    connect_error = httpx.ConnectError
+    transport_error = httpx.HTTPError
+
+    @property
+    def model(self):
+        return llm_client.model
+
+    def generate(self, prompt, **kwargs):
+        return llm_client.generate(prompt, **kwargs)
+
+    def stream(self, prompt, **kwargs):
+        return aiter(llm_client.stream(prompt, **kwargs))
+
+    def next_item(self, items):
+        return anext(items, None)
+
+    def query_llm(self, prompt, **kwargs):
+        return query_llm(prompt, **kwargs)
+
+    def stream_llm(self, prompt, **kwargs):
+        return aiter(stream_llm(prompt, **kwargs))
+
+    def ready_text(self, *args):
+        return asyncio.to_thread(super().ready_text, *args)
+
+    def remember_text(self, *args):
+        return asyncio.to_thread(super().remember_text, *args)
+
+    def get_state(self, key):
+        return asyncio.to_thread(super().get_state, key)
+
+    def store_conversation(self, *args):
+        return asyncio.to_thread(super().store_conversation, *args)
+
+    # Pending writes are only visible through the app's write-behind store
+    def get_chat(self, chat_id, email):
+        if flask_module.WRITE_BEHIND:
+            return asyncio.to_thread(super().get_chat, chat_id, email)
+        return chat_store.get_chat(chat_id, email)
+
+    def get_messages(self, chat_id, email, start=0):
+        if flask_module.WRITE_BEHIND:
+            return asyncio.to_thread(super().get_messages, chat_id, email, start)
+        return chat_store.get_messages(chat_id, email, start=start)
+
+    def append_message(self, chat_id, email, entry, create=False):
+        if flask_module.WRITE_BEHIND:
+            return asyncio.to_thread(super().append_message, chat_id, email, entry, create)
+        return chat_store.append_message(chat_id, email, entry, create=create)
+
+    def record_intent(self, *args):
+        return asyncio.to_thread(super().record_intent, *args)
+
+    def schedule_prefetch(self, *args):
+        if llm_client.saturated():
+            return None
+        return asyncio.to_thread(super().schedule_prefetch, *args)
+
+
+turn_io = AsyncTurnIO()
+
+
+async def query_llm(prompt, timeout=120, session=None, followup_prompt=None, route_key=None, cancel=None):
+    """Async app.query_llm"""
+    return await turns.arun(turns.query_llm(turn_io, prompt, timeout, session, followup_prompt, route_key, cancel))
+
+
+def stream_llm(prompt, timeout=120, session=None, followup_prompt=None, route_key=None, cancel=None):
+    """Async app.stream_llm"""
+    return turns.astream(turns.stream_llm(turn_io, prompt, timeout, session, followup_prompt, route_key, cancel))
+
+
+async def cancel_on_disconnect(request, cancel):
+    """Cancel a generation once its client disconnects; run as a task alongside the request"""
+    while (await request.receive())['type'] != 'http.disconnect':
+        pass
+    cancel.cancel('disconnect')
+
+
+async def stream_turn(turn):
+    events = turns.astream(turns.stream_turn(turn_io, turn))
+    try:
+        async with aclosing(events):
+            async for event in events:
+                yield event
+    finally:
+        finish_generation(turn.email, turn.chat_id, turn.cancel)
+
+
+async def chatbot(request):
+    """Async /chatbot with the same request and response format as the Flask view"""
+    started = time.perf_counter()
+    email = session_email(request)
+    if not email:
+        return JSONResponse({'reply': "Please login first"}, status_code=401)
+
+    data = await request.json()
+    user_message = (data.get('message') or '').strip()
+    chat_id = data.get('chat_id')
+    stream = bool(data.get('stream'))
+
+    if not user_message:
+        return JSONResponse({'reply': "Please enter a message"}, status_code=400)
+
+    turn = await turns.arun(turns.start_turn(turn_io, email, chat_id, user_message, started))
+    if stream:
+        return StreamingResponse(stream_turn(turn), media_type='application/x-ndjson')
+
+    watcher = asyncio.create_task(cancel_on_disconnect(request, turn.cancel)) if turn.plan['prompt'] else None
+    try:
+        body, status = await turns.arun(turns.reply(turn_io, turn))
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+    return JSONResponse(body, status_code=status)
+
+
+async def llm_metrics(request):
+    """The async client's figures, with those of the sync client it shares slots with under 'background'"""
+    return JSONResponse({
+        **llm_client.metrics(),
+        'background': flask_module.llm_client.metrics(),
+        'response_cache': flask_module.response_cache.stats()
+    })
+
+
+@asynccontextmanager
+async def lifespan(application):
+    await asyncio.to_thread(flask_module.create_app)
+    open_mongo()
+    router = getattr(llm_client, 'client', llm_client)
+    if isinstance(router, AsyncLLMRouter) and LLM_HEALTH_INTERVAL > 0:
+        router.start_health_checks(interval=LLM_HEALTH_INTERVAL)
+    yield
+    await llm_client.aclose()
+    if flask_module.WRITE_BEHIND:
+        await asyncio.to_thread(flask_module.chat_store.close)
+    if mongo_client is not None:
+        await mongo_client.close()
+
+
+application = Starlette(lifespan=lifespan, routes=[
+    Route('/chatbot', chatbot, methods=['POST']),
+    Route('/llm-metrics', llm_metrics, methods=['GET']),
+    Mount('/', app=WSGIMiddleware(flask_module.app)),
+])
@@ -1,14 +1,21 @@
 from flask import Blueprint, request, redirect, render_template, session, url_for
+import os
 import sqlite3
-from flask_bcrypt import Bcrypt
 from flask import current_app as app
+from services.hashing import AdmissionLimiter, HasherBusyError, bcrypt_check, bcrypt_hash
 
 auth_bp = Blueprint('auth', __name__)
-bcrypt = Bcrypt()
 
-@auth_bp.before_app_request
-def init_bcrypt():
-    bcrypt.init_app(app)
+# bcrypt runs on the app's hashing processes, not the request thread (see services/hashing.py)
+def hasher():
+    return app.extensions['password_hasher']
+
+AUTH_WINDOW = float(os.getenv('AUTH_WINDOW', '60'))
+ip_limiter = AdmissionLimiter(int(os.getenv('AUTH_IP_LIMIT', '60')), window=AUTH_WINDOW)
+username_limiter = AdmissionLimiter(int(os.getenv('AUTH_EMAIL_LIMIT', '10')), window=AUTH_WINDOW)
+
+def admit(username):
+    return ip_limiter.allow(request.remote_addr or '') and username_limiter.allow(username.lower())
 
 @auth_bp.route('/')
 def home():
@@ -18,7 +25,12 @@ def home():
 def register():
     username = request.form['username']
     password = request.form['password']
-    hashed_pw = bcrypt.generate_password_hash(password).decode('utf-8')
+    if not admit(username):
+        return 'Too many attempts, please wait a minute and try again', 429
+    try:
+        hashed_pw = hasher().run(bcrypt_hash, password, app.config.get('BCRYPT_LOG_ROUNDS', 12))
+    except HasherBusyError:
+        return 'The server is busy, please try again in a moment', 503
 
     conn = sqlite3.connect('db/database.db')
     c = conn.cursor()
@@ -34,6 +46,8 @@ def register():
 def login():
     username = request.form['username']
     password = request.form['password']
+    if not admit(username):
+        return 'Too many attempts, please wait a minute and try again', 429
 
     conn = sqlite3.connect('db/database.db')
     c = conn.cursor()
@@ -41,7 +55,11 @@ def login():
     user = c.fetchone()
     conn.close()
 
-    if user and bcrypt.check_password_hash(user[2], password):
+    try:
+        valid = bool(user) and hasher().run(bcrypt_check, user[2], password)
+    except HasherBusyError:
+        return 'The server is busy, please try again in a moment', 503
+    if valid:
         session['user_id'] = user[0]
         return redirect(url_for('chat.chat'))
     return 'Invalid username or password'
@@ -0,0 +1,176 @@
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+
+def normalize_prompt(text: str) -> str:
+    """
+    Lowercase and collapse whitespace so trivial differences share a key. Punctuation is kept:
+    it tells stacks apart ("C++", "C#" and "C"; ".NET"; "Node.js").
+    """
+    return ' '.join((text or '').lower().split())
+
+
+def cache_key(kind: str, prompt: str) -> str:
+    return hashlib.sha256(f"{kind}\n{normalize_prompt(prompt)}".encode('utf-8')).hexdigest()
+
+
+def cosine_similarity(a, b) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class SQLiteCacheBackend:
+    """Persistent cache tier in a local SQLite file"""
+
+    def __init__(self, path, ttl):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT response, created_at FROM response_cache WHERE key = ?', (key,)
+            ).fetchone()
+        if not row or time.time() - row[1] > self.ttl:
+            return None
+        return row[0]
+
+    def set(self, key, kind, response):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO response_cache (key, kind, response, created_at) VALUES (?, ?, ?, ?)',
+                (key, kind, response, time.time())
+            )
+            self._conn.execute('DELETE FROM response_cache WHERE created_at < ?', (time.time() - self.ttl,))
+            self._conn.commit()
+
+
+class MongoCacheBackend:
+    """Persistent cache tier in a MongoDB collection, expired by a TTL index"""
+
+    def __init__(self, collection, ttl):
+        self.collection = collection
+        self.ttl = ttl
+
+    def ensure_index(self):
+        self.collection.create_index('created_at', expireAfterSeconds=int(self.ttl))
+
+    def get(self, key):
+        # The TTL monitor only runs once a minute, so check age here too
+        fresh = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+        doc = self.collection.find_one({'_id': key, 'created_at': {'$gte': fresh}}, {'response': 1})
+        return doc['response'] if doc else None
+
+    def set(self, key, kind, response):
+        # In UTC, like the clock the TTL index compares it with
+        self.collection.update_one(
+            {'_id': key},
+            {'$set': {'kind': kind, 'response': response, 'created_at': datetime.now(timezone.utc)}},
+            upsert=True
+        )
+
+
+class ResponseCache:
+    """
+    Cache of LLM responses keyed on the normalized prompt.
+    Lookups try the in-memory LRU/TTL tier, then the optional persistent backend, then
+    (when an `embed` function is given) the most similar cached entry of the same kind.
+    """
+
+    def __init__(self, max_entries=512, ttl=86400, backend=None, embed=None, similarity=0.97):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend
+        self.embed = embed
+        self.similarity = similarity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind, prompt, semantic_text=None):
+        key = cache_key(kind, prompt)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry['created_at'] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry['response']
+            if entry:
+                del self._entries[key]
+
+        response = self.backend.get(key) if self.backend else None
+        if response is None and self.embed and semantic_text:
+            response = self._similar(kind, semantic_text, now)
+        with self._lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if response is not None and self.backend:
+            self._remember(key, kind, response, None)
+        return response
+
+    def set(self, kind, prompt, response, semantic_text=None):
+        key = cache_key(kind, prompt)
+        embedding = None
+        if self.embed and semantic_text:
+            embedding = self._embed(semantic_text)
+        self._remember(key, kind, response, embedding)
+        if self.backend:
+            self.backend.set(key, kind, response)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+    def _remember(self, key, kind, response, embedding):
+        with self._lock:
+            self._entries[key] = {
+                'kind': kind,
+                'response': response,
+                'embedding': embedding,
+                'created_at': time.time()
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _embed(self, text):
+        try:
+            return self.embed(normalize_prompt(text))
+        except Exception:
+            return None
+
+    def _similar(self, kind, semantic_text, now):
+        query = self._embed(semantic_text)
+        if not query:
+            return None
+        best, best_score = None, self.similarity
+        with self._lock:
+            for entry in self._entries.values():
+                if entry['kind'] != kind or not entry['embedding'] or now - entry['created_at'] > self.ttl:
+                    continue
+                score = cosine_similarity(query, entry['embedding'])
+                if score >= best_score:
+                    best, best_score = entry['response'], score
+        return best
@@ -0,0 +1,160 @@
+"""
+Cancellation of LLM generations nobody is waiting for any more.
+
+A CancelToken goes with one generation. It is cancelled when the client disconnects, sends a
+newer message to the same chat or asks to stop through /cancel; the LLM client then aborts
+its request to Ollama, which stops generating, and its concurrency slot is freed.
+GenerationRegistry keeps the token of the generation running for each chat.
+"""
+import asyncio
+import logging
+import threading
+
+from services.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+CANCELLED = REGISTRY.counter('llm_cancelled_total', "Generations cancelled before they finished", ['reason'])
+
+
+class GenerationCancelled(Exception):
+    """Raised to the caller of a generation that was cancelled"""
+
+
+class CancelToken:
+    """Cancellation signal for one generation, safe to cancel from any thread"""
+
+    def __init__(self):
+        self.reason = None
+        self._callbacks = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self.reason is not None
+
+    def cancel(self, reason='request'):
+        """Cancel the generation; False if it was cancelled already"""
+        with self._lock:
+            if self.reason is not None:
+                return False
+            self.reason = reason
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        CANCELLED.inc(reason=reason)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.debug("Cancel callback failed: %s", e)
+        return True
+
+    def on_cancel(self, callback):
+        """Call `callback` once cancelled (right away if it already is). Returns a function unregistering it."""
+        with self._lock:
+            if self.reason is None:
+                callback_id = self._next_id
+                self._next_id += 1
+                self._callbacks[callback_id] = callback
+                return lambda: self._forget(callback_id)
+        callback()
+        return lambda: None
+
+    def _forget(self, callback_id):
+        with self._lock:
+            self._callbacks.pop(callback_id, None)
+
+    def check(self):
+        if self.reason is not None:
+            raise GenerationCancelled(self.reason)
+
+
+class GenerationRegistry:
+    """The generation running for each chat; starting a new one cancels the one before it"""
+
+    def __init__(self):
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def start(self, key):
+        token = CancelToken()
+        with self._lock:
+            previous = self._tokens.get(key)
+            self._tokens[key] = token
+        if previous is not None:
+            previous.cancel('superseded')
+        return token
+
+    def finish(self, key, token):
+        with self._lock:
+            if self._tokens.get(key) is token:
+                del self._tokens[key]
+
+    def cancel(self, key, reason='request'):
+        """Cancel the generation running for `key`; False if there is none"""
+        with self._lock:
+            token = self._tokens.pop(key, None)
+        return token is not None and token.cancel(reason)
+
+    def count(self):
+        with self._lock:
+            return len(self._tokens)
+
+
+def collect(chunks):
+    """Merge streamed chunks into the response a non-streamed generation returns"""
+    text, last = [], {}
+    for chunk in chunks:
+        text.append(chunk.get('response', ''))
+        last = chunk
+    return {**last, 'response': ''.join(text)}
+
+
+async def acollect(chunks):
+    text, last = [], {}
+    async for chunk in chunks:
+        text.append(chunk.get('response', ''))
+        last = chunk
+    return {**last, 'response': ''.join(text)}
+
+
+_END = object()
+
+
+async def cancellable(chunks, token):
+    """
+    Yield from the async iterator `chunks`, consumed by a task of its own that is cancelled
+    with `token` (from any thread); the caller then gets GenerationCancelled. Cancelling the
+    task closes the HTTP request and the slot it holds. It is also cancelled if the caller stops early.
+    """
+    token.check()
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    async def pump():
+        async for chunk in chunks:
+            queue.put_nowait(chunk)
+
+    def finished(task):
+        if task.cancelled():
+            queue.put_nowait(GenerationCancelled(token.reason or 'cancelled'))
+        else:
+            queue.put_nowait(task.exception() or _END)
+
+    task = asyncio.create_task(pump())
+    task.add_done_callback(finished)
+    forget = token.on_cancel(lambda: loop.call_soon_threadsafe(task.cancel))
+    try:
+        while True:
+            item = await queue.get()
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        forget()
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
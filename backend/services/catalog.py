@@ -0,0 +1,272 @@
+"""
+Local catalog of project ideas, so common profiles are answered without the LLM.
+
+Each entry is a project (title, 5 problem statements, a fit reason) tagged with the profile
+dimensions of recommender/prompt_templates.py: skill level, language, domain and time
+available. Entries live in `projects.json`; `vectors.npy` holds one row per entry of
+tag features (one column per known profile value) and hashed keyword features, and is
+memory-mapped, so workers share the pages and startup does not read the whole matrix. A
+query scores every entry with one matrix-vector product: the profile fields make up a score
+of 1.0 when all match, the words of the message add at most KEYWORD_WEIGHT to order entries
+that match equally.
+
+No catalog ships with the repository; until one is grown offline with the LLM, one profile
+at a time, every titles request goes to the LLM:
+
+    cd backend && python -m services.catalog grow --limit 50
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import re
+import zlib
+
+from services.context import PROFILE_PATTERNS, TIME_PATTERN
+from services.structured import PROBLEM_COUNT, PROJECT_COUNT, PROJECTS_SCHEMA, parse_projects
+
+try:
+    import numpy as np
+except ImportError:  # the catalog is optional; without NumPy every request goes to the LLM
+    np = None
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('skill_level', 'language', 'domain', 'time_available')
+TIME_BUCKETS = ((14, '1-2 weeks'), (28, '2-4 weeks'), (60, '1-2 months'), (float('inf'), '2+ months'))
+TIME_UNITS = {'day': 1, 'week': 7, 'month': 30}
+TIME_WORDS = {'a': 1, 'an': 1, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'a couple of': 2}
+
+# One column per value of each profile field; values outside these (hand-edited entries)
+# are hashed into the remaining TAG_DIM columns, so they never share one with a known value
+TAG_VALUES = {
+    **{field: [value for value, _ in options] for field, options in PROFILE_PATTERNS.items()},
+    'time_available': [bucket for _, bucket in TIME_BUCKETS],
+}
+TAG_COLUMNS = {(field, value.lower()): column for column, (field, value) in
+               enumerate((field, value) for field in FIELDS for value in TAG_VALUES[field])}
+TAG_DIM = 64
+WORD_DIM = 1536
+KEYWORD_WEIGHT = 0.01
+STOPWORDS = {'and', 'for', 'the', 'with', 'from', 'that', 'this', 'into', 'using', 'based', 'want', 'project',
+             'projects', 'ideas', 'idea', 'need', 'some', 'have', 'week', 'weeks', 'month', 'months', 'days'}
+
+
+def time_bucket(text):
+    """Map a time like '3 weeks' or 'a month' onto the time options of the prompt templates"""
+    if not text:
+        return None
+    if any(text == bucket for _, bucket in TIME_BUCKETS):
+        return text
+    match = TIME_PATTERN.search(text)
+    if not match:
+        return None
+    amount, unit = match.group(1).lower(), match.group(2).lower()
+    numbers = re.findall(r'\d+', amount)
+    count = int(numbers[-1]) if numbers else TIME_WORDS.get(amount, 1)
+    days = count * TIME_UNITS[unit]
+    return next(bucket for limit, bucket in TIME_BUCKETS if days <= limit)
+
+
+def profile_tags(profile):
+    """The catalog tags ({field: value}) of a ConversationContext profile"""
+    tags = {field: profile[field] for field in FIELDS if profile.get(field) and field != 'time_available'}
+    bucket = time_bucket(profile.get('time_available'))
+    if bucket:
+        tags['time_available'] = bucket
+    return tags
+
+
+def keywords(text):
+    return {word for word in re.findall(r'[a-z0-9+#]{3,}', (text or '').lower()) if word not in STOPWORDS}
+
+
+def tag_index(field, value):
+    column = TAG_COLUMNS.get((field, value.lower()))
+    if column is not None:
+        return column
+    return len(TAG_COLUMNS) + zlib.crc32(f"{field}={value.lower()}".encode()) % (TAG_DIM - len(TAG_COLUMNS))
+
+
+def word_index(word):
+    return TAG_DIM + zlib.crc32(word.encode()) % WORD_DIM
+
+
+def entry_vector(entry):
+    """Binary features of an entry: every tag value it is suited to and the words of its text"""
+    vector = np.zeros(TAG_DIM + WORD_DIM, dtype=np.float32)
+    for field, values in entry['tags'].items():
+        for value in values:
+            vector[tag_index(field, value)] = 1
+    for word in keywords(' '.join([entry['title'], entry['reason']] + entry['problems'])):
+        vector[word_index(word)] = 1
+    return vector
+
+
+def query_vector(tags, text=''):
+    vector = np.zeros(TAG_DIM + WORD_DIM, dtype=np.float32)
+    for field, value in tags.items():
+        vector[tag_index(field, value)] += 1 / len(FIELDS)
+    words = keywords(text)
+    for word in words:
+        vector[word_index(word)] += KEYWORD_WEIGHT / len(words)
+    return vector
+
+
+class ProjectCatalog:
+    def __init__(self, entries=None, vectors=None, path=None):
+        self.entries = entries or []
+        self.vectors = vectors if vectors is not None else np.zeros((0, TAG_DIM + WORD_DIM), dtype=np.float32)
+        self.path = path
+
+    @classmethod
+    def load(cls, path):
+        """
+        Open the catalog in directory `path` (an empty one if it has no projects.json).
+        The vectors are rebuilt if they are missing or older than the entries.
+        """
+        if np is None:
+            raise RuntimeError("NumPy is required for the project catalog")
+        entries_path = os.path.join(path, 'projects.json')
+        vectors_path = os.path.join(path, 'vectors.npy')
+        if not os.path.exists(entries_path):
+            return cls(path=path)
+        with open(entries_path, encoding='utf-8') as f:
+            entries = json.load(f)
+        if not os.path.exists(vectors_path) or os.path.getmtime(vectors_path) < os.path.getmtime(entries_path):
+            cls(entries, path=path).save()
+        vectors = np.load(vectors_path, mmap_mode='r')
+        if vectors.shape != (len(entries), TAG_DIM + WORD_DIM):
+            cls(entries, path=path).save()
+            vectors = np.load(vectors_path, mmap_mode='r')
+        return cls(entries, vectors, path)
+
+    def save(self, path=None):
+        """Write projects.json and vectors.npy, replacing the old files only once both are written"""
+        path = path or self.path
+        os.makedirs(path, exist_ok=True)
+        vectors = np.stack([entry_vector(e) for e in self.entries]) if self.entries else self.vectors[:0]
+        # Several workers may rebuild a stale index at startup at once
+        entries_tmp = os.path.join(path, f'projects.{os.getpid()}.json.tmp')
+        vectors_tmp = os.path.join(path, f'vectors.{os.getpid()}.tmp.npy')
+        with open(entries_tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=1)
+        np.save(vectors_tmp, vectors)
+        os.replace(entries_tmp, os.path.join(path, 'projects.json'))
+        os.replace(vectors_tmp, os.path.join(path, 'vectors.npy'))
+        self.vectors = vectors
+
+    def __len__(self):
+        return len(self.entries)
+
+    def search(self, tags, text='', k=PROJECT_COUNT, exclude=()):
+        """The `k` best entries for a profile as [(score, entry)], best first"""
+        if not self.entries:
+            return []
+        scores = self.vectors @ query_vector(tags, text)
+        skip = {title.lower() for title in exclude}
+        top = min(len(scores), k + len(skip))
+        best = np.argpartition(-scores, top - 1)[:top]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        results = [(float(scores[i]), self.entries[i]) for i in best if self.entries[i]['title'].lower() not in skip]
+        return results[:k]
+
+    def recommend(self, profile, text='', min_score=1.0, exclude=()):
+        """
+        PROJECT_COUNT projects for a complete profile, or None when the profile is incomplete or
+        too few entries score `min_score` (1.0 = every profile field matches).
+        """
+        tags = profile_tags(profile)
+        if len(tags) < len(FIELDS):
+            return None
+        results = self.search(tags, text, PROJECT_COUNT, exclude)
+        if len(results) < PROJECT_COUNT or results[-1][0] < min_score - 1e-6:
+            return None
+        return [{key: entry[key] for key in ('title', 'problems', 'reason')} for _, entry in results]
+
+    def add(self, project, tags):
+        """Add a project suited to `tags`, or widen the tags of the entry that has its title"""
+        for entry in self.entries:
+            if entry['title'].lower() == project['title'].lower():
+                for field, value in tags.items():
+                    if value not in entry['tags'].setdefault(field, []):
+                        entry['tags'][field].append(value)
+                return False
+        self.entries.append({**project, 'tags': {field: [value] for field, value in tags.items()}})
+        return True
+
+    def covers(self, tags, min_score=1.0):
+        results = self.search(tags, k=PROJECT_COUNT)
+        return len(results) == PROJECT_COUNT and results[-1][0] >= min_score - 1e-6
+
+
+GROW_PROMPT = """You are an AI Project Recommender.
+
+Suggest EXACTLY {count} distinct projects for a {skill_level} developer who wants to use {language}
+in {domain} and has {time_available} available.
+
+Reply with a single JSON object with the keys "question" (set to "") and "projects", each project with:
+  "title": a concise project title, without numbering,
+  "problems": EXACTLY {problems} distinct problem statements for that project, 1-2 sentences each,
+  "reason": 1-2 sentences on why the project suits this profile.
+"""
+
+# The answer options of recommender/prompt_templates.py, for enumerating profiles to grow
+GROW_OPTIONS = {**TAG_VALUES, 'language': ['Python', 'JavaScript', 'Java', 'C++']}
+
+
+def grow(catalog, llm_client, limit=None, timeout=300):
+    """
+    Ask the LLM for projects for each profile the catalog cannot answer yet, saving after
+    every profile. Returns the number of new entries.
+    """
+    added = generated = 0
+    for values in itertools.product(*(GROW_OPTIONS[field] for field in FIELDS)):
+        tags = dict(zip(FIELDS, values))
+        if catalog.covers(tags):
+            continue
+        if limit is not None and generated >= limit:
+            break
+        prompt = GROW_PROMPT.format(count=PROJECT_COUNT, problems=PROBLEM_COUNT, **tags)
+        generated += 1
+        try:
+            data = parse_projects(llm_client.generate(prompt, timeout=timeout, format=PROJECTS_SCHEMA).get('response', ''))
+        except Exception as e:
+            logger.warning("Generating projects for %s failed: %s", tags, e)
+            continue
+        projects = [p for p in (data or {}).get('projects', []) if len(p['problems']) == PROBLEM_COUNT and p['reason']]
+        new = sum(catalog.add(project, tags) for project in projects)
+        added += new
+        catalog.save()
+        logger.info("%s: %d projects, %d new (catalog has %d)", tags, len(projects), new, len(catalog))
+    return added
+
+
+def main():
+    from services.llm import LLMClient
+
+    parser = argparse.ArgumentParser(description="Grow the project catalog with the LLM")
+    parser.add_argument('command', choices=['grow', 'reindex', 'stats'])
+    parser.add_argument('--path', default=os.getenv('CATALOG_PATH', 'db/catalog'))
+    parser.add_argument('--ollama-url', default=os.getenv('OLLAMA_URL', 'http://localhost:11434/api/generate'))
+    parser.add_argument('--model', default=os.getenv('OLLAMA_MODEL', 'llama3'))
+    parser.add_argument('--limit', type=int, help="generate for at most this many profiles")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    catalog = ProjectCatalog.load(args.path)
+    if args.command == 'grow':
+        added = grow(catalog, LLMClient(args.ollama_url, model=args.model, max_queue=0), limit=args.limit)
+        print(f"Added {added} projects, catalog has {len(catalog)}")
+    elif args.command == 'reindex':
+        catalog.save()
+        print(f"Rebuilt vectors for {len(catalog)} projects")
+    else:
+        profiles = list(itertools.product(*(GROW_OPTIONS[field] for field in FIELDS)))
+        covered = sum(catalog.covers(dict(zip(FIELDS, values))) for values in profiles)
+        print(f"{len(catalog)} projects, {covered} of {len(profiles)} profiles covered")
+
+
+if __name__ == '__main__':
+    main()
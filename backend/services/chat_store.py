@@ -0,0 +1,267 @@
+import base64
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from services.search import SEARCH_FIELDS
+
+DUPLICATE_KEY = 11000
+
+
+def encode_cursor(chat):
+    """Opaque history cursor pointing just past `chat` in (updated_at, _id) descending order"""
+    raw = f"{chat['updated_at'].isoformat()}|{chat['_id']}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for malformed cursors"""
+    try:
+        updated_at, chat_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        return datetime.fromisoformat(updated_at), ObjectId(chat_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+class ChatStore:
+    """
+    Chat persistence with one document per message.
+    Chat documents only hold metadata and a `message_count`; each turn appends a single
+    document to the messages collection keyed by (chat_id, seq), so the cost of a turn
+    does not grow with the length of the chat.
+    """
+
+    def __init__(self, chats, messages):
+        self.chats = chats
+        self.messages = messages
+        # Set once every old-format chat has a message_count (services.indexes.backfill_message_counts);
+        # until then list_chats also lists chats without one
+        self.counts_backfilled = False
+
+    def append_message(self, chat_id, email, entry, create=False):
+        """
+        Append one message to a chat. Returns its sequence number, or None if the chat does not
+        exist. With `create` a missing chat is created by the message (unless the id is another user's).
+        """
+        try:
+            chat = self._reserve(chat_id, email, create)
+        except DuplicateKeyError:
+            return None
+        if not chat:
+            return None
+        seq = chat['message_count'] - 1
+        self.messages.insert_one(self._message_doc(chat['_id'], email, seq, entry))
+        return seq
+
+    def _reserve(self, chat_id, email, create, count=1):
+        """
+        Reserve the next `count` message numbers of a chat with an atomic $inc, returning the
+        updated chat. An old-format chat is migrated first and the numbers reserved again,
+        as its message_count only becomes reliable once it is migrated.
+        """
+        update = dict(
+            projection={'message_count': 1, 'messages': 1, 'email': 1},
+            return_document=ReturnDocument.AFTER,
+            upsert=create
+        )
+        query = {'_id': ObjectId(chat_id), 'email': email}
+        chat = self.chats.find_one_and_update(query, self._append_update(create, count), **update)
+        if chat and 'messages' in chat:
+            self._migrate_legacy(chat)
+            chat = self.chats.find_one_and_update(query, self._append_update(create, count), **update)
+        return chat
+
+    def flush(self, chat_id=None, email=None):
+        """Nothing to do: writes go straight to MongoDB (see WriteBehindChatStore)"""
+        return 0
+
+    def get_chat(self, chat_id, email):
+        """Fetch a chat's metadata (not its messages), migrating old-format chats on the way"""
+        query = {'_id': ObjectId(chat_id), 'email': email}
+        projection = {'email': 1, 'chat_name': 1, 'message_count': 1, 'messages': 1, 'created_at': 1, 'updated_at': 1}
+        chat = self.chats.find_one(query, projection)
+        if chat and 'messages' in chat:
+            self._migrate_legacy(chat)
+            chat = self.chats.find_one(query, projection)
+        return chat
+
+    def set_prefetched(self, chat_id, email, key, text):
+        """Store a speculatively generated reply on the chat under `key`"""
+        self.chats.update_one(
+            {'_id': ObjectId(chat_id), 'email': email},
+            {'$set': {f'prefetched.{key}': text}}
+        )
+
+    def get_prefetched(self, chat_id, email, key):
+        chat = self.chats.find_one({'_id': ObjectId(chat_id), 'email': email}, {f'prefetched.{key}': 1})
+        return ((chat or {}).get('prefetched') or {}).get(key)
+
+    def clear_prefetched(self, chat_id, email):
+        self.chats.update_one({'_id': ObjectId(chat_id), 'email': email}, {'$unset': {'prefetched': ''}})
+
+    def list_chats(self, email, limit=30, cursor=None):
+        """One page of a user's chats, most recently updated first. Returns (chats, next_cursor)."""
+        # Chats without messages are left out, and expire (see services/indexes.py)
+        query = {'email': email, 'message_count': {'$gt': 0}}
+        if not self.counts_backfilled:
+            # Old-format chats have no message_count until the backfill has run
+            query['message_count'] = {'$not': {'$lte': 0}}
+        if cursor:
+            updated_at, last_id = decode_cursor(cursor)
+            query['$or'] = [
+                {'updated_at': {'$lt': updated_at}},
+                {'updated_at': updated_at, '_id': {'$lt': last_id}}
+            ]
+        chats = list(self.chats.find(
+            query,
+            {'_id': 1, 'chat_name': 1, 'created_at': 1, 'updated_at': 1}
+        ).sort([('updated_at', -1), ('_id', -1)]).limit(limit + 1))
+        next_cursor = encode_cursor(chats[limit - 1]) if len(chats) > limit else None
+        return chats[:limit], next_cursor
+
+    def search_messages(self, email, query, limit=20):
+        """
+        A user's messages matching a text search, best first, with their 'score'. Returns
+        (messages, chat names by chat id); empty chats have no messages, so none are found.
+        """
+        projection = {'_id': 0, 'chat_id': 1, 'seq': 1, 'score': {'$meta': 'textScore'},
+                      **{field: 1 for field in SEARCH_FIELDS}}
+        messages = list(self.messages.find(
+            {'email': email, '$text': {'$search': query}}, projection
+        ).sort([('score', {'$meta': 'textScore'})]).limit(limit))
+        chat_ids = list({message['chat_id'] for message in messages})
+        chats = self.chats.find({'_id': {'$in': chat_ids}, 'email': email}, {'chat_name': 1}) if chat_ids else []
+        return messages, {str(chat['_id']): chat['chat_name'] for chat in chats}
+
+    def get_messages(self, chat_id, email, start=0, limit=0, fields=None):
+        """
+        Read messages in sequence order from `start`; a `limit` of 0 reads to the end.
+        `fields` restricts the returned keys (seq is always included).
+        """
+        if fields:
+            projection = {'_id': 0, 'seq': 1, **{field: 1 for field in fields}}
+        else:
+            projection = {'_id': 0, 'chat_id': 0, 'email': 0, 'created_at': 0}
+        cursor = self.messages.find(
+            {'chat_id': ObjectId(chat_id), 'email': email, 'seq': {'$gte': start}},
+            projection
+        ).sort('seq', 1)
+        if limit:
+            cursor = cursor.limit(limit)
+        return list(cursor)
+
+    def delete_chat(self, chat_id, email):
+        """Delete a chat and its messages. Returns False if no such chat exists."""
+        result = self.chats.delete_one({'_id': ObjectId(chat_id), 'email': email})
+        if result.deleted_count == 0:
+            return False
+        self.messages.delete_many({'chat_id': ObjectId(chat_id), 'email': email})
+        return True
+
+    def _append_update(self, create, count=1):
+        # UTC, as the empty_chat_ttl index on created_at compares it with the server's UTC clock
+        now = datetime.now(timezone.utc)
+        update = {'$inc': {'message_count': count}, '$set': {'updated_at': now}}
+        if create:
+            update['$setOnInsert'] = {'chat_name': 'New Chat', 'created_at': now}
+        return update
+
+    def _message_doc(self, chat_oid, email, seq, entry):
+        doc = dict(entry)
+        doc.pop('_id', None)
+        doc.update({'chat_id': chat_oid, 'email': email, 'seq': seq, 'created_at': datetime.now(timezone.utc)})
+        return doc
+
+    def _migrate_legacy(self, chat):
+        """
+        Move a chat's embedded `messages` array (the old storage format) into the messages
+        collection. Requests racing to migrate the same chat insert the same rows, so rows
+        already inserted are skipped; only the request that removes the array sets message_count.
+        """
+        legacy = chat.get('messages') or []
+        if legacy:
+            try:
+                self.messages.insert_many([
+                    self._message_doc(chat['_id'], chat['email'], seq, entry) for seq, entry in enumerate(legacy)
+                ], ordered=False)
+            except BulkWriteError as e:
+                if not only_duplicates(e):
+                    raise
+        self.chats.update_one(
+            {'_id': chat['_id'], 'messages': {'$exists': True}},
+            {'$unset': {'messages': ''}, '$set': {'message_count': len(legacy)}}
+        )
+
+
+class AsyncChatStore(ChatStore):
+    """ChatStore for the async serving mode; takes collections from pymongo's AsyncMongoClient"""
+
+    async def append_message(self, chat_id, email, entry, create=False):
+        try:
+            chat = await self._reserve(chat_id, email, create)
+        except DuplicateKeyError:
+            return None
+        if not chat:
+            return None
+        seq = chat['message_count'] - 1
+        await self.messages.insert_one(self._message_doc(chat['_id'], email, seq, entry))
+        return seq
+
+    async def _reserve(self, chat_id, email, create, count=1):
+        update = dict(
+            projection={'message_count': 1, 'messages': 1, 'email': 1},
+            return_document=ReturnDocument.AFTER,
+            upsert=create
+        )
+        query = {'_id': ObjectId(chat_id), 'email': email}
+        chat = await self.chats.find_one_and_update(query, self._append_update(create, count), **update)
+        if chat and 'messages' in chat:
+            await self._migrate_legacy(chat)
+            chat = await self.chats.find_one_and_update(query, self._append_update(create, count), **update)
+        return chat
+
+    async def get_chat(self, chat_id, email):
+        query = {'_id': ObjectId(chat_id), 'email': email}
+        projection = {'email': 1, 'chat_name': 1, 'message_count': 1, 'messages': 1, 'created_at': 1, 'updated_at': 1}
+        chat = await self.chats.find_one(query, projection)
+        if chat and 'messages' in chat:
+            await self._migrate_legacy(chat)
+            chat = await self.chats.find_one(query, projection)
+        return chat
+
+    async def get_messages(self, chat_id, email, start=0, limit=0, fields=None):
+        if fields:
+            projection = {'_id': 0, 'seq': 1, **{field: 1 for field in fields}}
+        else:
+            projection = {'_id': 0, 'chat_id': 0, 'email': 0, 'created_at': 0}
+        cursor = self.messages.find(
+            {'chat_id': ObjectId(chat_id), 'email': email, 'seq': {'$gte': start}},
+            projection
+        ).sort('seq', 1)
+        if limit:
+            cursor = cursor.limit(limit)
+        return await cursor.to_list(length=None)
+
+    async def _migrate_legacy(self, chat):
+        legacy = chat.get('messages') or []
+        if legacy:
+            try:
+                await self.messages.insert_many([
+                    self._message_doc(chat['_id'], chat['email'], seq, entry) for seq, entry in enumerate(legacy)
+                ], ordered=False)
+            except BulkWriteError as e:
+                if not only_duplicates(e):
+                    raise
+        await self.chats.update_one(
+            {'_id': chat['_id'], 'messages': {'$exists': True}},
+            {'$unset': {'messages': ''}, '$set': {'message_count': len(legacy)}}
+        )
+
+
+def only_duplicates(error):
+    """True if a BulkWriteError only failed on documents that already exist"""
+    details = error.details
+    return (not details.get('writeConcernErrors')
+            and all(e.get('code') == DUPLICATE_KEY for e in details.get('writeErrors', [])))
@@ -0,0 +1,127 @@
+import re
+from collections import deque
+
+# Profile dimensions the recommender asks about (see recommender/prompt_templates.py)
+PROFILE_PATTERNS = {
+    'skill_level': [
+        ('beginner', r'\b(beginner|newbie|novice|just starting|new to)\b'),
+        ('intermediate', r'\b(intermediate|some experience)\b'),
+        ('highly skilled', r'\b(advanced|expert|highly skilled|experienced|senior)\b'),
+    ],
+    'language': [
+        ('Python', r'\bpython\b'),
+        ('JavaScript', r'\b(javascript|js|node(\.js)?|react|typescript)\b'),
+        ('Java', r'\bjava\b'),
+        ('C++', r'(\bc\+\+|\bcpp\b)'),
+        ('Go', r'\bgolang\b'),
+        ('Rust', r'\brust\b'),
+    ],
+    'domain': [
+        ('Machine Learning', r'\b(machine learning|ml)\b'),
+        ('Deep Learning', r'\b(deep learning|dl|neural networks?)\b'),
+        ('NLP', r'\b(nlp|natural language processing)\b'),
+        ('Computer Vision', r'\b(computer vision|cv|image|images|vision)\b'),
+        ('Generative AI', r'\b(generative ai|genai|llms?)\b'),
+        ('IoT', r'\b(iot|internet of things|embedded)\b'),
+        ('Blockchain', r'\b(blockchain|web3|crypto)\b'),
+        ('Data Science', r'\b(data science|data analysis|analytics)\b'),
+        ('Web', r'\b(web|website|web app)\b'),
+        ('Mobile', r'\b(mobile|android|ios)\b'),
+    ],
+}
+TIME_PATTERN = re.compile(
+    r'\b(\d+\s*(?:-|to)\s*\d+|\d+|one|two|three|four|a|an|a couple of)\s*(day|week|month)s?\b', re.I
+)
+PROFILE_LABELS = {
+    'skill_level': 'Skill level',
+    'language': 'Language',
+    'domain': 'Domain',
+    'time_available': 'Time available',
+}
+
+
+def extract_profile(text: str) -> dict:
+    """Pick out the profile fields a message mentions, e.g. {'skill_level': 'beginner', 'language': 'Python'}"""
+    text = text or ''
+    low = text.lower()
+    profile = {}
+    for field, options in PROFILE_PATTERNS.items():
+        for value, pattern in options:
+            if re.search(pattern, low):
+                profile[field] = value
+                break
+    match = TIME_PATTERN.search(text)
+    if match:
+        profile['time_available'] = match.group(0).strip()
+    return profile
+
+
+def render_turn(msg: dict, reply_limit: int = 300) -> str:
+    bot_reply = msg.get('bot_reply', '')
+    if len(bot_reply) > reply_limit:
+        bot_reply = bot_reply[:reply_limit] + "..."
+    return f"User: {msg.get('user_message', '')}\nAssistant: {bot_reply}\n"
+
+
+class ConversationContext:
+    """
+    Prompt context for one chat, updated one message at a time.
+    Keeps only the last `window` turns verbatim; what older turns said about the user's
+    skill, language, domain and time is kept as a compact profile instead.
+    """
+
+    def __init__(self, window=4, turns=None, profile=None, rendered=None, llm_session=None):
+        self.window = window
+        self.turns = deque(turns or [], maxlen=window)
+        self.profile = dict(profile or {})
+        self._rendered = rendered
+        # Ollama's KV `context` tokens for this chat, reused by the next generation
+        self.llm_session = dict(llm_session or {})
+
+    @classmethod
+    def from_history(cls, conversation_history, window=4):
+        context = cls(window=window)
+        for msg in conversation_history:
+            context.add(msg)
+        return context
+
+    @classmethod
+    def from_dict(cls, data, window=4):
+        turns = data.get('turns', [])
+        # The cached rendering is only valid if it was made with the same window
+        rendered = data.get('rendered') if len(turns) <= window else None
+        return cls(window=window, turns=turns[-window:], profile=data.get('profile'), rendered=rendered,
+                   llm_session=data.get('llm_session'))
+
+    def to_dict(self):
+        return {
+            'turns': list(self.turns),
+            'profile': self.profile,
+            'rendered': self.render(),
+            'llm_session': self.llm_session
+        }
+
+    def add(self, msg: dict):
+        """Account for one new history entry"""
+        self.profile.update(extract_profile(msg.get('user_message', '')))
+        self.turns.append(render_turn(msg))
+        self._rendered = None
+
+    def render(self) -> str:
+        if self._rendered is None:
+            self._rendered = self._render()
+        return self._rendered
+
+    def _render(self) -> str:
+        if not self.turns and not self.profile:
+            return ""
+        context = ""
+        if self.profile:
+            context += "\n--- Known User Profile ---\n"
+            for field, label in PROFILE_LABELS.items():
+                if field in self.profile:
+                    context += f"{label}: {self.profile[field]}\n"
+        context += "\n--- Conversation History ---\n"
+        context += ''.join(self.turns)
+        context += "--- End History ---\n\n"
+        return context
@@ -0,0 +1,149 @@
+"""
+Password hashing off the request threads.
+
+Password hashes are deliberately CPU-heavy; computed inline they hold the GIL and stall
+every other request in the process during a login storm. PasswordHasher runs them in a
+small process pool instead, and turns callers away once `max_queue` are already waiting.
+AdmissionLimiter caps login and signup attempts per client IP and per email.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HasherBusyError(Exception):
+    """Raised when too many password hashes are already queued"""
+
+
+def bcrypt_hash(password, rounds=12):
+    import bcrypt
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def bcrypt_check(hashed, password):
+    import bcrypt
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    except ValueError:
+        return False
+
+
+def werkzeug_check(hashed, password):
+    # An empty or malformed stored hash fails verification instead of raising
+    return bool(hashed) and check_password_hash(hashed, password)
+
+
+class PasswordHasher:
+    """
+    Runs hash functions on `workers` processes once `start()` has been called in the serving
+    process; before that, or with `workers=0`, they run inline, for tests and single-user
+    setups. Callers beyond `max_queue` waiting for a worker get HasherBusyError right away,
+    and each call waits at most `timeout` seconds.
+    """
+
+    def __init__(self, workers=2, max_queue=32, timeout=10):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def start(self):
+        """Start the pool for this process; a pool inherited across a fork is left to its parent"""
+        with self._lock:
+            if self.workers and self._pid != os.getpid():
+                # spawn rather than fork: the app process holds MongoDB and HTTP pool threads
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+                self._pid = os.getpid()
+
+    def run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                self._rejected += 1
+                raise HasherBusyError("Password hashing queue is full")
+            self._pending += 1
+            executor = self._executor if self._pid == os.getpid() else None
+        if executor is None:
+            try:
+                return fn(*args)
+            finally:
+                self._done()
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException:
+            self._done()
+            raise
+        # A hash stays pending until its future is done, even once its caller gave up on it,
+        # so the processes never hold more than `workers + max_queue` of them
+        future.add_done_callback(self._done)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # Not the builtin TimeoutError before Python 3.11. A hash still queued is
+            # dropped; one already handed to a process runs to completion.
+            future.cancel()
+            raise HasherBusyError("Timed out waiting for a password hash")
+
+    def _done(self, future=None):
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
+
+    def hash(self, password):
+        return self.run(generate_password_hash, password)
+
+    def verify(self, hashed, password):
+        return self.run(werkzeug_check, hashed, password)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'pending': self._pending,
+                'max_queue': self.max_queue,
+                'completed': self._completed,
+                'rejected': self._rejected,
+            }
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class AdmissionLimiter:
+    """Sliding-window limit of `limit` attempts per key every `window` seconds, for up to `max_keys` keys"""
+
+    def __init__(self, limit, window=60, max_keys=10000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._attempts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        """Record an attempt for `key`; False if it is over the limit (a limit of 0 admits everything)"""
+        if not self.limit:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._attempts.pop(key, None) or deque()
+            while attempts and now - attempts[0] > self.window:
+                attempts.popleft()
+            allowed = len(attempts) < self.limit
+            if allowed:
+                attempts.append(now)
+            self._attempts[key] = attempts
+            while len(self._attempts) > self.max_keys:
+                self._attempts.popitem(last=False)
+            return allowed
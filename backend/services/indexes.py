@@ -0,0 +1,143 @@
+"""
+MongoDB index management for the chat app.
+
+Run `python -m services.indexes` from the backend directory to create the indexes and
+explain the hot queries; it exits non-zero if any of them still scans a whole collection.
+"""
+import logging
+import os
+import sys
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel, MongoClient
+from pymongo.errors import OperationFailure
+
+from services.search import SEARCH_FIELDS
+
+logger = logging.getLogger(__name__)
+
+# Chats that never got a message are deleted this many seconds after they were created
+EMPTY_CHAT_TTL = int(os.getenv('EMPTY_CHAT_TTL', '86400'))
+# Chat history only lists chats with messages
+NONEMPTY = {'message_count': {'$gt': 0}}
+
+INDEXES = {
+    'users': [
+        IndexModel([('email', ASCENDING)], unique=True, name='email_unique'),
+    ],
+    'chats': [
+        IndexModel([('email', ASCENDING), ('updated_at', DESCENDING), ('_id', DESCENDING)],
+                   partialFilterExpression=NONEMPTY, name='email_updated_at_id_nonempty'),
+        IndexModel([('created_at', ASCENDING)], expireAfterSeconds=EMPTY_CHAT_TTL,
+                   partialFilterExpression={'message_count': 0}, name='empty_chat_ttl'),
+        IndexModel([('_id', ASCENDING), ('email', ASCENDING)], name='id_email'),
+    ],
+    'messages': [
+        IndexModel([('chat_id', ASCENDING), ('seq', ASCENDING)], unique=True, name='chat_seq'),
+        # Chat search; the email prefix keeps each search to one user's messages
+        IndexModel([('email', ASCENDING)] + [(field, TEXT) for field in SEARCH_FIELDS],
+                   weights=SEARCH_FIELDS, name='email_message_text'),
+    ],
+}
+
+
+# Indexes superseded by the ones above, dropped once those exist
+RETIRED = {
+    'chats': ['email_updated_at_id'],
+}
+
+
+def backfill_message_counts(db):
+    """
+    Give chats of the old embedded-messages format a message_count, which the partial indexes
+    filter on. Returns True if every old-format chat has one now; failures are logged.
+    """
+    try:
+        result = db['chats'].update_many(
+            {'message_count': {'$exists': False}},
+            [{'$set': {'message_count': {'$size': {'$ifNull': ['$messages', []]}}}}]
+        )
+    except OperationFailure as e:
+        logger.error("Could not backfill chat message counts: %s", e)
+        return False
+    if result.modified_count:
+        logger.info("Counted the messages of %d old-format chats", result.modified_count)
+    return True
+
+
+def ensure_indexes(db):
+    """
+    Create any missing indexes. Failures (e.g. duplicate emails blocking a unique index) are
+    logged. Returns True if every old-format chat has a message_count now.
+    """
+    counted = backfill_message_counts(db)
+    for collection, models in INDEXES.items():
+        try:
+            db[collection].create_indexes(models)
+            existing = db[collection].index_information()
+            for name in RETIRED.get(collection, []):
+                if name in existing:
+                    db[collection].drop_index(name)
+        except OperationFailure as e:
+            logger.error("Could not create indexes on %s: %s", collection, e)
+    return counted
+
+
+def hot_queries(email, chat_id):
+    """The queries on the request path, as (name, cursor factory) pairs taking the db"""
+    chat_oid = ObjectId(chat_id)
+    return [
+        ('login/signup user lookup',
+         lambda db: db['users'].find({'email': email}).limit(1)),
+        ('chat history list',
+         lambda db: db['chats'].find({'email': email, **NONEMPTY},
+                                     {'_id': 1, 'chat_name': 1, 'created_at': 1, 'updated_at': 1})
+                               .sort([('updated_at', -1), ('_id', -1)]).limit(31)),
+        ('chat lookup by id and owner',
+         lambda db: db['chats'].find({'_id': chat_oid, 'email': email}).limit(1)),
+        ('chat messages page',
+         lambda db: db['messages'].find({'chat_id': chat_oid, 'email': email, 'seq': {'$gte': 0}})
+                                  .sort('seq', 1).limit(30)),
+        ('chat search',
+         lambda db: db['messages'].find({'email': email, '$text': {'$search': 'python project'}}).limit(20)),
+    ]
+
+
+def plan_stages(plan):
+    """Flatten an explain() plan tree into its stage names"""
+    stages = [plan.get('stage')]
+    for child in [plan.get('inputStage')] + plan.get('inputStages', []):
+        if child:
+            stages.extend(plan_stages(child))
+    return [s for s in stages if s]
+
+
+def explain_hot_queries(db, email='someone@example.com', chat_id=None):
+    """Explain each hot query. Returns a list of dicts with the winning plan's stages and any problems."""
+    report = []
+    for name, query in hot_queries(email, chat_id or str(ObjectId())):
+        winning_plan = query(db).explain()['queryPlanner']['winningPlan']
+        # Sharded / SBE explain output nests the classic plan one level down
+        stages = plan_stages(winning_plan.get('queryPlan', winning_plan))
+        problems = []
+        if 'COLLSCAN' in stages:
+            problems.append('collection scan')
+        if 'SORT' in stages:
+            problems.append('in-memory sort')
+        report.append({'query': name, 'stages': stages, 'problems': problems})
+    return report
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    db = MongoClient(os.getenv('MONGO_URI', 'mongodb://localhost:27017/'))['ai_project_recommender']
+    ensure_indexes(db)
+    report = explain_hot_queries(db)
+    for row in report:
+        status = ', '.join(row['problems']) or 'ok'
+        print(f"{row['query']:<32} {' <- '.join(row['stages']):<48} {status}")
+    return 1 if any('collection scan' in row['problems'] for row in report) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
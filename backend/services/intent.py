@@ -0,0 +1,287 @@
+"""
+Local intent classifier answering simple turns without the LLM.
+
+A message is sorted into one of INTENTS by a linear (softmax) model over hashed word, word
+pair and character trigram features. Greetings get the canned greeting, off-topic messages
+the fixed refusal the prompts ask the LLM for, and selections like "the second one" are
+resolved with normalize_choice; everything else ('project') goes to the LLM as before.
+The model is trained offline from templated examples, plus any labelled messages given
+(e.g. a shadow log of real turns), and saved as one small JSON file:
+
+    cd backend && python -m services.intent train --examples shadow.jsonl
+    cd backend && python -m services.intent predict "the second one"
+
+It only needs the standard library, so loading it takes a few milliseconds.
+"""
+import argparse
+import base64
+import itertools
+import json
+import math
+import os
+import random
+import re
+import sys
+import zlib
+from array import array
+
+from services.context import TIME_PATTERN
+
+INTENTS = ('project', 'greeting', 'off_topic', 'select')
+DIM = 1 << 14
+OFF_TOPIC_REPLY = "I only provide project recommendations. Please ask something related to project ideas."
+
+NUMBERS = {'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10}
+ORDINALS = {'first': 1, 'second': 2, 'third': 3, 'fourth': 4, 'fifth': 5, 'sixth': 6, 'seventh': 7, 'eighth': 8,
+            'ninth': 9, 'tenth': 10, '1st': 1, '2nd': 2, '3rd': 3, '4th': 4, '5th': 5, '6th': 6, '7th': 7, '8th': 8,
+            '9th': 9, '10th': 10}
+LAST_WORDS = {'last', 'final'}
+# "one" is a number only after these ("option one"), not a pronoun ("the second one", "another one")
+ONE_CUES = {None, 'number', 'option', 'project', 'idea', 'pick', 'choose', 'take', 'with'}
+
+
+def words(text):
+    return re.findall(r"[a-z0-9#+']+", (text or '').lower())
+
+
+def normalize_choice(text, count=None):
+    """
+    The 0-based item a selection like "2", "#2", "the second one", "option two" or "the last one"
+    refers to, or None if the message names no single item. Numbers that are part of a
+    time ("2 weeks") do not count; "last" needs the number of items, `count`.
+    """
+    tokens = words(TIME_PATTERN.sub(' ', text or ''))
+    choices = set()
+    for previous, word in zip([None] + tokens, tokens):
+        word = word.lstrip('#')
+        if word == 'one' and previous not in ONE_CUES:
+            continue
+        if word.isdigit():
+            choices.add(int(word))
+        elif word in NUMBERS:
+            choices.add(NUMBERS[word])
+        elif word in ORDINALS:
+            choices.add(ORDINALS[word])
+        elif word in LAST_WORDS and count:
+            choices.add(count)
+    if len(choices) != 1:
+        return None
+    choice = choices.pop()
+    if choice < 1 or (count is not None and choice > count):
+        return None
+    return choice - 1
+
+
+def features(text):
+    """Hashed feature indexes of a message, with their weights"""
+    tokens = words(text)
+    names = [f"w:{w}" for w in tokens] + [f"b:{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    for token in tokens:
+        padded = f"<{token}>"
+        names += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+    names.append(f"n:{min(len(tokens), 8)}")
+    counts = {}
+    for name in names:
+        index = zlib.crc32(name.encode()) % DIM
+        counts[index] = counts.get(index, 0) + 1
+    norm = math.sqrt(sum(c * c for c in counts.values()))
+    return [(index, c / norm) for index, c in counts.items()]
+
+
+class IntentModel:
+    def __init__(self, weights=None, bias=None, labels=INTENTS, dim=DIM):
+        self.labels = tuple(labels)
+        self.dim = dim
+        self.weights = weights if weights is not None else array('f', bytes(4 * len(self.labels) * dim))
+        self.bias = list(bias) if bias is not None else [0.0] * len(self.labels)
+
+    def probabilities(self, text):
+        return dict(zip(self.labels, self._probabilities(features(text))))
+
+    def predict(self, text):
+        """(intent, confidence) for a message"""
+        probabilities = self.probabilities(text)
+        label = max(probabilities, key=probabilities.get)
+        return label, probabilities[label]
+
+    @classmethod
+    def train(cls, examples, epochs=30, learning_rate=0.5, l2=1e-5, seed=0):
+        """Fit the model with SGD on (text, intent) pairs"""
+        model = cls()
+        data = [(features(text), model.labels.index(label)) for text, label in examples]
+        rng = random.Random(seed)
+        for epoch in range(epochs):
+            rng.shuffle(data)
+            rate = learning_rate / (1 + epoch * 0.1)
+            for feats, target in data:
+                probabilities = model._probabilities(feats)
+                for k, p in enumerate(probabilities):
+                    gradient = p - (k == target)
+                    offset = k * model.dim
+                    for i, v in feats:
+                        w = model.weights[offset + i]
+                        model.weights[offset + i] = w - rate * (gradient * v + l2 * w)
+                    model.bias[k] -= rate * gradient
+        return model
+
+    def _probabilities(self, feats):
+        scores = [b + sum(self.weights[k * self.dim + i] * v for i, v in feats) for k, b in enumerate(self.bias)]
+        top = max(scores)
+        exps = [math.exp(s - top) for s in scores]
+        total = sum(exps)
+        return [e / total for e in exps]
+
+    def save(self, path):
+        data = {
+            'labels': list(self.labels),
+            'dim': self.dim,
+            'bias': self.bias,
+            # float32, little-endian, one row of `dim` weights per label
+            'weights': base64.b64encode(self._little_endian(self.weights).tobytes()).decode('ascii'),
+        }
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        weights = array('f')
+        weights.frombytes(base64.b64decode(data['weights']))
+        return cls(cls._little_endian(weights), data['bias'], data['labels'], data['dim'])
+
+    @staticmethod
+    def _little_endian(weights):
+        if sys.byteorder == 'big':
+            weights = array('f', weights)
+            weights.byteswap()
+        return weights
+
+
+# Templates for the built-in training examples
+GREETINGS = ['hi', 'hello', 'hey', 'hey there', 'hi there', 'hello there', 'hiya', 'hii', 'heyy', 'yo', 'howdy',
+             'greetings', 'start', 'good morning', 'good afternoon', 'good evening', 'hello again', 'hi again',
+             'hey bot', 'hello bot', 'hi!', 'hello!!', 'hey, how are you?', 'hi how are you', "what's up", 'sup',
+             'namaste', 'hola', 'hi, what can you do?', 'hello, who are you?', 'hey, anyone there?', 'morning',
+             "let's start", 'get started', 'begin', 'hi :)']
+OFF_TOPIC_ASKS = ['tell me', 'what is', 'how do i', 'can you explain', 'i want to know', 'who is', 'help me with',
+                  'give me', 'do you know']
+OFF_TOPIC_THINGS = ['a joke', 'the weather today', 'the weather in london', 'how to cook pasta', 'a recipe for cake',
+                    'the capital of france', 'the score of the football game', 'the latest news', 'my horoscope',
+                    'the price of bitcoin today', 'a poem about love', 'a good movie to watch', 'the meaning of life',
+                    'how to lose weight', 'the president of the usa', 'how tall mount everest is',
+                    'a song recommendation', 'cheap flights to paris', 'my relationship problems',
+                    'the history of rome', 'a bedtime story', 'what to eat for dinner', 'the time in tokyo',
+                    'how to fix my car', 'the lottery numbers', 'a good book to read', 'how to tie a tie']
+OFF_TOPIC_EXTRA = ['what is 2+2', 'solve x + 3 = 7', 'who won the world cup', 'write my history essay',
+                   'translate hello into spanish', 'i feel sad today', 'how old are you', 'do you like pizza',
+                   'play some music', 'book a table for two', 'what day is it', 'is it going to rain tomorrow',
+                   'tell me something funny', 'what should i wear today', 'how do i make coffee',
+                   "what's your favourite colour", 'recommend a restaurant nearby', 'sing a song',
+                   'what is the square root of 144', 'who is the richest person in the world']
+SELECT_TEMPLATES = ['{n}', '#{n}', '{o}', 'the {o}', 'the {o} one', '{o} one', '{o} please', 'number {n}',
+                    'option {n}', 'option {w}', 'number {w}', '{w}', "i'll take the {o} one", "i'll go with {n}",
+                    "let's go with the {o} one", 'i choose {n}', 'i pick the {o}', 'pick {n}', 'go with {w}',
+                    'i like the {o} one', 'i want number {n}', 'choose option {n}', 'the {o} sounds good',
+                    '{n} please', 'the {o} project', 'project {n}', 'idea {n}', 'the {o} idea looks interesting',
+                    'can you tell me more about the {o} one', 'i prefer option {w}', '{o} looks good to me']
+SELECT_LAST = ['the last one', 'last one', 'the last', 'last option', "i'll take the last one", 'the final one']
+SKILLS = ['beginner', 'intermediate', 'advanced', 'i am new to coding', 'expert', 'some experience',
+          'highly skilled', 'student']
+LANGUAGES = ['python', 'java', 'javascript', 'c++', 'react', 'rust', 'golang', 'typescript']
+DOMAINS = ['machine learning', 'web development', 'computer vision', 'nlp', 'iot', 'blockchain', 'data science',
+           'mobile apps', 'deep learning', 'game development', 'cybersecurity', 'generative ai', 'ml']
+TIMES = ['2 weeks', 'a month', '3 months', 'one weekend', '6 weeks', '1-2 weeks', '10 days', 'two months']
+PROJECT_TEMPLATES = ['{s} {l} {d} {t}', '{s}, {l}, {d}, {t}', 'i am a {s} in {l} interested in {d} and i have {t}',
+                     'suggest a {d} project', 'i want to build something with {l}', 'project ideas for {d}',
+                     'i have {t} to build a {d} project', 'something in {d} using {l}', '{d} with {l}',
+                     'give me {d} project ideas for a {s}', 'i know {l}, what can i build in {t}?',
+                     '{s} level, {t}', 'i want a {d} project', 'recommend projects in {l}', '{l}', '{d}', '{t}',
+                     'i have about {t}', 'my skill level is {s}', 'can you suggest a {s} {d} project',
+                     'what should i build with {l} in {t}', 'final year project in {d}',
+                     'i need 2 project ideas in {d}']
+PROJECT_EXTRA = ['yes', 'no', 'yes please', 'sure', 'another one', 'another one please', 'give me another one',
+                 'one more', 'show me another one', 'more ideas', 'show me different projects',
+                 'can you suggest something else', 'something fun', 'i want to learn ml', 'not sure',
+                 'i have no idea what to build', 'help me pick a project', 'anything is fine',
+                 'something related to healthcare', 'i like music and coding', 'a project for my resume',
+                 'these are too hard', 'something easier please', 'more advanced ones', 'none of these',
+                 'explore another project', 'i want to build an app', 'projects for hackathon',
+                 'a weather app', 'a recipe recommendation app', 'a movie recommender', 'a music playlist generator',
+                 'a chatbot for my college', 'a news summarizer', 'a fitness tracker app', 'a stock price predictor',
+                 'a game in python', 'what is machine learning used for in projects']
+
+
+def training_examples():
+    """The built-in labelled examples, generated from the templates above"""
+    examples = [(text, 'greeting') for text in GREETINGS]
+    examples += [(f"{ask} {thing}", 'off_topic') for ask, thing in itertools.product(OFF_TOPIC_ASKS, OFF_TOPIC_THINGS)]
+    examples += [(text, 'off_topic') for text in OFF_TOPIC_EXTRA]
+    number_words = {n: w for w, n in NUMBERS.items()}
+    ordinal_words = {n: w for w, n in ORDINALS.items() if w.isalpha()}
+    for template, n in itertools.product(SELECT_TEMPLATES, range(1, 11)):
+        examples.append((template.format(n=n, w=number_words[n], o=ordinal_words[n]), 'select'))
+    examples += [(text, 'select') for text in SELECT_LAST]
+    rng = random.Random(0)
+    for template in PROJECT_TEMPLATES:
+        for _ in range(12):
+            text = template.format(s=rng.choice(SKILLS), l=rng.choice(LANGUAGES), d=rng.choice(DOMAINS),
+                                   t=rng.choice(TIMES))
+            examples.append((text, 'project'))
+    examples += [(text, 'project') for text in PROJECT_EXTRA]
+    return examples
+
+
+def read_examples(path):
+    """(text, intent) pairs from a JSONL file of {"text", "label"} objects, such as a shadow log"""
+    examples = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                if item.get('label') in INTENTS:
+                    examples.append((item['text'], item['label']))
+    return examples
+
+
+def accuracy(model, examples):
+    return sum(model.predict(text)[0] == label for text, label in examples) / max(len(examples), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train or try the intent classifier")
+    parser.add_argument('command', choices=['train', 'eval', 'predict'])
+    parser.add_argument('text', nargs='*', help="messages to classify (predict)")
+    parser.add_argument('--path', default=os.getenv('INTENT_MODEL_PATH', 'db/intent_model.json'))
+    parser.add_argument('--examples', action='append', default=[], help="extra labelled JSONL examples")
+    parser.add_argument('--epochs', type=int, default=30)
+    args = parser.parse_args()
+
+    examples = training_examples()
+    for path in args.examples:
+        examples += read_examples(path)
+    if args.command == 'train':
+        model = IntentModel.train(examples, epochs=args.epochs)
+        model.save(args.path)
+        print(f"Trained on {len(examples)} examples ({accuracy(model, examples):.1%} accurate), saved to {args.path}")
+    elif args.command == 'eval':
+        # Hold out every fifth example
+        train = [e for i, e in enumerate(examples) if i % 5]
+        held_out = examples[::5]
+        model = IntentModel.train(train, epochs=args.epochs)
+        print(f"{accuracy(model, held_out):.1%} accurate on {len(held_out)} held-out examples")
+        for text, label in held_out:
+            predicted, confidence = model.predict(text)
+            if predicted != label:
+                print(f"  {text!r}: {predicted} ({confidence:.2f}), expected {label}")
+    else:
+        model = IntentModel.load(args.path)
+        for text in args.text:
+            intent, confidence = model.predict(text)
+            print(f"{intent}\t{confidence:.2f}\t{text}")
+
+
+if __name__ == '__main__':
+    main()
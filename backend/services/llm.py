@@ -0,0 +1,456 @@
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from functools import partial
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.connection import HTTPConnection, HTTPSConnection
+
+from services.cancellation import GenerationCancelled, acollect, cancellable, collect
+from services.metrics import record_generation
+
+try:
+    import httpx
+except ImportError:  # only needed by AsyncLLMClient (the ASGI serving mode)
+    httpx = None
+
+
+class LLMBusyError(Exception):
+    """Raised when the LLM queue is full, instead of waiting out a long timeout"""
+
+
+# Connections taken from the pool by the current thread's cancellable request (see LLMClient.cancelling)
+_watched = threading.local()
+
+
+class WatchedConnections(list):
+    """The connections of one cancellable request; once aborted, any it goes on to use are shut down too"""
+    aborted = False
+
+
+class WatchedConnectionMixin:
+    watch = None
+
+    def connect(self):
+        super().connect()
+        # A request aborted while this connection was still connecting had no socket to shut down
+        if self.watch is not None and self.watch.aborted:
+            shutdown_socket(self.sock)
+
+
+class WatchedHTTPConnection(WatchedConnectionMixin, HTTPConnection):
+    pass
+
+
+class WatchedHTTPSConnection(WatchedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class WatchedPoolMixin:
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        connections = getattr(_watched, 'connections', None)
+        conn.watch = connections
+        if connections is not None:
+            connections.append(conn)
+            if connections.aborted:
+                shutdown_socket(conn.sock)
+        return conn
+
+
+class WatchedHTTPConnectionPool(WatchedPoolMixin, HTTPConnectionPool):
+    ConnectionCls = WatchedHTTPConnection
+
+
+class WatchedHTTPSConnectionPool(WatchedPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = WatchedHTTPSConnection
+
+
+def shutdown_socket(sock):
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def abort_connections(connections):
+    """Shut down the sockets of in-use connections, so a read blocked on them fails right away"""
+    connections.aborted = True
+    for conn in list(connections):
+        shutdown_socket(getattr(conn, 'sock', None))
+
+
+class SlotPool:
+    """
+    Generation slots of one Ollama instance. The sync and async clients of a process share
+    one pool (see router.build_async_llm_client), so together they stay within its size.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._free = size
+        self._cond = threading.Condition()
+
+    def acquire(self, blocking=True, timeout=None):
+        with self._cond:
+            if blocking and not self._cond.wait_for(lambda: self._free > 0, timeout):
+                return False
+            if not self._free:
+                return False
+            self._free -= 1
+            return True
+
+    async def acquire_async(self, timeout, poll=0.01):
+        """Wait for a slot without blocking the event loop, checking every `poll` seconds"""
+        deadline = time.monotonic() + timeout
+        while not self.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(poll)
+        return True
+
+    def release(self):
+        with self._cond:
+            if self._free >= self.size:
+                raise ValueError("SlotPool released too many times")
+            self._free += 1
+            self._cond.notify()
+
+    def full(self):
+        with self._cond:
+            return self._free == 0
+
+    def in_use(self):
+        with self._cond:
+            return self.size - self._free
+
+
+def clear_pools(adapter_ref):
+    """Drop the pooled connections of an adapter in a forked child (its sockets are the parent's)"""
+    adapter = adapter_ref()
+    if adapter is not None:
+        adapter.poolmanager.clear()
+
+
+class LLMClient:
+    """
+    Shared HTTP client for Ollama.
+    Keeps a keep-alive connection pool and caps in-flight generations with a SlotPool
+    (`slots`, or one of `max_in_flight`); callers beyond `max_queue` waiting for a slot are
+    rejected right away.
+    """
+
+    def __init__(self, url, model='llama3', max_in_flight=2, max_queue=16,
+                 queue_timeout=30, pool_size=10, keep_alive=None, model_options=None, slots=None):
+        self.url = url
+        self.model = model
+        self.slots = slots or SlotPool(max_in_flight)
+        self.max_in_flight = self.slots.size
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.keep_alive = keep_alive
+        self.model_options = model_options or {}
+
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        self.adapter.poolmanager.pool_classes_by_scheme = {
+            'http': WatchedHTTPConnectionPool, 'https': WatchedHTTPSConnectionPool
+        }
+        # A process forked from this one must not share its pooled sockets
+        os.register_at_fork(after_in_child=partial(clear_pools, weakref.ref(self.adapter)))
+
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def _acquire(self, cancel=None):
+        if cancel is None:
+            return self.slots.acquire(timeout=self.queue_timeout)
+        # Wait in short steps, so a cancelled request leaves the queue promptly
+        deadline = time.monotonic() + self.queue_timeout
+        while not cancel.cancelled:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if self.slots.acquire(timeout=min(remaining, 0.1)):
+                return True
+        return False
+
+    @contextmanager
+    def slot(self, cancel=None):
+        """Hold one of the in-flight slots for the duration of a generation"""
+        with self._lock:
+            if self._waiting + self._in_flight >= self.max_in_flight + self.max_queue:
+                self._rejected += 1
+                raise LLMBusyError("LLM queue is full")
+            self._waiting += 1
+        acquired = self._acquire(cancel)
+        with self._lock:
+            self._waiting -= 1
+            if acquired:
+                self._in_flight += 1
+            elif cancel is None or not cancel.cancelled:
+                self._rejected += 1
+        if not acquired:
+            if cancel is not None:
+                cancel.check()
+            raise LLMBusyError("Timed out waiting for an LLM slot")
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._completed += 1
+            self.slots.release()
+
+    def saturated(self):
+        """True when every generation slot is taken or callers are already waiting for one"""
+        with self._lock:
+            return self._waiting > 0 or self.slots.full()
+
+    def _payload(self, prompt, stream, options):
+        payload = {'model': self.model, 'prompt': prompt, 'stream': stream}
+        if self.keep_alive:
+            payload['keep_alive'] = self.keep_alive
+        if self.model_options:
+            # Sent on every request: Ollama reloads the model when num_ctx differs from the loaded one
+            payload['options'] = self.model_options
+        payload.update(options)
+        return payload
+
+    @contextmanager
+    def cancelling(self, cancel):
+        """
+        Make the request sent inside abortable by `cancel`: its socket is shut down when the
+        token fires, and the resulting connection error surfaces as GenerationCancelled.
+        Yields the list collecting the request's connections (None without a token).
+        """
+        if cancel is None:
+            yield None
+            return
+        connections = WatchedConnections()
+        forget = cancel.on_cancel(lambda: abort_connections(connections))
+        try:
+            yield connections
+        except Exception as e:
+            if cancel.cancelled and not isinstance(e, GenerationCancelled):
+                raise GenerationCancelled(cancel.reason) from e
+            raise
+        finally:
+            forget()
+
+    def _post(self, payload, timeout, connections=None, stream=False):
+        _watched.connections = connections
+        try:
+            return self.session.post(self.url, json=payload, stream=stream, timeout=timeout)
+        finally:
+            _watched.connections = None
+
+    def generate(self, prompt, timeout=120, route_key=None, cancel=None, **options):
+        """
+        Run a blocking generation and return Ollama's JSON response. `route_key` is for LLMRouter.
+        With a `cancel` token (services.cancellation) it is streamed, so it can stop midway.
+        """
+        if cancel is not None:
+            return collect(self.stream(prompt, timeout=timeout, cancel=cancel, **options))
+        payload = self._payload(prompt, False, options)
+        with self.slot():
+            started = time.perf_counter()
+            response = self.session.post(self.url, json=payload, timeout=timeout)
+            response.raise_for_status()
+            data = response.json()
+            record_generation(data, time.perf_counter() - started, 'generate')
+            return data
+
+    def stream(self, prompt, timeout=120, route_key=None, cancel=None, **options):
+        """Run a streamed generation, yielding each JSON chunk Ollama sends, until done or `cancel` fires"""
+        payload = self._payload(prompt, True, options)
+        with self.slot(cancel), self.cancelling(cancel) as connections:
+            started = time.perf_counter()
+            with self._post(payload, timeout, connections, stream=True) as response:
+                try:
+                    response.raise_for_status()
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        chunk = json.loads(line)
+                        if chunk.get('done'):
+                            record_generation(chunk, time.perf_counter() - started, 'stream')
+                        yield chunk
+                        if chunk.get('done'):
+                            break
+                        if cancel is not None:
+                            cancel.check()
+                finally:
+                    if connections is not None:
+                        # The connection goes back to the pool next and may serve another request
+                        connections.clear()
+
+    def embed(self, text, model=None, timeout=10):
+        """Return an embedding vector for `text` from Ollama's embeddings endpoint"""
+        url = self.url.rsplit('/api/', 1)[0] + '/api/embeddings'
+        response = self.session.post(url, json={'model': model or self.model, 'prompt': text}, timeout=timeout)
+        response.raise_for_status()
+        return response.json().get('embedding')
+
+    def warm_up(self, timeout=300):
+        """
+        Load the model into Ollama's memory, kept there for `keep_alive`, without generating
+        anything (Ollama only loads the model for an empty prompt). Takes no generation slot.
+        Returns the seconds Ollama spent loading it, 0 if it was loaded already.
+        """
+        response = self.session.post(self.url, json=self._payload('', False, {}), timeout=timeout)
+        response.raise_for_status()
+        return response.json().get('load_duration', 0) / 1e9
+
+    def metrics(self):
+        """Queue and connection pool figures for monitoring"""
+        manager = self.adapter.poolmanager
+        pools = [manager.pools[key] for key in manager.pools.keys()]
+        with self._lock:
+            return {
+                'in_flight': self._in_flight,
+                'waiting': self._waiting,
+                'max_in_flight': self.max_in_flight,
+                'max_queue': self.max_queue,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                # Slots taken by every client sharing them (see AsyncLLMClient)
+                'slots_in_use': self.slots.in_use(),
+                'pool_connections_opened': sum(p.num_connections for p in pools),
+                'pool_requests': sum(p.num_requests for p in pools),
+                'pool_idle_connections': sum(1 for p in pools if p.pool for conn in p.pool.queue if conn),
+            }
+
+
+class AsyncLLMClient:
+    """
+    asyncio counterpart of LLMClient for the ASGI serving mode.
+    Waiting for Ollama holds no thread, so one process can keep many generations open;
+    the same in-flight cap and fast "busy" rejection apply. Given the `slots` of the
+    process's LLMClient for the same instance, the two share that cap.
+    """
+
+    def __init__(self, url, model='llama3', max_in_flight=2, max_queue=16,
+                 queue_timeout=30, pool_size=10, keep_alive=None, model_options=None, slots=None):
+        if httpx is None:
+            raise RuntimeError("httpx is required for the async serving mode")
+        self.url = url
+        self.model = model
+        self.slots = slots
+        self.max_in_flight = slots.size if slots else max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.keep_alive = keep_alive
+        self.model_options = model_options or {}
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+        self._slots = None if slots else asyncio.Semaphore(max_in_flight)
+        self._waiting = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._waiting + self._in_flight >= self.max_in_flight + self.max_queue:
+            self._rejected += 1
+            raise LLMBusyError("LLM queue is full")
+        self._waiting += 1
+        try:
+            if self.slots is not None:
+                acquired = await self.slots.acquire_async(self.queue_timeout)
+            else:
+                acquired = True
+                await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            acquired = False
+        finally:
+            self._waiting -= 1
+        if not acquired:
+            self._rejected += 1
+            raise LLMBusyError("Timed out waiting for an LLM slot")
+        self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            self._completed += 1
+            (self.slots or self._slots).release()
+
+    def _payload(self, prompt, stream, options):
+        payload = {'model': self.model, 'prompt': prompt, 'stream': stream}
+        if self.keep_alive:
+            payload['keep_alive'] = self.keep_alive
+        if self.model_options:
+            # Sent on every request: Ollama reloads the model when num_ctx differs from the loaded one
+            payload['options'] = self.model_options
+        payload.update(options)
+        return payload
+
+    def saturated(self):
+        if self.slots is not None:
+            return self._waiting > 0 or self.slots.full()
+        return self._waiting > 0 or self._in_flight >= self.max_in_flight
+
+    async def generate(self, prompt, timeout=120, route_key=None, cancel=None, **options):
+        if cancel is not None:
+            return await acollect(self.stream(prompt, timeout=timeout, cancel=cancel, **options))
+        payload = self._payload(prompt, False, options)
+        async with self.slot():
+            started = time.perf_counter()
+            response = await self.client.post(self.url, json=payload, timeout=timeout)
+            response.raise_for_status()
+            data = response.json()
+            record_generation(data, time.perf_counter() - started, 'generate')
+            return data
+
+    async def stream(self, prompt, timeout=120, route_key=None, cancel=None, **options):
+        if cancel is not None:
+            # Cancelling the task running the request closes it and releases the slot
+            async for chunk in cancellable(self.stream(prompt, timeout=timeout, **options), cancel):
+                yield chunk
+            return
+        payload = self._payload(prompt, True, options)
+        async with self.slot():
+            started = time.perf_counter()
+            async with self.client.stream('POST', self.url, json=payload, timeout=timeout) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get('done'):
+                        record_generation(chunk, time.perf_counter() - started, 'stream')
+                    yield chunk
+                    if chunk.get('done'):
+                        break
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    def metrics(self):
+        metrics = {
+            'in_flight': self._in_flight,
+            'waiting': self._waiting,
+            'max_in_flight': self.max_in_flight,
+            'max_queue': self.max_queue,
+            'completed': self._completed,
+            'rejected': self._rejected,
+        }
+        if self.slots is not None:
+            metrics['slots_in_use'] = self.slots.in_use()
+        return metrics
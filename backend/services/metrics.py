@@ -0,0 +1,186 @@
+"""
+In-process metrics in the Prometheus text format, plus timing spans for request stages.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def samples(self):
+        with self._lock:
+            return [(f"{self.name}{format_labels(self.labels, key)}", value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name} {format_value(value)}" for name, value in self.samples()]
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """A gauge that is either set directly or read from `callback` at scrape time"""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), callback=None):
+        super().__init__(name, help, labels)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self):
+        if self.callback is not None:
+            try:
+                return [(self.name, self.callback())]
+            except Exception:
+                return []
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        entry = self._values.get(self._key(labels))
+        return entry[0][-1] if entry else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        samples = []
+        for key, (counts, total) in items:
+            for bound, count in zip(self.buckets, counts):
+                samples.append((f"{self.name}_bucket{format_labels(self.labels, key, [('le', format_value(bound))])}", count))
+            samples.append((f"{self.name}_sum{format_labels(self.labels, key)}", total))
+            samples.append((f"{self.name}_count{format_labels(self.labels, key)}", counts[-1]))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=(), callback=None):
+        return self.register(Gauge(name, help, labels, callback))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram('chatbot_stage_seconds', "Time spent in each stage of a chat turn", ['stage'])
+STARTUP_SECONDS = REGISTRY.gauge('app_startup_seconds', "Time taken by each phase of process startup "
+                                 "(import, startup, warmup)", ['phase'])
+LLM_SECONDS = REGISTRY.histogram('llm_request_seconds', "Ollama generation latency", ['mode'])
+LLM_TOKENS = REGISTRY.counter('llm_eval_tokens_total', "Tokens generated by Ollama (eval_count)")
+LLM_EVAL_SECONDS = REGISTRY.counter('llm_eval_seconds_total', "Ollama generation time (eval_duration)")
+LLM_TOKENS_PER_SECOND = REGISTRY.histogram(
+    'llm_tokens_per_second', "Ollama generation speed per request (eval_count / eval_duration)", buckets=RATE_BUCKETS
+)
+MONGO_SECONDS = REGISTRY.histogram('mongo_command_seconds', "MongoDB command latency", ['command'])
+MONGO_FAILURES = REGISTRY.counter('mongo_command_failures_total', "Failed MongoDB commands", ['command'])
+
+
+@contextmanager
+def span(stage, spans=None):
+    """Time a block into chatbot_stage_seconds; (stage, seconds) is also appended to `spans` if given"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+
+def record_generation(data, seconds, mode):
+    """Record one finished Ollama generation from its final JSON response or chunk"""
+    LLM_SECONDS.observe(seconds, mode=mode)
+    eval_count = data.get('eval_count')
+    eval_duration = data.get('eval_duration')
+    if eval_count:
+        LLM_TOKENS.inc(eval_count)
+    if eval_count and eval_duration:
+        LLM_EVAL_SECONDS.inc(eval_duration / 1e9)
+        LLM_TOKENS_PER_SECOND.observe(eval_count / (eval_duration / 1e9))
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo command listener feeding mongo_command_seconds; pass it in `event_listeners`"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, command=event.command_name)
+
+    def failed(self, event):
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, command=event.command_name)
+        MONGO_FAILURES.inc(command=event.command_name)
@@ -0,0 +1,49 @@
+"""
+MongoDB handles that are opened lazily, in the process that uses them.
+
+A pymongo client must not be carried across a fork, so the app's client, database and
+collections are created at import as ProcessLocal proxies: the real MongoClient is built on
+first use in each process, after the server has forked its workers, and importing the app
+needs no reachable MongoDB.
+"""
+import os
+import threading
+
+from pymongo import MongoClient
+
+
+class ProcessLocal:
+    """
+    Proxy to the object `resolve()` returns, resolved on first use and again in a forked child.
+    Indexing it (client['db'], db['collection']) gives a ProcessLocal of the result.
+    """
+
+    def __init__(self, resolve):
+        self._resolve = resolve
+        self._target = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._target = self._resolve()
+                    self._pid = os.getpid()
+        return self._target
+
+    @property
+    def resolved(self):
+        """True if this process has already created the object"""
+        return self._pid == os.getpid()
+
+    def __getitem__(self, name):
+        return ProcessLocal(lambda: self.get()[name])
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+def lazy_mongo_client(*args, **kwargs):
+    """A MongoClient(*args, **kwargs) per process, created when first used"""
+    return ProcessLocal(lambda: MongoClient(*args, **kwargs))
@@ -0,0 +1,88 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from services.cancellation import CancelToken
+
+
+class Prefetcher:
+    """
+    Runs speculative jobs on background workers, grouped per chat.
+    Scheduling a new batch for a chat cancels its previous one; `take` claims one job's
+    result and cancels the rest of the batch, since the user made their choice.
+    Each job is called with its own CancelToken, which fires when the job is cancelled, so
+    a job already generating can abort and free its LLM slot. Results are kept for the
+    `max_groups` most recently scheduled chats.
+    """
+
+    def __init__(self, workers=1, max_groups=1000):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+        self.max_groups = max_groups
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def schedule(self, group, jobs):
+        """
+        Start `jobs` ({job key: callable taking a CancelToken}) for `group`, replacing any
+        jobs it still has
+        """
+        futures = {}
+        for key, job in jobs.items():
+            token = CancelToken()
+            futures[key] = (self.executor.submit(job, token), token)
+        with self._lock:
+            dropped = [self._jobs.pop(group, {})]
+            self._jobs[group] = futures
+            while len(self._jobs) > self.max_groups:
+                dropped.append(self._jobs.popitem(last=False)[1])
+        for previous in dropped:
+            cancel_jobs(previous.values())
+
+    def take(self, group, key, timeout=None, cancel=None):
+        """
+        Claim the result of `key` in `group`, waiting up to `timeout` seconds if it is running,
+        or until the `cancel` token fires, which aborts the job too. A job still queued behind
+        others is cancelled instead, as the caller can start it right away. Returns None if
+        there was no such job or it was queued, skipped, cancelled or failed.
+        """
+        with self._lock:
+            futures = self._jobs.pop(group, {})
+        future, token = futures.pop(key, (None, None))
+        cancel_jobs(futures.values())
+        if future is None or future.cancel():
+            return None
+        if cancel is not None:
+            finished = threading.Event()
+            future.add_done_callback(lambda _: finished.set())
+
+            def abort():
+                # The claimed job belongs to the turn now, and is cancelled with it
+                token.cancel(cancel.reason)
+                finished.set()
+
+            forget = cancel.on_cancel(abort)
+            try:
+                finished.wait(timeout)
+            finally:
+                forget()
+            timeout = 0
+        try:
+            return future.result(timeout=timeout)
+        except Exception:
+            return None
+
+    def cancel(self, group):
+        with self._lock:
+            futures = self._jobs.pop(group, {})
+        cancel_jobs(futures.values())
+
+    def pending(self):
+        with self._lock:
+            return sum(1 for futures in self._jobs.values() for future, _ in futures.values() if not future.done())
+
+
+def cancel_jobs(jobs):
+    """Drop queued jobs and abort the generations of running ones"""
+    for future, token in jobs:
+        if not future.cancel():
+            token.cancel('prefetch')
@@ -0,0 +1,304 @@
+"""
+Routing of generations across several Ollama instances.
+
+LLMRouter has the same interface as LLMClient and wraps one client per backend. Each
+request goes to the backend with the fewest outstanding requests, except that requests
+with a `route_key` (a chat) stick to the backend that served that key last, keeping its
+prompt cache warm. A backend is taken out of rotation by a circuit breaker after
+`failure_threshold` consecutive connection errors or timeouts, and by failed health checks.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import requests
+
+from services.llm import AsyncLLMClient, LLMClient
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+
+def is_backend_failure(error) -> bool:
+    """Errors that say the backend is down or stuck, as opposed to a bad request"""
+    failures = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+    if httpx is not None:
+        failures += (httpx.TransportError,)
+    return isinstance(error, failures)
+
+
+def is_unreachable(error) -> bool:
+    """The request never reached the backend, so it is safe to send it to another one"""
+    unreachable = (requests.exceptions.ConnectionError,)
+    if httpx is not None:
+        unreachable += (httpx.ConnectError,)
+    return isinstance(error, unreachable)
+
+
+class Backend:
+    def __init__(self, client):
+        self.client = client
+        self.url = client.url
+        self.outstanding = 0
+        self.failures = 0
+        self.open_until = 0.0
+        self.trial_running = False
+        self.healthy = True
+        self.requests = 0
+        self.errors = 0
+
+    @property
+    def base_url(self):
+        return self.url.rsplit('/api/', 1)[0]
+
+    def available(self, now):
+        """Healthy and with a closed circuit, or an open one whose cooldown allows a trial request"""
+        if not self.healthy:
+            return False
+        if self.failures and self.open_until:
+            return now >= self.open_until and not self.trial_running
+        return True
+
+
+class LLMRouter:
+    def __init__(self, clients, failure_threshold=3, cooldown=30, max_sticky=10000):
+        if not clients:
+            raise ValueError("LLMRouter needs at least one backend")
+        self.backends = [Backend(client) for client in clients]
+        self.model = clients[0].model
+        self.keep_alive = clients[0].keep_alive
+        self.model_options = clients[0].model_options
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_sticky = max_sticky
+        self._sticky = OrderedDict()
+        self._lock = threading.Lock()
+        self._health_thread = None
+
+    @property
+    def url(self):
+        return self.backends[0].url
+
+    def pick(self, route_key=None, exclude=()):
+        """Reserve a backend for one request. Raises ConnectionError if none is available."""
+        now = time.time()
+        with self._lock:
+            candidates = [b for b in self.backends if b.available(now) and b not in exclude]
+            if not candidates:
+                raise requests.exceptions.ConnectionError("No LLM backend is available")
+            backend = self._sticky.get(route_key) if route_key is not None else None
+            if backend not in candidates or backend.client.saturated():
+                # Ties go to the backend that has served the fewest requests, spreading new chats
+                backend = min(candidates, key=lambda b: (b.client.saturated(), b.outstanding, b.requests))
+            if route_key is not None:
+                self._sticky[route_key] = backend
+                self._sticky.move_to_end(route_key)
+                while len(self._sticky) > self.max_sticky:
+                    self._sticky.popitem(last=False)
+            if backend.open_until:
+                backend.trial_running = True
+            backend.outstanding += 1
+            backend.requests += 1
+            return backend
+
+    def release(self, backend, error=None):
+        with self._lock:
+            backend.outstanding -= 1
+            backend.trial_running = False
+            if error is not None and is_backend_failure(error):
+                backend.errors += 1
+                backend.failures += 1
+                if backend.failures >= self.failure_threshold:
+                    if not backend.open_until or time.time() >= backend.open_until:
+                        logger.warning("LLM backend %s failed %d times, pausing it for %ss: %s",
+                                       backend.url, backend.failures, self.cooldown, error)
+                    backend.open_until = time.time() + self.cooldown
+            elif error is None:
+                backend.failures = 0
+                backend.open_until = 0.0
+
+    @contextmanager
+    def use(self, route_key=None):
+        backend = self.pick(route_key)
+        try:
+            yield backend
+        except BaseException as e:
+            self.release(backend, e)
+            raise
+        self.release(backend)
+
+    def generate(self, prompt, timeout=120, route_key=None, **options):
+        """Generate on the chosen backend, moving on to the next one if it cannot be reached"""
+        tried = []
+        while True:
+            backend = self.pick(route_key, tried)
+            try:
+                result = backend.client.generate(prompt, timeout=timeout, **options)
+            except BaseException as e:
+                self.release(backend, e)
+                tried.append(backend)
+                if not is_unreachable(e) or len(tried) == len(self.backends):
+                    raise
+                continue
+            self.release(backend)
+            return result
+
+    def stream(self, prompt, timeout=120, route_key=None, **options):
+        """Like generate, but a backend that fails after its first token is not retried elsewhere"""
+        tried = []
+        while True:
+            backend = self.pick(route_key, tried)
+            started = False
+            try:
+                for chunk in backend.client.stream(prompt, timeout=timeout, **options):
+                    started = True
+                    yield chunk
+            except BaseException as e:
+                self.release(backend, e)
+                tried.append(backend)
+                if started or not is_unreachable(e) or len(tried) == len(self.backends):
+                    raise
+                continue
+            self.release(backend)
+            return
+
+    def embed(self, text, model=None, timeout=10):
+        with self.use() as backend:
+            return backend.client.embed(text, model=model, timeout=timeout)
+
+    def warm_up(self, timeout=300):
+        """Load the model on every backend; raises if none could. Returns the longest load time."""
+        loaded, error = [], None
+        for backend in self.backends:
+            try:
+                loaded.append(backend.client.warm_up(timeout=timeout))
+            except Exception as e:
+                logger.warning("Could not warm up LLM backend %s: %s", backend.url, e)
+                error = e
+        if not loaded:
+            raise error
+        return max(loaded)
+
+    def saturated(self):
+        now = time.time()
+        return all(b.client.saturated() for b in self.backends if b.available(now))
+
+    def check_health(self, timeout=2):
+        """Probe every backend's /api/tags; a backend that answers again gets its circuit closed"""
+        for backend in self.backends:
+            try:
+                response = requests.get(backend.base_url + '/api/tags', timeout=timeout)
+                healthy = response.ok
+            except requests.exceptions.RequestException:
+                healthy = False
+            with self._lock:
+                if healthy and not backend.healthy:
+                    logger.info("LLM backend %s is healthy again", backend.url)
+                elif backend.healthy and not healthy:
+                    logger.warning("LLM backend %s failed its health check", backend.url)
+                backend.healthy = healthy
+                if healthy:
+                    backend.failures = 0
+                    backend.open_until = 0.0
+
+    def start_health_checks(self, interval=10, timeout=2):
+        def loop():
+            while True:
+                self.check_health(timeout)
+                time.sleep(interval)
+
+        self._health_thread = threading.Thread(target=loop, name='llm-health', daemon=True)
+        self._health_thread.start()
+
+    def metrics(self):
+        now = time.time()
+        backends = []
+        for b in self.backends:
+            backends.append({
+                'url': b.url,
+                'available': b.available(now),
+                'healthy': b.healthy,
+                'circuit_open': bool(b.open_until) and now < b.open_until,
+                'outstanding': b.outstanding,
+                'requests': b.requests,
+                'errors': b.errors,
+                **b.client.metrics(),
+            })
+        totals = {key: sum(b[key] for b in backends)
+                  for key in ('in_flight', 'waiting', 'max_in_flight', 'max_queue', 'completed', 'rejected')}
+        return {**totals, 'backends': backends}
+
+
+class AsyncLLMRouter(LLMRouter):
+    """LLMRouter over AsyncLLMClient backends, for the async serving mode"""
+
+    async def generate(self, prompt, timeout=120, route_key=None, **options):
+        tried = []
+        while True:
+            backend = self.pick(route_key, tried)
+            try:
+                result = await backend.client.generate(prompt, timeout=timeout, **options)
+            except BaseException as e:
+                self.release(backend, e)
+                tried.append(backend)
+                if not is_unreachable(e) or len(tried) == len(self.backends):
+                    raise
+                continue
+            self.release(backend)
+            return result
+
+    async def stream(self, prompt, timeout=120, route_key=None, **options):
+        tried = []
+        while True:
+            backend = self.pick(route_key, tried)
+            started = False
+            try:
+                async for chunk in backend.client.stream(prompt, timeout=timeout, **options):
+                    started = True
+                    yield chunk
+            except BaseException as e:
+                self.release(backend, e)
+                tried.append(backend)
+                if started or not is_unreachable(e) or len(tried) == len(self.backends):
+                    raise
+                continue
+            self.release(backend)
+            return
+
+    async def aclose(self):
+        for backend in self.backends:
+            await backend.client.aclose()
+
+
+def build_llm_client(urls, client_class=LLMClient, router_class=LLMRouter, failure_threshold=3, cooldown=30,
+                     slots=None, **client_options):
+    """A plain client for one Ollama URL, or a router over several. `slots` has a SlotPool per URL."""
+    clients = [client_class(url, slots=pool, **client_options) for url, pool in zip(urls, slots or [None] * len(urls))]
+    if len(clients) == 1:
+        return clients[0]
+    return router_class(clients, failure_threshold=failure_threshold, cooldown=cooldown)
+
+
+def build_async_llm_client(urls, share_with=None, **options):
+    """
+    The async client for `urls`. Given the process's sync client for the same URLs, each
+    instance's generation slots are shared with it, so both together keep to its in-flight cap.
+    """
+    if share_with is not None:
+        options['slots'] = [client.slots for client in instance_clients(share_with)]
+    return build_llm_client(urls, client_class=AsyncLLMClient, router_class=AsyncLLMRouter, **options)
+
+
+def instance_clients(client):
+    """The per-instance LLMClients behind a client, a router, or a coalescing client over either"""
+    if not isinstance(client, (LLMClient, LLMRouter)):
+        client = client.client
+    if isinstance(client, LLMRouter):
+        return [backend.client for backend in client.backends]
+    return [client]
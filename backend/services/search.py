@@ -0,0 +1,59 @@
+"""
+Search over a user's chat messages.
+
+Matching and ranking is done by MongoDB's text index on the messages collection (see
+services/indexes.py), which is prefixed by email so a search only reads the user's own
+entries. This module turns the matched messages into short snippets around the words found.
+"""
+import re
+
+# Message fields searched, with the text index weights
+SEARCH_FIELDS = {'selected_title': 5, 'selected_problem': 3, 'user_message': 2, 'bot_reply': 1}
+SNIPPET_WIDTH = 160
+MAX_QUERY_LENGTH = 200
+
+
+def search_terms(query):
+    """Words of a search query, without negated ones ("-word"), lowercased"""
+    terms = []
+    for token in re.findall(r'-?[\w+#]+', query.lower()):
+        if not token.startswith('-') and token not in terms:
+            terms.append(token)
+    return terms
+
+
+def term_pattern(terms):
+    """Regex finding the terms as word prefixes, loosely enough to match the stemmed forms the index matches"""
+    stems = sorted({re.escape(term if len(term) <= 5 else term[:-2]) for term in terms}, key=len, reverse=True)
+    return re.compile(r'\b(?:' + '|'.join(stems) + r')', re.IGNORECASE) if stems else None
+
+
+def snippet(text, pattern, width=SNIPPET_WIDTH):
+    """Up to `width` characters of `text` around its first match of `pattern`, with ellipses where cut"""
+    text = ' '.join((text or '').split())
+    match = pattern.search(text) if pattern else None
+    if len(text) <= width:
+        return text
+    start = max(0, (match.start() if match else 0) - width // 3)
+    if start:
+        start = text.find(' ', start) + 1 or start
+    end = min(len(text), start + width)
+    if end < len(text) and text.rfind(' ', start, end) > start:
+        end = text.rfind(' ', start, end)
+    return ('…' if start else '') + text[start:end].strip() + ('…' if end < len(text) else '')
+
+
+def search_result(message, pattern, chat_names):
+    """The API result for a matched message: the field with the most matches and a snippet of it"""
+    fields = [field for field in SEARCH_FIELDS if message.get(field)]
+    field = max(fields, key=lambda f: (len(pattern.findall(message[f])) if pattern else 0, SEARCH_FIELDS[f]),
+                default='user_message')
+    chat_id = str(message['chat_id'])
+    return {
+        'chat_id': chat_id,
+        'chat_name': chat_names.get(chat_id, 'Chat'),
+        'seq': message['seq'],
+        'field': field,
+        'snippet': snippet(message.get(field, ''), pattern),
+        'score': round(message.get('score', 0), 3),
+    }
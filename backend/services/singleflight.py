@@ -0,0 +1,498 @@
+"""
+Single-flight coalescing of identical LLM generations.
+
+Concurrent callers making the same request share one generation: the first caller (the
+leader) runs it and the others wait for its result instead of sending the same prompt to
+Ollama again. Streams are shared chunk by chunk. With a flight store the leader also claims
+the request in MongoDB, so callers in other workers wait for it too; they receive the
+result once it is complete. A caller whose generation is cancelled (services.cancellation)
+just stops following the shared stream; it keeps running for the others, and is cancelled
+itself once the last of them leaves.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from pymongo.errors import DuplicateKeyError
+
+from services.cancellation import CancelToken, GenerationCancelled, acollect, cancellable, collect
+from services.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+COALESCED = REGISTRY.counter('llm_coalesced_total', "Generations answered by an identical request already in flight",
+                             ['scope'])
+
+
+def utcnow():
+    # Expiry times are compared by the TTL index with the server's UTC clock
+    return datetime.now(timezone.utc)
+
+
+def flight_key(mode, model, prompt, options):
+    """
+    Key of a generation request: the exact prompt and everything else that shapes the output.
+    Not normalized like cache keys, so only exact duplicates share a generation.
+    """
+    request = json.dumps([mode, model, prompt, options], sort_keys=True, default=str)
+    return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+
+class MongoFlightStore:
+    """
+    Claims and results of in-flight generations in a MongoDB collection, shared by every worker.
+    A claim lapses after `lease` seconds if its worker never finishes it; a result stays
+    readable for `linger` seconds so the waiting workers can pick it up.
+    """
+
+    def __init__(self, collection, lease=300, linger=10):
+        self.collection = collection
+        self.lease = lease
+        self.linger = linger
+
+    def ensure_index(self):
+        self.collection.create_index('expires_at', expireAfterSeconds=0)
+
+    def _claim_doc(self):
+        return {'done': False, 'result': None, 'expires_at': utcnow() + timedelta(seconds=self.lease)}
+
+    def claim(self, key):
+        """True if this worker now holds `key`: it was free, or its previous claim or result lapsed"""
+        try:
+            self.collection.insert_one({'_id': key, **self._claim_doc()})
+            return True
+        except DuplicateKeyError:
+            lapsed = {'_id': key, 'expires_at': {'$lt': utcnow()}}
+            return self.collection.find_one_and_update(lapsed, {'$set': self._claim_doc()}) is not None
+
+    def get(self, key):
+        return self.collection.find_one({'_id': key})
+
+    def publish(self, key, result):
+        expires_at = utcnow() + timedelta(seconds=self.linger)
+        self.collection.update_one({'_id': key}, {'$set': {'done': True, 'result': result, 'expires_at': expires_at}})
+
+    def release(self, key):
+        """Give up a claim without a result, so a waiting worker takes over"""
+        self.collection.delete_one({'_id': key, 'done': False})
+
+
+class AsyncMongoFlightStore(MongoFlightStore):
+    """MongoFlightStore for the async serving mode; its TTL index is created by the sync store"""
+
+    async def claim(self, key):
+        try:
+            await self.collection.insert_one({'_id': key, **self._claim_doc()})
+            return True
+        except DuplicateKeyError:
+            lapsed = {'_id': key, 'expires_at': {'$lt': utcnow()}}
+            return await self.collection.find_one_and_update(lapsed, {'$set': self._claim_doc()}) is not None
+
+    async def get(self, key):
+        return await self.collection.find_one({'_id': key})
+
+    async def publish(self, key, result):
+        expires_at = utcnow() + timedelta(seconds=self.linger)
+        await self.collection.update_one({'_id': key}, {'$set': {'done': True, 'result': result, 'expires_at': expires_at}})
+
+    async def release(self, key):
+        await self.collection.delete_one({'_id': key, 'done': False})
+
+
+class FlightAbandoned(Exception):
+    """Every caller of a shared stream went away before it finished"""
+
+
+class Flight:
+    """
+    One generation in progress in this process, with the chunks it has produced so far.
+    `cancel` stops a shared stream once none of its callers is left.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.cancel = CancelToken()
+        self.chunks = []
+        self.result = None
+        self.error = None
+        self.done = False
+        self.subscribers = 0
+        self.task = None
+        self._cond = threading.Condition()
+
+    def add(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, result=None, error=None):
+        with self._cond:
+            self.result, self.error, self.done = result, error, True
+            self._cond.notify_all()
+
+    def wait(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self.done)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def follow(self, cancel=None):
+        """Yield the flight's chunks from the first one, as they arrive, until done or `cancel` fires"""
+        forget = cancel.on_cancel(self.wake) if cancel is not None else None
+        cancelled = (lambda: cancel.cancelled) if cancel is not None else (lambda: False)
+        seen = 0
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: len(self.chunks) > seen or self.done or cancelled())
+                    new, done = self.chunks[seen:], self.done
+                if cancelled():
+                    raise GenerationCancelled(cancel.reason)
+                seen += len(new)
+                yield from new
+                if done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+        finally:
+            if forget is not None:
+                forget()
+
+
+class SingleFlight:
+    """
+    Shares identical calls in flight in this process, and across workers when given a
+    flight store. A shared stream is run by a background thread that every caller follows,
+    so the callers can come and go independently; it is stopped once none is left.
+    """
+
+    def __init__(self, store=None, wait_timeout=300, poll_interval=0.1):
+        self.store = store
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key, flight_class=Flight):
+        """The flight for `key` and whether this caller leads it"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = flight_class(key)
+            flight.subscribers += 1
+            return flight, leader
+
+    def _leave(self, flight):
+        with self._lock:
+            flight.subscribers -= 1
+            abandoned = not flight.subscribers and not flight.done
+            if abandoned:
+                # Later callers start a new generation rather than join the cancelled one
+                self._forget(flight)
+        if abandoned:
+            flight.cancel.cancel('abandoned')
+
+    def _forget(self, flight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    def _land(self, key, flight, result=None, error=None):
+        with self._lock:
+            self._forget(flight)
+        flight.finish(result, error)
+
+    def _claim(self, key, cancel=None):
+        """
+        Claim `key` in the shared store, or wait for the worker holding it (until `cancel` fires).
+        Returns (claimed, result); both are empty without a store, or if waiting timed out.
+        """
+        if self.store is None:
+            return False, None
+        deadline = time.monotonic() + self.wait_timeout
+        try:
+            while not self.store.claim(key):
+                doc = self.store.get(key)
+                if doc is not None and doc.get('done'):
+                    COALESCED.inc(scope='shared')
+                    return False, doc['result']
+                if time.monotonic() > deadline or (cancel is not None and cancel.cancelled):
+                    return False, None
+                if doc is not None:
+                    time.sleep(self.poll_interval)
+        except Exception as e:
+            logger.warning("Flight store unavailable, generating without it: %s", e)
+            return False, None
+        return True, None
+
+    def _finish_claim(self, key, result=None):
+        try:
+            if result is None:
+                self.store.release(key)
+            else:
+                self.store.publish(key, result)
+        except Exception as e:
+            logger.warning("Could not update flight store: %s", e)
+
+    def do(self, key, fn):
+        """Return fn(), or the result of the identical call already in flight"""
+        flight, leader = self._join(key)
+        if not leader:
+            COALESCED.inc(scope='process')
+            return flight.wait()
+        claimed = False
+        try:
+            claimed, result = self._claim(key)
+            if result is None:
+                result = fn()
+        except BaseException as e:
+            if claimed:
+                self._finish_claim(key)
+            self._land(key, flight, error=e)
+            raise
+        if claimed:
+            self._finish_claim(key, result)
+        self._land(key, flight, result)
+        return result
+
+    def stream(self, key, fn, cancel=None):
+        """
+        Yield the chunks of the iterator fn(flight_cancel) returns, or those of the identical
+        stream already in flight. A `cancel` token stops this caller only; `flight_cancel` fires
+        once every caller has left, and should abort the generation.
+        """
+        flight, leader = self._join(key)
+        if leader:
+            flight.task = threading.Thread(target=self._pump, args=(key, flight, fn), name='llm-flight', daemon=True)
+            flight.task.start()
+        else:
+            COALESCED.inc(scope='process')
+        try:
+            yield from flight.follow(cancel)
+        finally:
+            self._leave(flight)
+
+    def _pump(self, key, flight, fn):
+        claimed = False
+        try:
+            claimed, chunks = self._claim(key, flight.cancel)
+            if chunks is None:
+                flight.cancel.check()
+                chunks = fn(flight.cancel)
+                try:
+                    for chunk in chunks:
+                        flight.add(chunk)
+                        if not flight.subscribers:
+                            raise FlightAbandoned("Every caller of the shared generation went away")
+                finally:
+                    chunks.close()
+            else:
+                for chunk in chunks:
+                    flight.add(chunk)
+        except BaseException as e:
+            if claimed:
+                self._finish_claim(key)
+            self._land(key, flight, error=e)
+            return
+        if claimed:
+            self._finish_claim(key, flight.chunks)
+        self._land(key, flight, flight.chunks)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+
+class AsyncFlight(Flight):
+    """Flight for callers on one event loop"""
+
+    def __init__(self, key):
+        super().__init__(key)
+        self._cond = asyncio.Condition()
+
+    async def add(self, chunk):
+        async with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    async def finish(self, result=None, error=None):
+        async with self._cond:
+            self.result, self.error, self.done = result, error, True
+            self._cond.notify_all()
+
+    async def wait(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.done)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    async def follow(self):
+        seen = 0
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: len(self.chunks) > seen or self.done)
+                new, done = self.chunks[seen:], self.done
+            seen += len(new)
+            for chunk in new:
+                yield chunk
+            if done:
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class AsyncSingleFlight(SingleFlight):
+    """SingleFlight for the async serving mode, over an AsyncMongoFlightStore; shared streams run as tasks"""
+
+    def _join(self, key, flight_class=AsyncFlight):
+        return super()._join(key, flight_class)
+
+    async def _land(self, key, flight, result=None, error=None):
+        with self._lock:
+            self._forget(flight)
+        await flight.finish(result, error)
+
+    async def _claim(self, key, cancel=None):
+        if self.store is None:
+            return False, None
+        deadline = time.monotonic() + self.wait_timeout
+        try:
+            while not await self.store.claim(key):
+                doc = await self.store.get(key)
+                if doc is not None and doc.get('done'):
+                    COALESCED.inc(scope='shared')
+                    return False, doc['result']
+                if time.monotonic() > deadline or (cancel is not None and cancel.cancelled):
+                    return False, None
+                if doc is not None:
+                    await asyncio.sleep(self.poll_interval)
+        except Exception as e:
+            logger.warning("Flight store unavailable, generating without it: %s", e)
+            return False, None
+        return True, None
+
+    async def _finish_claim(self, key, result=None):
+        try:
+            if result is None:
+                await self.store.release(key)
+            else:
+                await self.store.publish(key, result)
+        except Exception as e:
+            logger.warning("Could not update flight store: %s", e)
+
+    async def do(self, key, fn):
+        flight, leader = self._join(key)
+        if not leader:
+            COALESCED.inc(scope='process')
+            return await flight.wait()
+        claimed = False
+        try:
+            claimed, result = await self._claim(key)
+            if result is None:
+                result = await fn()
+        except BaseException as e:
+            if claimed:
+                await self._finish_claim(key)
+            await self._land(key, flight, error=e)
+            raise
+        if claimed:
+            await self._finish_claim(key, result)
+        await self._land(key, flight, result)
+        return result
+
+    async def stream(self, key, fn, cancel=None):
+        if cancel is not None:
+            async for chunk in cancellable(self.stream(key, fn), cancel):
+                yield chunk
+            return
+        flight, leader = self._join(key)
+        if leader:
+            flight.task = asyncio.create_task(self._pump(key, flight, fn))
+        else:
+            COALESCED.inc(scope='process')
+        try:
+            async for chunk in flight.follow():
+                yield chunk
+        finally:
+            self._leave(flight)
+
+    async def _pump(self, key, flight, fn):
+        claimed = False
+        try:
+            claimed, chunks = await self._claim(key, flight.cancel)
+            if chunks is None:
+                flight.cancel.check()
+                chunks = fn(flight.cancel)
+                try:
+                    async for chunk in chunks:
+                        await flight.add(chunk)
+                        if not flight.subscribers:
+                            raise FlightAbandoned("Every caller of the shared generation went away")
+                finally:
+                    await chunks.aclose()
+            else:
+                for chunk in chunks:
+                    await flight.add(chunk)
+        except BaseException as e:
+            if claimed:
+                await self._finish_claim(key)
+            await self._land(key, flight, error=e)
+            return
+        if claimed:
+            await self._finish_claim(key, flight.chunks)
+        await self._land(key, flight, flight.chunks)
+
+
+class CoalescingLLMClient:
+    """
+    Wraps an LLMClient or LLMRouter so identical generations in flight at the same time reach
+    Ollama once. Generations continuing a chat's KV context are specific to that chat and
+    bypass it. Everything else is passed through to the wrapped client.
+    """
+
+    def __init__(self, client, flights):
+        self.client = client
+        self.flights = flights
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def generate(self, prompt, timeout=120, route_key=None, cancel=None, **options):
+        if 'context' in options:
+            return self.client.generate(prompt, timeout=timeout, route_key=route_key, cancel=cancel, **options)
+        if cancel is not None:
+            # Followed as a shared stream, so cancelling this caller leaves the generation running for the others
+            return collect(self.stream(prompt, timeout=timeout, route_key=route_key, cancel=cancel, **options))
+        key = flight_key('generate', self.client.model, prompt, options)
+        return self.flights.do(key, lambda: self.client.generate(prompt, timeout=timeout, route_key=route_key, **options))
+
+    def stream(self, prompt, timeout=120, route_key=None, cancel=None, **options):
+        if 'context' in options:
+            return self.client.stream(prompt, timeout=timeout, route_key=route_key, cancel=cancel, **options)
+        key = flight_key('stream', self.client.model, prompt, options)
+        return self.flights.stream(key, lambda flight_cancel: self.client.stream(prompt, timeout=timeout, route_key=route_key,
+                                                                                 cancel=flight_cancel, **options),
+                                   cancel=cancel)
+
+
+class AsyncCoalescingLLMClient(CoalescingLLMClient):
+    """CoalescingLLMClient over an AsyncLLMClient or AsyncLLMRouter"""
+
+    async def generate(self, prompt, timeout=120, route_key=None, cancel=None, **options):
+        if 'context' in options:
+            return await self.client.generate(prompt, timeout=timeout, route_key=route_key, cancel=cancel, **options)
+        if cancel is not None:
+            return await acollect(self.stream(prompt, timeout=timeout, route_key=route_key, cancel=cancel, **options))
+        key = flight_key('generate', self.client.model, prompt, options)
+        return await self.flights.do(key, lambda: self.client.generate(prompt, timeout=timeout, route_key=route_key,
+                                                                      **options))
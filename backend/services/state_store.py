@@ -0,0 +1,70 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+
+class MemoryStateStore:
+    """In-process state store with LRU eviction and a TTL, bounded to `max_entries` keys"""
+
+    def __init__(self, max_entries=1000, ttl=21600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry:
+                return None
+            if time.time() - entry[1] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def count(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class MongoStateStore:
+    """State store in a MongoDB collection, shared by every worker; idle keys expire via a TTL index"""
+
+    def __init__(self, collection, ttl=21600):
+        self.collection = collection
+        self.ttl = ttl
+
+    def ensure_index(self):
+        """Create the TTL index; done at startup (see start_process) rather than on import"""
+        self.collection.create_index('updated_at', expireAfterSeconds=int(self.ttl))
+
+    def get(self, key):
+        doc = self.collection.find_one({'_id': key}, {'value': 1})
+        return doc['value'] if doc else None
+
+    def set(self, key, value):
+        self.collection.update_one(
+            {'_id': key},
+            # TTL indexes compare with the server's UTC clock
+            {'$set': {'value': value, 'updated_at': datetime.now(timezone.utc)}},
+            upsert=True
+        )
+
+    def delete(self, key):
+        self.collection.delete_one({'_id': key})
+
+    def count(self):
+        return self.collection.estimated_document_count()
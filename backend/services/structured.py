@@ -0,0 +1,99 @@
+"""
+JSON-mode generation of project titles together with their problem statements.
+
+The model is asked for one object matching PROJECTS_SCHEMA (passed to Ollama as `format`),
+so a single call covers the titles, problems and overview turns. parse_projects validates
+and repairs what comes back.
+"""
+import json
+import re
+
+PROJECT_COUNT = 10
+PROBLEM_COUNT = 5
+
+PROJECTS_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'question': {'type': 'string'},
+        'projects': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'title': {'type': 'string'},
+                    'problems': {'type': 'array', 'items': {'type': 'string'}},
+                    'reason': {'type': 'string'},
+                },
+                'required': ['title', 'problems', 'reason'],
+            },
+        },
+    },
+    'required': ['question', 'projects'],
+}
+
+LIST_MARKER = re.compile(r'^\s*(?:\d+\s*[\)\.:-]|[-*•])\s*')
+
+
+def clean_text(value) -> str:
+    """Strip list numbering, markdown bold and surrounding whitespace the model may add"""
+    if not isinstance(value, str):
+        return ''
+    return ' '.join(LIST_MARKER.sub('', value).replace('**', '').split())
+
+
+def unique(items):
+    seen = set()
+    result = []
+    for item in items:
+        if item and item.lower() not in seen:
+            seen.add(item.lower())
+            result.append(item)
+    return result
+
+
+def parse_projects(raw):
+    """
+    Parse a PROJECTS_SCHEMA reply into {'question': str, 'projects': [{'title', 'problems', 'reason'}]}.
+    Bad items are dropped and lists trimmed to size. A project left with fewer than
+    PROBLEM_COUNT problems is kept (see is_complete). Returns None if nothing usable is left.
+    """
+    try:
+        data = json.loads(raw) if isinstance(raw, str) else raw
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    projects = []
+    titles = set()
+    for item in data.get('projects') or []:
+        if not isinstance(item, dict):
+            continue
+        title = clean_text(item.get('title'))
+        if not title or title.lower() in titles:
+            continue
+        titles.add(title.lower())
+        problems = unique(clean_text(p) for p in item.get('problems') or [])
+        projects.append({
+            'title': title,
+            'problems': problems[:PROBLEM_COUNT],
+            'reason': clean_text(item.get('reason')),
+        })
+        if len(projects) == PROJECT_COUNT:
+            break
+
+    question = clean_text(data.get('question'))
+    if not projects and not question:
+        return None
+    return {'question': '' if projects else question, 'projects': projects}
+
+
+def is_complete(project) -> bool:
+    return bool(project) and len(project.get('problems') or []) >= PROBLEM_COUNT
+
+
+def find_project(projects, title):
+    for project in projects or []:
+        if project['title'] == title:
+            return project
+    return None
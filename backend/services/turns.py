@@ -0,0 +1,412 @@
+"""
+The /chatbot turn pipeline, shared by the Flask view (app.py) and the async view (asgi.py).
+
+Steps are generators that do no I/O themselves: every call that may block goes through an
+`io` object and is yielded, `value = yield io.get_chat(...)`, and text for the client is
+yielded as an Emit. The app's TurnIO returns results directly and its steps run with
+run()/stream(); the async view's AsyncTurnIO returns awaitables instead, which arun()/astream()
+await before sending the result (or throwing the error) back into the steps. Calls that never
+block (stages, metrics, planning and parsing) are made directly.
+"""
+import inspect
+import json
+
+from bson import ObjectId
+
+from services.cancellation import GenerationCancelled
+from services.context import ConversationContext
+from services.llm import LLMBusyError
+from services.structured import PROJECTS_SCHEMA, parse_projects
+
+BUSY_REPLY = "🚦 The AI service is busy right now. Please try again in a moment."
+CANCELLED_REPLY = "⏹️ Stopped generating this reply."
+TIMEOUT_TEXT = "⏱️ Request timed out. Please try again."
+CONNECT_TEXT = "❌ Cannot connect to the AI service. Ensure Ollama is running on http://localhost:11434"
+
+# Messages of a chat kept in the state store, and read back from MongoDB when it has none
+HISTORY_MESSAGES = 40
+
+
+class Emit:
+    """Text a step sends to the client"""
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+
+def event(**fields):
+    """An NDJSON event of a streamed turn"""
+    return Emit(json.dumps(fields) + '\n')
+
+
+class Turn:
+    """A planned /chatbot turn and the chat it belongs to"""
+
+    def __init__(self, email, chat_id, user_message, conversation_history, context, plan, cancel, started):
+        self.email = email
+        self.chat_id = chat_id
+        self.user_message = user_message
+        self.conversation_history = conversation_history
+        self.context = context
+        self.plan = plan
+        self.cancel = cancel
+        # time.perf_counter() when the request came in
+        self.started = started
+
+
+def run(steps):
+    """Run steps whose I/O is synchronous and return their result; emitted text is dropped"""
+    try:
+        value = next(steps)
+        while True:
+            value = steps.send(None if isinstance(value, Emit) else value)
+    except StopIteration as stop:
+        return stop.value
+
+
+def stream(steps):
+    """Run steps whose I/O is synchronous, yielding the text they emit; returns their result"""
+    try:
+        value = next(steps)
+        while True:
+            if isinstance(value, Emit):
+                yield value.text
+                value = steps.send(None)
+            else:
+                value = steps.send(value)
+    except StopIteration as stop:
+        return stop.value
+    finally:
+        # A closed stream (the client went away) closes the steps where they are
+        steps.close()
+
+
+async def resolve(value):
+    """What to send back into steps for a value they yielded, awaited if it is awaitable"""
+    if isinstance(value, Emit):
+        return None
+    return await value if inspect.isawaitable(value) else value
+
+
+async def arun(steps):
+    """run() for steps whose I/O is async"""
+    try:
+        value = next(steps)
+        while True:
+            try:
+                result = await resolve(value)
+            except Exception as e:
+                value = steps.throw(e)
+            else:
+                value = steps.send(result)
+    except StopIteration as stop:
+        return stop.value
+    finally:
+        steps.close()
+
+
+async def astream(steps):
+    """stream() for steps whose I/O is async; their result is not returned"""
+    try:
+        value = next(steps)
+        while True:
+            if isinstance(value, Emit):
+                yield value.text
+            try:
+                result = await resolve(value)
+            except Exception as e:
+                value = steps.throw(e)
+            else:
+                value = steps.send(result)
+    except StopIteration:
+        return
+    finally:
+        steps.close()
+
+
+def conversation_key(email: str, chat_id: str) -> str:
+    return f"{email}:{chat_id}"
+
+
+def chat_route_key(email: str, chat_id):
+    """Routing key keeping a chat on one LLM backend (new chats get one once created)"""
+    return conversation_key(email, chat_id) if chat_id else None
+
+
+def needs_chat_name(conversation_history: list, entry: dict) -> bool:
+    """True for the first titles/clarify turn of a chat (the history already includes `entry`)"""
+    if entry['reply_type'] not in ('titles', 'clarify'):
+        return False
+    earlier = conversation_history[:-1]
+    return not any(msg.get('reply_type') in ('titles', 'clarify') for msg in earlier)
+
+
+def session_generate(io, prompt, timeout, session, use_context, route_key=None, cancel=None):
+    """Generate, continuing from the session's KV context if asked, and keep the new context"""
+    options = {'context': session['context']} if use_context else {}
+    data = yield io.generate(prompt, timeout=timeout, route_key=route_key, cancel=cancel, **options)
+    session.update({'context': data.get('context') or [], 'model': io.model})
+    return data.get('response', '').strip()
+
+
+def session_stream(io, prompt, timeout, session, use_context, route_key=None, cancel=None):
+    options = {'context': session['context']} if use_context and session else {}
+    chunks = yield io.stream(prompt, timeout=timeout, route_key=route_key, cancel=cancel, **options)
+    while (chunk := (yield io.next_item(chunks))) is not None:
+        if chunk.get('response'):
+            yield Emit(chunk['response'])
+        if chunk.get('done') and session is not None:
+            session.update({'context': chunk.get('context') or [], 'model': io.model})
+
+
+def query_llm(io, prompt, timeout=120, session=None, followup_prompt=None, route_key=None, cancel=None):
+    """
+    Query Ollama LLM without any rule-based filtering. Raises LLMBusyError when saturated.
+    With a chat `session`, Ollama's returned KV context is kept in it and `followup_prompt`
+    (the turn without system prompt and history) is sent on top of it instead of `prompt`;
+    if Ollama rejects the cached context, the full prompt is sent on a fresh session.
+    `route_key` (the chat) keeps a chat on the same backend when several are configured.
+    A `cancel` token (see GenerationRegistry) aborts the generation with GenerationCancelled.
+    """
+    try:
+        if session is None:
+            data = yield io.generate(prompt, timeout=timeout, route_key=route_key, cancel=cancel)
+            return data.get('response', '').strip()
+        if followup_prompt and io.session_usable(session, followup_prompt):
+            try:
+                return (yield from session_generate(io, followup_prompt, timeout, session, use_context=True,
+                                                    route_key=route_key, cancel=cancel))
+            except io.status_error as e:
+                io.logger.info("Cached LLM context rejected, resending full prompt: %s", e)
+        session.clear()
+        return (yield from session_generate(io, prompt, timeout, session, use_context=False, route_key=route_key,
+                                            cancel=cancel))
+    except (LLMBusyError, GenerationCancelled):
+        raise
+    except io.timeout_error:
+        return TIMEOUT_TEXT
+    except io.connect_error:
+        return CONNECT_TEXT
+    except Exception as e:
+        return f"❌ Error: {str(e)}"
+
+
+def query_structured(io, prompt, timeout=120, route_key=None, cancel=None):
+    """
+    Ask Ollama for a PROJECTS_SCHEMA object in JSON mode, retrying once if the reply is not
+    usable. Returns the repaired JSON text, or None so the caller can fall back to plain text.
+    Raises LLMBusyError when saturated.
+    """
+    for attempt in range(2):
+        try:
+            data = yield io.generate(prompt, timeout=timeout, route_key=route_key, cancel=cancel,
+                                     format=PROJECTS_SCHEMA)
+        except (LLMBusyError, GenerationCancelled):
+            raise
+        except io.transport_error as e:
+            io.logger.warning("Structured generation failed: %s", e)
+            return None
+        parsed = parse_projects(data.get('response', ''))
+        if parsed is not None:
+            return json.dumps(parsed)
+        io.logger.info("Unusable structured reply (attempt %d)", attempt + 1)
+    return None
+
+
+def stream_llm(io, prompt, timeout=120, session=None, followup_prompt=None, route_key=None, cancel=None):
+    """Query Ollama in stream mode, emitting response tokens as they are generated (see query_llm for sessions)"""
+    try:
+        if session is not None and followup_prompt and io.session_usable(session, followup_prompt):
+            try:
+                # A rejected context fails before any token is emitted, so falling back is safe
+                yield from session_stream(io, followup_prompt, timeout, session, use_context=True,
+                                          route_key=route_key, cancel=cancel)
+                return
+            except io.status_error as e:
+                io.logger.info("Cached LLM context rejected, resending full prompt: %s", e)
+        if session is not None:
+            session.clear()
+        yield from session_stream(io, prompt, timeout, session, use_context=False, route_key=route_key,
+                                  cancel=cancel)
+    except (LLMBusyError, GenerationCancelled):
+        raise
+    except io.timeout_error:
+        yield Emit(TIMEOUT_TEXT)
+    except io.connect_error:
+        yield Emit(CONNECT_TEXT)
+    except Exception as e:
+        yield Emit(f"❌ Error: {str(e)}")
+
+
+def generate_turn_text(io, email: str, chat_id, plan: dict, timeout=120, session=None, cancel=None):
+    """
+    Get the LLM output for a planned turn, unless the response cache or a prefetch already has it.
+    `session` is the chat's LLM session and `cancel` its cancellation token (see query_llm).
+    """
+    ready = yield io.ready_text(email, chat_id, plan, session, cancel)
+    if ready is not None:
+        return ready
+    route_key = chat_route_key(email, chat_id)
+    if plan.get('structured'):
+        if session is not None:
+            session.clear()
+        llm_text = yield from query_structured(io, plan['prompt'], timeout=timeout, route_key=route_key,
+                                               cancel=cancel)
+        if llm_text is None:
+            llm_text = yield io.query_llm(plan['fallback_prompt'], timeout=timeout, route_key=route_key,
+                                          cancel=cancel)
+    else:
+        llm_text = yield io.query_llm(plan['prompt'], timeout=timeout, session=session,
+                                      followup_prompt=plan.get('followup_prompt'), route_key=route_key, cancel=cancel)
+    yield io.remember_text(plan, llm_text)
+    return llm_text
+
+
+def load_conversation(io, email: str, chat_id):
+    """
+    Recent history and prompt context of a chat, rebuilt from MongoDB when the state
+    store no longer has them. Returns (conversation_history, ConversationContext).
+    """
+    if not chat_id:
+        return [], ConversationContext(window=io.context_turns)
+    state = yield io.get_state(conversation_key(email, chat_id))
+    if state is None:
+        chat = yield io.get_chat(chat_id, email)
+        count = chat.get('message_count', 0) if chat else 0
+        conversation_history = []
+        if count:
+            conversation_history = yield io.get_messages(chat_id, email, start=max(0, count - HISTORY_MESSAGES))
+        context = ConversationContext.from_history(conversation_history, window=io.context_turns)
+        yield io.store_conversation(email, chat_id, conversation_history, context)
+        return conversation_history, context
+    return state['history'], ConversationContext.from_dict(state['context'], window=io.context_turns)
+
+
+def save_turn(io, email: str, chat_id, conversation_history: list, entry: dict):
+    """
+    Append the turn's message to MongoDB. Returns the (possibly new) chat id. A chat is only
+    created by its first real message, so greetings alone never leave an empty chat behind.
+    """
+    if not chat_id:
+        chat_id = str(ObjectId())
+    if entry['reply_type'] == 'greeting':
+        return chat_id
+    yield io.append_message(chat_id, email, entry, create=True)
+
+    # Name the chat in the background from its first real user message (not greeting)
+    if needs_chat_name(conversation_history, entry):
+        io.schedule_chat_name(email, chat_id, entry['user_message'])
+    return chat_id
+
+
+def complete_turn(io, email: str, chat_id, conversation_history: list, entry: dict, context: ConversationContext,
+                  intent: dict = None):
+    """Record a finished turn in the state store and MongoDB. Returns the chat id."""
+    yield io.record_intent(intent, entry)
+    conversation_history = conversation_history + [entry]
+    chat_id = yield from save_turn(io, email, chat_id, conversation_history, entry)
+    context.add(entry)
+    yield io.store_conversation(email, chat_id, conversation_history, context)
+    if entry['reply_type'] == 'titles' and not entry.get('projects'):
+        yield io.schedule_prefetch(email, chat_id, entry, context)
+    return chat_id
+
+
+def start_turn(io, email: str, chat_id, user_message: str, started: float):
+    """Load the chat and plan the turn, cancelling the chat's previous generation. Returns a Turn."""
+    with io.stage('load'):
+        conversation_history, context = yield from load_conversation(io, email, chat_id)
+    # A turn without a chat (clients get one from /new-chat first) starts one here, so its
+    # generation is never keyed, or cancelled, together with another new chat's
+    chat_id = chat_id or str(ObjectId())
+    with io.stage('plan'):
+        plan = io.plan_turn(user_message, conversation_history, context.render(), context.profile)
+    cancel = io.start_generation(email, chat_id)
+    return Turn(email, chat_id, user_message, conversation_history, context, plan, cancel, started)
+
+
+def finish_reply(io, turn: Turn, llm_text: str, stream=False):
+    """Parse and record the turn's reply. Returns its history entry and chat id."""
+    with io.stage('parse'):
+        entry = io.finish_turn(turn.plan, turn.user_message, llm_text)
+    if stream and turn.plan.get('structured'):
+        # Structured (JSON) output is not readable as it arrives, so it is sent formatted once parsed
+        yield event(type='token', text=entry['bot_reply'])
+    with io.stage('save'):
+        chat_id = yield from complete_turn(io, turn.email, turn.chat_id, turn.conversation_history, entry,
+                                           turn.context, turn.plan.get('intent'))
+    io.observe(turn, entry['reply_type'], stream=stream)
+    return entry, chat_id
+
+
+def reply(io, turn: Turn):
+    """Answer a turn in one response. Returns the response body and its status code."""
+    plan, session = turn.plan, turn.context.llm_session
+    try:
+        with io.stage('llm'):
+            if plan['prompt']:
+                llm_text = yield from generate_turn_text(io, turn.email, turn.chat_id, plan, timeout=120,
+                                                         session=session, cancel=turn.cancel)
+            else:
+                llm_text = io.stored_text(plan, session)
+    except LLMBusyError:
+        io.observe(turn, 'busy')
+        return {'reply': BUSY_REPLY, 'chat_id': turn.chat_id}, 503
+    except GenerationCancelled:
+        io.observe(turn, 'cancelled')
+        return {'reply': CANCELLED_REPLY, 'reply_type': 'cancelled', 'chat_id': turn.chat_id}, 409
+    finally:
+        io.finish_generation(turn.email, turn.chat_id, turn.cancel)
+    entry, chat_id = yield from finish_reply(io, turn, llm_text)
+    return {'reply': entry['bot_reply'], 'chat_id': chat_id}, 200
+
+
+def stream_turn(io, turn: Turn):
+    """
+    Emit NDJSON events for a turn: one 'token' event per streamed LLM token,
+    then a single 'done' event carrying the parsed reply once the stream completes.
+    Closing the steps while the LLM is generating (the client went away) cancels the generation.
+    """
+    plan, session = turn.plan, turn.context.llm_session
+    tokens = []
+    structured = plan.get('structured')
+    if plan['prompt']:
+        cached = yield io.ready_text(turn.email, turn.chat_id, plan, session, turn.cancel)
+    else:
+        cached = io.stored_text(plan, session) or None
+    if cached is not None:
+        tokens.append(cached)
+        if not structured:
+            yield event(type='token', text=cached)
+    elif plan['prompt']:
+        try:
+            with io.stage('llm'):
+                if structured:
+                    tokens.append((yield from generate_turn_text(io, turn.email, turn.chat_id, plan, timeout=120,
+                                                                 session=session, cancel=turn.cancel)))
+                else:
+                    llm_tokens = yield io.stream_llm(plan['prompt'], timeout=120, session=session,
+                                                     followup_prompt=plan.get('followup_prompt'),
+                                                     route_key=chat_route_key(turn.email, turn.chat_id),
+                                                     cancel=turn.cancel)
+                    while (token := (yield io.next_item(llm_tokens))) is not None:
+                        tokens.append(token)
+                        yield event(type='token', text=token)
+        except LLMBusyError:
+            io.observe(turn, 'busy', stream=True)
+            yield event(type='done', reply=BUSY_REPLY, reply_type='busy', chat_id=turn.chat_id)
+            return
+        except GenerationCancelled:
+            io.observe(turn, 'cancelled', stream=True)
+            yield event(type='done', reply=CANCELLED_REPLY, reply_type='cancelled', chat_id=turn.chat_id)
+            return
+        except GeneratorExit:
+            if turn.cancel is not None:
+                turn.cancel.cancel('disconnect')
+            raise
+        if not structured:
+            yield io.remember_text(plan, ''.join(tokens).strip())
+
+    entry, chat_id = yield from finish_reply(io, turn, ''.join(tokens), stream=True)
+    yield event(type='done', reply=entry['bot_reply'], reply_type=entry['reply_type'], chat_id=chat_id)
@@ -0,0 +1,76 @@
+import logging
+import os
+import threading
+import time
+
+from services.metrics import STARTUP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class ModelWarmUp:
+    """
+    Loads the model on the Ollama backends in the background when a process starts, so the
+    first chat after a cold start does not wait for Ollama to read it into memory; the
+    client's keep_alive then keeps it loaded. A failed attempt is retried every
+    `retry_interval` seconds until one succeeds. `ready` is what readiness probes report.
+    """
+
+    def __init__(self, client, enabled=True, timeout=300, retry_interval=10):
+        self.client = client
+        self.enabled = enabled
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.state = 'pending' if enabled else 'disabled'
+        self.attempts = 0
+        self.seconds = None
+        self.load_seconds = None
+        self.error = None
+        self._pid = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.state in ('ready', 'disabled')
+
+    def start(self):
+        """Start warming up in a background thread, once per process"""
+        with self._lock:
+            if not self.enabled or self._pid == os.getpid():
+                return False
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='llm-warmup', daemon=True)
+            self._thread.start()
+            return True
+
+    def _run(self):
+        while not self.warm_up():
+            time.sleep(self.retry_interval)
+
+    def warm_up(self):
+        """One attempt at loading the model; True once it is loaded"""
+        if self.state != 'ready':
+            self.state = 'warming'
+        self.attempts += 1
+        started = time.perf_counter()
+        try:
+            self.load_seconds = self.client.warm_up(timeout=self.timeout)
+        except Exception as e:
+            self.state, self.error = 'failed', str(e)
+            logger.warning("Model warm-up failed (attempt %d), retrying in %gs: %s", self.attempts, self.retry_interval, e)
+            return False
+        self.seconds = time.perf_counter() - started
+        self.state, self.error = 'ready', None
+        STARTUP_SECONDS.set(self.seconds, phase='warmup')
+        logger.info("Model %s warmed up in %.1fs (Ollama load %.1fs)", self.client.model, self.seconds, self.load_seconds)
+        return True
+
+    def status(self):
+        return {
+            'state': self.state,
+            'attempts': self.attempts,
+            'seconds': self.seconds,
+            'load_seconds': self.load_seconds,
+            'error': self.error,
+        }
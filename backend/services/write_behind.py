@@ -0,0 +1,447 @@
+"""
+Write-behind persistence of chat turns.
+
+WriteBehindChatStore acknowledges appended messages and prefetched replies as soon as
+they are written to a local append-only journal, and writes them to MongoDB in the
+background: every `interval` seconds, or sooner once `max_batch` writes are pending.
+A turn makes no MongoDB round trip at all.
+
+Messages are numbered when they are flushed: one atomic $inc of message_count per chat
+reserves numbers for all of its pending messages (and creates the chat on its first
+message), so workers writing to the same chat never give two messages the same number.
+The numbers are journalled before the messages are inserted, and messages of a replayed
+journal that are already stored are recognised by their _id, so replaying a journal that
+was partly flushed already is harmless. Other chat writes are coalesced into one
+idempotent update per chat (message_count and updated_at only move forward).
+
+Journal segments that were not flushed are replayed on startup, including those left by
+worker processes that are no longer running. Reads first flush the chat (or the user's
+chats) they read, so a process always sees its own writes.
+"""
+import glob
+import logging
+import os
+import re
+import threading
+import time
+from datetime import timezone
+
+from bson import ObjectId, json_util
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from services.chat_store import ChatStore
+from services.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+FLUSHES = REGISTRY.counter('write_behind_flushes_total', "Write-behind flushes to MongoDB", ['result'])
+FLUSH_SECONDS = REGISTRY.histogram('write_behind_flush_seconds', "Time to flush pending chat writes to MongoDB")
+# Journalled times are read back in UTC, comparable with those of new writes
+JOURNAL_JSON = json_util.JSONOptions(tz_aware=True, tzinfo=timezone.utc)
+SEGMENT_PATTERN = re.compile(r'journal-(\d+)-(\d+)\.jsonl$')
+DUPLICATE_KEY = 11000
+
+
+class PendingChat:
+    """Coalesced writes to one chat that are not in MongoDB yet"""
+
+    def __init__(self, email):
+        self.email = email
+        self.count = None
+        self.updated_at = None
+        # None, or ('merge' | 'replace', {key: text}): set some keys, or replace the whole field
+        self.prefetched = None
+        self.messages = []
+        # _ids of replayed messages without a number, which may have been stored already
+        self.replayed = set()
+        self.writes = 0
+
+    def touch(self, when):
+        self.updated_at = max(self.updated_at, when) if self.updated_at else when
+
+    def set_prefetched(self, key, text):
+        mode, values = self.prefetched or ('merge', {})
+        self.prefetched = (mode, {**values, key: text})
+
+    def merge(self, newer):
+        """Fold in the writes of `newer`, which were made after these"""
+        if newer.count is not None:
+            self.count = max(self.count or 0, newer.count)
+        if newer.updated_at:
+            self.touch(newer.updated_at)
+        if newer.prefetched and newer.prefetched[0] == 'merge' and self.prefetched:
+            self.prefetched = (self.prefetched[0], {**self.prefetched[1], **newer.prefetched[1]})
+        elif newer.prefetched:
+            self.prefetched = newer.prefetched
+        self.messages += newer.messages
+        self.replayed |= newer.replayed
+        self.writes += newer.writes
+        return self
+
+    def number(self, seqs):
+        """Give messages the numbers reserved for them (a list of [_id, seq] pairs)"""
+        seqs = dict((oid, seq) for oid, seq in seqs)
+        for message in self.messages:
+            if message['_id'] in seqs:
+                message['seq'] = seqs[message['_id']]
+                self.replayed.discard(message['_id'])
+                self.count = max(self.count or 0, message['seq'] + 1)
+
+    def chat_update(self, chat_oid):
+        update = {}
+        maximum = {key: value for key, value in (('message_count', self.count), ('updated_at', self.updated_at))
+                   if value is not None}
+        if maximum:
+            update['$max'] = maximum
+        if self.prefetched:
+            mode, values = self.prefetched
+            if mode == 'merge':
+                update['$set'] = {f'prefetched.{key}': text for key, text in values.items()}
+            elif values:
+                update['$set'] = {'prefetched': values}
+            else:
+                update['$unset'] = {'prefetched': ''}
+        if not update:
+            return None
+        return UpdateOne({'_id': chat_oid, 'email': self.email}, update)
+
+
+class WriteBehindChatStore(ChatStore):
+    """
+    ChatStore whose writes reach MongoDB in the background, journalled in `journal_dir`.
+    With `fsync` each journal write is also synced to disk, surviving power loss as well
+    as crashes of the process. Call close() on shutdown to flush what is pending.
+    """
+
+    def __init__(self, chats, messages, journal_dir, interval=0.5, max_batch=500, fsync=False):
+        super().__init__(chats, messages)
+        self.journal_dir = journal_dir
+        self.interval = interval
+        self.max_batch = max_batch
+        self.fsync = fsync
+        self._pending = {}
+        self._pending_writes = 0
+        self._segments = []
+        self._journal = None
+        self._segment_number = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._thread = None
+        self._closed = False
+        self._flushed = 0
+        self._failed = 0
+        os.makedirs(journal_dir, exist_ok=True)
+
+    # Writes
+
+    def append_message(self, chat_id, email, entry, create=False):
+        """
+        Queue one message for a chat. Its number is only reserved when it is flushed, so this
+        returns the message's _id instead, or None for a chat known to be another user's (or,
+        without `create`, not to exist). A new chat id that turns out to be another user's
+        is only found out at the flush, which drops its writes.
+        """
+        oid = ObjectId(chat_id)
+        with self._lock:
+            pending = self._pending.get(str(oid))
+        if pending is not None and pending.email != email:
+            return None
+        if not create and pending is None and not self.chats.find_one({'_id': oid, 'email': email}, {'_id': 1}):
+            return None
+        message = self._message_doc(oid, email, None, entry)
+        del message['seq']
+        # Journalled with its own _id, which tells a replay of it apart from any other message
+        message['_id'] = ObjectId()
+        self._write({'op': 'append', 'chat_id': oid, 'email': email, 'message': message})
+        return str(message['_id'])
+
+    def set_prefetched(self, chat_id, email, key, text):
+        self._write({'op': 'prefetch', 'chat_id': ObjectId(chat_id), 'email': email, 'key': key, 'text': text})
+
+    def clear_prefetched(self, chat_id, email):
+        self._write({'op': 'clear_prefetched', 'chat_id': ObjectId(chat_id), 'email': email})
+
+    # Reads see this process's pending writes of what they read
+
+    def get_chat(self, chat_id, email):
+        self.flush(chat_id)
+        return super().get_chat(chat_id, email)
+
+    def get_prefetched(self, chat_id, email, key):
+        with self._lock:
+            chat = self._pending.get(str(ObjectId(chat_id)))
+            if chat is not None and chat.email == email and chat.prefetched:
+                mode, values = chat.prefetched
+                if key in values or mode == 'replace':
+                    return values.get(key)
+        return super().get_prefetched(chat_id, email, key)
+
+    def list_chats(self, email, limit=30, cursor=None):
+        self.flush(email=email)
+        return super().list_chats(email, limit=limit, cursor=cursor)
+
+    def get_messages(self, chat_id, email, start=0, limit=0, fields=None):
+        self.flush(chat_id)
+        return super().get_messages(chat_id, email, start=start, limit=limit, fields=fields)
+
+    def search_messages(self, email, query, limit=20):
+        self.flush(email=email)
+        return super().search_messages(email, query, limit=limit)
+
+    def delete_chat(self, chat_id, email):
+        # Everything, so no journal segment is left that a replay could recreate the chat from
+        self.flush()
+        return super().delete_chat(chat_id, email)
+
+    # Journal and flushing
+
+    def _write(self, op):
+        with self._lock:
+            self._write_locked(op)
+
+    def _write_locked(self, op):
+        if self._closed:
+            raise RuntimeError("Chat store is closed")
+        self._journal_locked(op)
+        self._apply(op)
+        self._start()
+        if self._pending_writes >= self.max_batch:
+            self._wake.notify()
+
+    def _journal_locked(self, op):
+        if self._journal is None:
+            self._open_segment()
+        self._journal.write(json_util.dumps(op) + "\n")
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+    def _journal_numbers(self, op, segment):
+        """Journal the numbers reserved for messages, next to the messages themselves"""
+        if segment is None:
+            with self._lock:
+                self._journal_locked(op)
+            return
+        with open(segment, 'a', encoding='utf-8') as f:
+            f.write(json_util.dumps(op) + "\n")
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def _start(self):
+        # Started on the first write, so a process forked after building the store gets its own
+        # (a thread started before a fork is not running in the child)
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+
+    def _apply(self, op, replayed=False):
+        key = str(op['chat_id'])
+        if op['op'] == 'number':
+            # Numbers of messages that are still pending; the others were flushed already
+            if key in self._pending:
+                self._pending[key].number(op['seqs'])
+            return
+        chat = self._pending.setdefault(key, PendingChat(op['email']))
+        chat.writes += 1
+        self._pending_writes += 1
+        # Chats are created by their first message when it is flushed, so a 'create' op left
+        # in an older journal changes nothing
+        if op['op'] == 'append':
+            message = op['message']
+            chat.messages.append(message)
+            if 'seq' in message:
+                # Numbered when it was journalled, by an older version
+                chat.count = max(chat.count or 0, message['seq'] + 1)
+            elif replayed:
+                chat.replayed.add(message['_id'])
+            chat.touch(message['created_at'])
+        elif op['op'] == 'prefetch':
+            chat.set_prefetched(op['key'], op['text'])
+        elif op['op'] == 'clear_prefetched':
+            chat.prefetched = ('replace', {})
+
+    def _open_segment(self):
+        self._journal = open(self._segment_path(), 'a', encoding='utf-8')
+        self._segments.append(self._journal.name)
+
+    def _segment_path(self):
+        # Numbered from the clock, so a restarted process with the same pid never reuses one
+        self._segment_number = max(self._segment_number + 1, time.time_ns())
+        return os.path.join(self.journal_dir, f"journal-{os.getpid()}-{self._segment_number}.jsonl")
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._closed and self._pending_writes < self.max_batch:
+                    self._wake.wait(self.interval)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning("Write-behind flush failed, retrying: %s", e)
+                time.sleep(self.interval)
+
+    def flush(self, chat_id=None, email=None):
+        """
+        Write what is pending to MongoDB: everything, or only the writes of one chat or of one
+        user's chats. On failure it stays pending (and journalled). Returns the writes flushed.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if chat_id is None and email is None:
+                    if not self._pending and not self._segments:
+                        return 0
+                    batch, segments = self._pending, self._segments
+                    self._pending, self._segments = {}, []
+                    if self._journal is not None:
+                        self._journal.close()
+                        self._journal = None
+                else:
+                    # The journal segments also hold other chats' writes, so they are kept
+                    keys = [key for key, chat in self._pending.items()
+                            if (chat_id is None or key == str(ObjectId(chat_id)))
+                            and (email is None or chat.email == email)]
+                    if not keys:
+                        return 0
+                    batch, segments = {key: self._pending.pop(key) for key in keys}, []
+                writes = sum(chat.writes for chat in batch.values())
+                self._pending_writes -= writes
+            started = time.perf_counter()
+            try:
+                self._bulk_write(batch, segments[-1] if segments else None)
+            except Exception:
+                FLUSHES.inc(result='error')
+                with self._lock:
+                    self._failed += 1
+                    for key, newer in self._pending.items():
+                        batch[key] = batch[key].merge(newer) if key in batch else newer
+                    self._pending, self._pending_writes = batch, self._pending_writes + writes
+                    self._segments = segments + self._segments
+                raise
+            FLUSH_SECONDS.observe(time.perf_counter() - started)
+            FLUSHES.inc(result='ok')
+            for path in segments:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            with self._lock:
+                self._flushed += writes
+            return writes
+
+    def _bulk_write(self, batch, segment):
+        self._skip_stored(batch)
+        refused = {key for key, chat in batch.items() if not self._number_messages(ObjectId(key), chat, segment)}
+        chat_writes = [chat.chat_update(ObjectId(key)) for key, chat in batch.items() if key not in refused]
+        chat_writes = [write for write in chat_writes if write is not None]
+        if chat_writes:
+            self.chats.bulk_write(chat_writes, ordered=False)
+        messages = [message for key, chat in batch.items() if key not in refused for message in chat.messages]
+        if messages:
+            try:
+                self.messages.bulk_write([InsertOne(message) for message in messages], ordered=False)
+            except BulkWriteError as e:
+                errors = e.details.get('writeErrors', [])
+                if any(error.get('code') != DUPLICATE_KEY for error in errors) or e.details.get('writeConcernErrors'):
+                    raise
+                # Only messages already stored under their own _id are replays (of a journal
+                # flushed just before a crash, or of a retried flush); anything else is a conflict
+                ids = [messages[error['index']].get('_id') for error in errors]
+                stored = {doc['_id'] for doc in self.messages.find({'_id': {'$in': ids}}, {'_id': 1})}
+                if None in ids or not stored.issuperset(ids):
+                    raise
+
+    def _skip_stored(self, batch):
+        """Drop replayed messages that were stored before their numbers could be journalled"""
+        ids = [oid for chat in batch.values() for oid in chat.replayed]
+        if not ids:
+            return
+        stored = {doc['_id'] for doc in self.messages.find({'_id': {'$in': ids}}, {'_id': 1})}
+        for chat in batch.values():
+            chat.messages = [message for message in chat.messages if message['_id'] not in stored]
+            chat.replayed -= stored
+
+    def _number_messages(self, chat_oid, chat, segment):
+        """
+        Reserve numbers for a chat's new messages with one atomic $inc, which also creates the
+        chat. Returns False if the chat id is another user's, whose writes are then dropped.
+        """
+        new = [message for message in chat.messages if 'seq' not in message]
+        if not new:
+            return True
+        try:
+            doc = self._reserve(chat_oid, chat.email, True, count=len(new))
+        except DuplicateKeyError:
+            logger.warning("Dropping %d writes to chat %s, which is another user's", chat.writes, chat_oid)
+            return False
+        first = doc['message_count'] - len(new)
+        seqs = [[message['_id'], first + offset] for offset, message in enumerate(new)]
+        self._journal_numbers({'op': 'number', 'chat_id': chat_oid, 'email': chat.email, 'seqs': seqs}, segment)
+        chat.number(seqs)
+        return True
+
+    def replay(self):
+        """
+        Queue the writes of journal segments left unflushed by an earlier run of this process
+        or by processes that are gone; call it before any writes. Each segment is claimed by
+        renaming it, so only one process replays it. Returns the number of writes replayed.
+        """
+        replayed = 0
+        segments = []
+        for path in glob.glob(os.path.join(self.journal_dir, 'journal-*.jsonl')):
+            match = SEGMENT_PATTERN.search(path)
+            if match and (int(match.group(1)) == os.getpid() or not process_alive(int(match.group(1)))):
+                segments.append((int(match.group(1)), int(match.group(2)), path))
+        for _, _, path in sorted(segments):
+            with self._lock:
+                claimed = self._segment_path()
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            with open(claimed, encoding='utf-8') as f:
+                ops = [json_util.loads(line, json_options=JOURNAL_JSON) for line in f if line.strip()]
+            with self._lock:
+                for op in ops:
+                    self._apply(op, replayed=True)
+                self._segments.append(claimed)
+            replayed += sum(1 for op in ops if op['op'] != 'number')
+        if replayed:
+            self._start()
+        return replayed
+
+    def close(self):
+        """Stop the background flushes and write out what is pending"""
+        with self._lock:
+            self._closed = True
+            self._wake.notify()
+        if self._thread is not None:
+            self._thread.join(self.interval + 5)
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error("Could not flush chat writes on shutdown, they stay in the journal: %s", e)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'pending_writes': self._pending_writes,
+                'pending_chats': len(self._pending),
+                'flushed': self._flushed,
+                'failed_flushes': self._failed,
+                'journal_segments': len(self._segments),
+            }
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,175 @@
+"""
+A stand-in for Ollama's HTTP API, for benchmarks.
+
+Serves /api/generate (blocking and streamed), /api/embeddings and /api/tags with canned
+answers shaped like the real model's: 10 titles, 5 problem statements, a 2-line overview
+or a 1-2 word chat name depending on the prompt, or the JSON object asked for with
+`format`. `latency` is the time to the first token and `token_rate` the tokens generated
+per second after it.
+
+    python benchmarks/fake_ollama.py --port 11434 --latency 0.3 --token-rate 40
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TITLES = [
+    "Spam Email Classifier", "Handwritten Digit Recognizer", "Movie Recommendation Engine",
+    "Sentiment Analysis Dashboard", "Stock Price Trend Predictor", "Fake News Detector",
+    "Plant Disease Identifier", "Resume Screening Assistant", "Traffic Sign Classifier",
+    "Customer Churn Predictor",
+]
+PROBLEMS = [
+    "Small teams receive too much unsolicited email to review by hand.",
+    "Existing filters miss spam written to look like personal messages.",
+    "Users cannot see why a message was flagged, so they stop trusting the filter.",
+    "Filters trained on English mail perform poorly on mixed-language inboxes.",
+    "Retraining a filter on new spam patterns takes days instead of minutes.",
+]
+OVERVIEW = [
+    "Build a classifier that flags unwanted messages and explains each decision.",
+    "It suits a beginner in Python and ML because it uses small datasets and standard libraries.",
+]
+
+
+def canned_reply(prompt, structured=False):
+    if structured:
+        return json.dumps({'question': '', 'projects': [
+            {'title': title, 'problems': PROBLEMS, 'reason': OVERVIEW[1]} for title in TITLES
+        ]})
+    if 'Extract the main topic' in prompt:
+        return "Machine Learning"
+    if 'Selected problem statement:' in prompt:
+        return '\n'.join(OVERVIEW)
+    if 'problem statements' in prompt:
+        return '\n'.join(f"{i}. {p}" for i, p in enumerate(PROBLEMS, 1))
+    return '\n'.join(f"{i}. {t}" for i, t in enumerate(TITLES, 1))
+
+
+def tokenize(text):
+    """Split text into word-sized tokens that join back to the original"""
+    tokens, start = [], 0
+    for i, ch in enumerate(text):
+        if ch in ' \n' and i > start:
+            tokens.append(text[start:i])
+            start = i
+    tokens.append(text[start:])
+    return tokens
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def send_json(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, data):
+        line = (json.dumps(data) + '\n').encode()
+        self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path != '/api/tags':
+            self.send_error(404)
+            return
+        self.send_json({'models': [{'name': 'llama3:latest'}]})
+
+    def do_POST(self):
+        payload = self.read_json()
+        if self.path == '/api/embeddings':
+            digest = hashlib.sha256(payload.get('prompt', '').encode()).digest()
+            return self.send_json({'embedding': [b / 255 for b in digest]})
+        if self.path != '/api/generate':
+            self.send_error(404)
+            return
+
+        server = self.server
+        prompt = payload.get('prompt', '')
+        if not prompt:
+            # Ollama only loads the model for an empty prompt
+            return self.send_json({'model': payload.get('model'), 'response': '', 'done': True,
+                                   'done_reason': 'load', 'load_duration': 0})
+        tokens = tokenize(canned_reply(prompt, structured=bool(payload.get('format'))))
+        context = list(payload.get('context') or []) + list(range(len(prompt.split()) + len(tokens)))
+        started = time.perf_counter()
+        time.sleep(server.latency)
+
+        def done_stats():
+            return {
+                'model': payload.get('model'),
+                'done': True,
+                'context': context,
+                'prompt_eval_count': len(prompt.split()),
+                'eval_count': len(tokens),
+                'eval_duration': int(len(tokens) / server.token_rate * 1e9),
+                'total_duration': int((time.perf_counter() - started) * 1e9),
+            }
+
+        if not payload.get('stream', True):
+            time.sleep(len(tokens) / server.token_rate)
+            return self.send_json({**done_stats(), 'response': ''.join(tokens)})
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for token in tokens:
+            time.sleep(1 / server.token_rate)
+            self.send_chunk({'model': payload.get('model'), 'response': token, 'done': False})
+        self.send_chunk({**done_stats(), 'response': ''})
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class FakeOllama:
+    """A fake Ollama server on a background thread; `url` is its /api/generate endpoint"""
+
+    def __init__(self, latency=0.2, token_rate=50, host='127.0.0.1', port=0):
+        self.server = ThreadingHTTPServer((host, port), FakeOllamaHandler)
+        self.server.daemon_threads = True
+        self.server.latency = latency
+        self.server.token_rate = token_rate
+        self.thread = threading.Thread(target=self.server.serve_forever, name='fake-ollama', daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api/generate"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11434)
+    parser.add_argument('--latency', type=float, default=0.2, help="seconds to the first token")
+    parser.add_argument('--token-rate', type=float, default=50, help="tokens per second")
+    args = parser.parse_args()
+    fake = FakeOllama(args.latency, args.token_rate, args.host, args.port)
+    print(f"Fake Ollama listening on {fake.url}")
+    fake.server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+"""
+End-to-end load benchmark for backend/app.py.
+
+Each virtual user signs up and then repeatedly logs in and walks a full recommendation
+flow: greeting, project titles, problem selection, overview, chat history, reopening the
+chat, starting a new one and logging out. Requests go through the real Flask app (in-process by
+default, or a running server with --base-url). The LLM is the fake Ollama server in
+fake_ollama.py, and MongoDB is mongomock unless --mongo-uri is given.
+
+    python benchmarks/run.py --users 8 --iterations 5 --latency 0.2 --token-rate 50
+    python benchmarks/run.py --save baseline.json
+    python benchmarks/run.py --baseline baseline.json --tolerance 0.25
+
+App settings (LLM_MAX_IN_FLIGHT, RESPONSE_CACHE_SIZE, ...) are read from the environment
+as usual; RESPONSE_CACHE_SIZE=0 measures every turn on the LLM path.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'backend'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_ollama import FakeOllama
+
+PROFILES = [
+    "I'm a beginner in Python, interested in machine learning, and I have 2 weeks",
+    "Intermediate JavaScript developer, web apps, about 1 month",
+    "Advanced Python, NLP, 3 weeks",
+    "Beginner, Java, IoT, a couple of weeks",
+    "Some experience with Python and computer vision, 1-2 weeks",
+    "Expert in Rust, blockchain, 2 months",
+    "New to programming, Python, data science, 3 weeks",
+    "Intermediate Go developer into generative AI, 1 month",
+]
+PASSWORD = 'bench-password'
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class Recorder:
+    """Collects per-endpoint latencies from all virtual users"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, ok=True):
+        with self._lock:
+            self.samples[name].append(seconds)
+            if not ok:
+                self.errors[name] += 1
+
+    def report(self, duration):
+        endpoints = {}
+        for name, values in sorted(self.samples.items()):
+            endpoints[name] = {
+                'count': len(values),
+                'errors': self.errors[name],
+                'throughput': len(values) / duration,
+                'p50_ms': percentile(values, 50) * 1000,
+                'p95_ms': percentile(values, 95) * 1000,
+                'p99_ms': percentile(values, 99) * 1000,
+            }
+        total = sum(len(v) for v in self.samples.values())
+        return {
+            'duration_s': duration,
+            'requests': total,
+            'errors': sum(self.errors.values()),
+            'throughput': total / duration if duration else 0,
+            'endpoints': endpoints,
+        }
+
+
+class LocalClient:
+    """Flask test client with the same call shape as RemoteClient"""
+
+    def __init__(self, flask_app):
+        self.client = flask_app.test_client()
+
+    def request(self, method, path, **kwargs):
+        response = self.client.open(path, method=method, **kwargs)
+        body = response.get_data()
+        return response.status_code, body
+
+
+class RemoteClient:
+    """Keep-alive HTTP client for a running server"""
+
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def request(self, method, path, **kwargs):
+        response = self.session.request(method, self.base_url + path, allow_redirects=False, **kwargs)
+        return response.status_code, response.content
+
+
+class VirtualUser:
+    def __init__(self, client, recorder, email, rng, stream=False):
+        self.client = client
+        self.recorder = recorder
+        self.email = email
+        self.rng = rng
+        self.stream = stream
+
+    def call(self, name, method, path, expect=(200,), **kwargs):
+        started = time.perf_counter()
+        status, body = self.client.request(method, path, **kwargs)
+        ok = status in expect
+        self.recorder.add(name, time.perf_counter() - started, ok)
+        if not ok:
+            raise BenchmarkError(f"{name}: HTTP {status}: {body[:200]!r}")
+        return body
+
+    def chat(self, name, message, chat_id):
+        body = self.call(name, 'POST', '/chatbot', json={'message': message, 'chat_id': chat_id, 'stream': self.stream})
+        data = json.loads(body.splitlines()[-1]) if self.stream else json.loads(body)
+        if data.get('reply_type') == 'busy':
+            raise BenchmarkError(f"{name}: LLM busy")
+        return data
+
+    def signup(self):
+        self.call('signup', 'POST', '/signup', data={
+            'email': self.email, 'password': PASSWORD, 'confirm_password': PASSWORD
+        })
+
+    def scenario(self):
+        self.call('login', 'POST', '/login', expect=(302,), data={'email': self.email, 'password': PASSWORD})
+        chat_id = self.chat('chatbot:greeting', 'hi', None)['chat_id']
+        self.chat('chatbot:titles', self.rng.choice(PROFILES), chat_id)
+        self.chat('chatbot:problems', str(self.rng.randint(1, 10)), chat_id)
+        self.chat('chatbot:overview', str(self.rng.randint(1, 5)), chat_id)
+        self.call('get-chat-history', 'GET', '/get-chat-history')
+        self.call('get-chat', 'GET', f'/get-chat/{chat_id}')
+        self.call('new-chat', 'POST', '/new-chat')
+        # Log out so the next login checks the password again
+        self.call('logout', 'GET', '/logout', expect=(302,))
+
+    def run(self, iterations):
+        for _ in range(iterations):
+            try:
+                self.scenario()
+            except BenchmarkError as e:
+                print(f"  {self.email}: {e}", file=sys.stderr)
+
+
+def load_app(ollama_url, mongo_uri):
+    """Import backend/app.py against the fake LLM and mongomock (or a real MongoDB)"""
+    os.environ['OLLAMA_URL'] = ollama_url
+    os.environ.setdefault('MONGO_ENSURE_INDEXES', '1' if mongo_uri else '0')
+    # Every virtual user logs in from the same address
+    os.environ.setdefault('AUTH_IP_LIMIT', '0')
+    os.environ.setdefault('AUTH_EMAIL_LIMIT', '0')
+    if mongo_uri:
+        os.environ['MONGO_URI'] = mongo_uri
+        import app
+    else:
+        import mongomock
+        with mock.patch('pymongo.MongoClient', mongomock.MongoClient):
+            import app
+    app.create_app()
+    return app
+
+
+def run(args):
+    fake = None
+    if not args.base_url:
+        fake = FakeOllama(args.latency, args.token_rate).start()
+        flask_app = load_app(fake.url, args.mongo_uri).app
+        make_client = lambda: LocalClient(flask_app)
+    else:
+        make_client = lambda: RemoteClient(args.base_url)
+
+    warmup = Recorder()
+    run_id = f"{args.seed}-{int(time.time())}"
+    users = [
+        VirtualUser(make_client(), warmup, f"bench{i}-{run_id}@example.com", random.Random(args.seed + i), args.stream)
+        for i in range(args.users)
+    ]
+    for user in users:
+        user.signup()
+        if args.warmup:
+            user.run(1)
+
+    recorder = Recorder()
+    for user in users:
+        user.recorder = recorder
+    threads = [threading.Thread(target=user.run, args=(args.iterations,)) for user in users]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report = recorder.report(time.perf_counter() - started)
+    report['config'] = {
+        'users': args.users, 'iterations': args.iterations, 'stream': args.stream, 'seed': args.seed,
+        'latency': args.latency, 'token_rate': args.token_rate,
+    }
+    if fake:
+        fake.stop()
+    return report
+
+
+def print_report(report):
+    print(f"{'endpoint':<20}{'count':>7}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, row in report['endpoints'].items():
+        print(f"{name:<20}{row['count']:>7}{row['errors']:>8}{row['throughput']:>9.1f}"
+              f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}")
+    print(f"\n{report['requests']} requests in {report['duration_s']:.2f}s "
+          f"({report['throughput']:.1f} req/s, {report['errors']} errors)")
+
+
+def compare(report, baseline, tolerance, min_delta_ms=5):
+    """
+    Regressions against a saved report: throughput down or p95 latency up by more than
+    `tolerance`; latency changes under `min_delta_ms` are treated as noise.
+    """
+    regressions = []
+    if report['throughput'] < baseline['throughput'] * (1 - tolerance):
+        regressions.append(f"throughput {baseline['throughput']:.1f} -> {report['throughput']:.1f} req/s")
+    for name, old in baseline['endpoints'].items():
+        new = report['endpoints'].get(name)
+        if new and new['p95_ms'] > old['p95_ms'] * (1 + tolerance) and new['p95_ms'] - old['p95_ms'] > min_delta_ms:
+            regressions.append(f"{name} p95 {old['p95_ms']:.1f} -> {new['p95_ms']:.1f} ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end load benchmark for the chat app")
+    parser.add_argument('--users', type=int, default=4, help="concurrent virtual users")
+    parser.add_argument('--iterations', type=int, default=3, help="scenarios per user")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stream', action='store_true', help="use streamed /chatbot replies")
+    parser.add_argument('--no-warmup', dest='warmup', action='store_false')
+    parser.add_argument('--latency', type=float, default=0.2, help="fake LLM seconds to first token")
+    parser.add_argument('--token-rate', type=float, default=50, help="fake LLM tokens per second")
+    parser.add_argument('--mongo-uri', help="use this MongoDB instead of mongomock")
+    parser.add_argument('--base-url', help="benchmark a running server instead (it must use its own LLM and database)")
+    parser.add_argument('--save', help="write the report as JSON")
+    parser.add_argument('--baseline', help="compare against a saved report; exit 1 on regression")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--min-delta-ms', type=float, default=5, help="ignore p95 changes smaller than this")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    print_report(report)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance, args.min_delta_ms)
+        for line in regressions:
+            print(f"REGRESSION: {line}")
+        return 1 if regressions else 0
+    return 1 if report['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
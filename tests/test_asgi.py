@@ -0,0 +1,92 @@
+import asyncio
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+os.environ.setdefault('MONGO_ENSURE_INDEXES', '0')
+
+try:
+    from starlette.testclient import TestClient
+    import asgi
+except ImportError:  # async serving mode dependencies not installed
+    asgi = None
+
+from services.chat_store import AsyncChatStore
+from services.llm import LLMBusyError
+from services.state_store import MemoryStateStore
+from services.turns import BUSY_REPLY, CONNECT_TEXT
+
+
+@unittest.skipIf(asgi is None, "starlette/httpx/a2wsgi not installed")
+class TestAsyncChatbot(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(asgi.application)
+        with asgi.flask_module.app.test_request_context():
+            serializer = asgi.flask_module.app.session_interface.get_signing_serializer(asgi.flask_module.app)
+            self.client.cookies.set('session', serializer.dumps({'email': 'test@example.com'}))
+        self.store = mock.patch.object(asgi, 'chat_store', spec=AsyncChatStore).start()
+        self.store.get_chat = mock.AsyncMock(return_value=None)
+        self.store.append_message = mock.AsyncMock(return_value=0)
+        mock.patch.object(asgi.flask_module, 'conversation_store', MemoryStateStore()).start()
+        mock.patch.object(asgi.flask_module, 'schedule_chat_name').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_requires_login(self):
+        self.client.cookies.clear()
+        response = self.client.post('/chatbot', json={'message': 'hi'})
+        self.assertEqual(response.status_code, 401)
+
+    def test_titles_turn(self):
+        with mock.patch.object(asgi, 'query_llm', mock.AsyncMock(return_value='1. Spam Filter\n2. Chess AI')):
+            response = self.client.post('/chatbot', json={'message': 'python ML for beginners, rust free'})
+        chat_id = response.json()['chat_id']
+        self.assertEqual(response.json(), {'reply': '1. Spam Filter\n2. Chess AI', 'chat_id': chat_id})
+        # The chat is created by its first message
+        self.store.append_message.assert_awaited_once()
+        self.assertEqual(self.store.append_message.await_args[0][0], chat_id)
+        self.assertTrue(self.store.append_message.await_args[1]['create'])
+
+    def test_streamed_turn(self):
+        async def tokens(prompt, timeout=120, **kwargs):
+            for token in ['Which ', 'language?']:
+                yield token
+
+        with mock.patch.object(asgi, 'stream_llm', tokens):
+            response = self.client.post('/chatbot', json={
+                'message': 'something fun', 'chat_id': '65f000000000000000000001', 'stream': True
+            })
+        events = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual(events[-1]['reply'], 'Which language?')
+        self.assertEqual(events[-1]['reply_type'], 'clarify')
+
+    def test_busy_llm(self):
+        with mock.patch.object(asgi, 'query_llm', mock.AsyncMock(side_effect=LLMBusyError('busy'))):
+            response = self.client.post('/chatbot', json={'message': 'python ML for beginners, rust free'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['reply'], BUSY_REPLY)
+        self.store.append_message.assert_not_called()
+
+    def test_llm_errors_become_replies(self):
+        llm = mock.Mock(model=asgi.llm_client.model)
+        llm.generate = mock.AsyncMock(side_effect=asgi.httpx.ConnectError('refused'))
+        with mock.patch.object(asgi, 'llm_client', llm):
+            self.assertEqual(asyncio.run(asgi.query_llm('prompt')), CONNECT_TEXT)
+
+    def test_mongo_opened_on_startup(self):
+        # Importing the module connects nothing; each worker opens its client in the lifespan
+        mock.patch.object(asgi, 'chat_store', None).start()
+        mock.patch.object(asgi, 'mongo_client', None).start()
+        asgi.open_mongo()
+        self.assertIsInstance(asgi.chat_store, AsyncChatStore)
+        asyncio.run(asgi.mongo_client.close())
+
+    def test_other_routes_served_by_flask(self):
+        response = self.client.get('/', follow_redirects=False)
+        self.assertEqual(response.status_code, 302)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+os.environ.setdefault('MONGO_ENSURE_INDEXES', '0')
+
+import app as app_module
+from services.hashing import AdmissionLimiter, HasherBusyError, PasswordHasher
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+class TestPasswordHasher(unittest.TestCase):
+    def test_hashes_in_worker_process(self):
+        hasher = PasswordHasher(workers=1)
+        hasher.start()
+        self.addCleanup(hasher.shutdown)
+        hashed = hasher.hash('secret1')
+        self.assertTrue(hasher.verify(hashed, 'secret1'))
+        self.assertFalse(hasher.verify(hashed, 'wrong'))
+        self.assertFalse(hasher.verify('', 'secret1'))
+        self.assertEqual(hasher.metrics()['completed'], 4)
+
+    def test_runs_inline_until_started(self):
+        hasher = PasswordHasher(workers=1)
+        self.addCleanup(hasher.shutdown)
+        # A lambda cannot be sent to a worker process
+        self.assertEqual(hasher.run(lambda: 'inline'), 'inline')
+
+    def test_rejects_beyond_queue(self):
+        hasher = PasswordHasher(workers=0, max_queue=1)
+        started = threading.Event()
+        thread = threading.Thread(target=hasher.run, args=(lambda: started.set() or time.sleep(0.2),))
+        thread.start()
+        started.wait(1)
+        with self.assertRaises(HasherBusyError):
+            hasher.hash('secret1')
+        thread.join()
+        self.assertEqual(hasher.metrics()['rejected'], 1)
+
+    def test_slow_hash_times_out(self):
+        hasher = PasswordHasher(workers=1, timeout=0.2)
+        hasher.start()
+        self.addCleanup(hasher.shutdown)
+        with self.assertRaises(HasherBusyError):
+            hasher.run(time.sleep, 2)
+
+    def test_timed_out_hashes_stay_pending_until_done(self):
+        hasher = PasswordHasher(workers=1, max_queue=1, timeout=0.1)
+        hasher.start()
+        self.addCleanup(hasher.shutdown)
+        for _ in range(2):
+            with self.assertRaises(HasherBusyError):
+                hasher.run(time.sleep, 0.5)
+        # Both are still held by the pool, so the queue is full
+        self.assertEqual(hasher.metrics()['pending'], 2)
+        with self.assertRaises(HasherBusyError):
+            hasher.run(time.sleep, 0)
+        self.assertEqual(hasher.metrics()['rejected'], 1)
+        deadline = time.monotonic() + 10
+        while hasher.metrics()['pending'] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(hasher.metrics()['pending'], 0)
+        self.assertEqual(hasher.run(time.sleep, 0), None)
+
+    def test_admission_window(self):
+        limiter = AdmissionLimiter(2, window=0.1)
+        self.assertEqual([limiter.allow('ip') for _ in range(3)], [True, True, False])
+        self.assertTrue(limiter.allow('other'))
+        time.sleep(0.15)
+        self.assertTrue(limiter.allow('ip'))
+        self.assertTrue(AdmissionLimiter(0).allow('ip'))
+
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class TestAuthRoutes(unittest.TestCase):
+    def setUp(self):
+        app_module.app.config['TESTING'] = True
+        self.client = app_module.app.test_client()
+        users = mongomock.MongoClient().db.users
+        users.create_index('email', unique=True)
+        mock.patch.object(app_module, 'users_collection', users).start()
+        mock.patch.object(app_module, 'password_hasher', PasswordHasher(workers=0)).start()
+        mock.patch.object(app_module, 'auth_ip_limiter', AdmissionLimiter(0)).start()
+        mock.patch.object(app_module, 'auth_email_limiter', AdmissionLimiter(3)).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def signup(self, email='a@example.com'):
+        return self.client.post('/signup', data={'email': email, 'password': 'secret1', 'confirm_password': 'secret1'})
+
+    def test_signup_upsert_rejects_existing_email(self):
+        self.assertIn(b'Account created', self.signup().data)
+        self.assertIn(b'Email already exists', self.signup().data)
+        self.assertEqual(app_module.users_collection.count_documents({}), 1)
+
+    def test_login_and_admission_limit(self):
+        self.signup()
+        ok = self.client.post('/login', data={'email': 'a@example.com', 'password': 'secret1'})
+        self.assertEqual(ok.status_code, 302)
+        # Signed in already: the password is still checked, and the attempt counted
+        wrong = self.client.post('/login', data={'email': 'a@example.com', 'password': 'nope'})
+        self.assertIn(b'Invalid email or password', wrong.data)
+        limited = self.client.post('/login', data={'email': 'a@example.com', 'password': 'secret1'})
+        self.assertEqual(limited.status_code, 429)
+
+    def test_busy_hasher(self):
+        with mock.patch.object(app_module.password_hasher, 'hash', side_effect=HasherBusyError):
+            response = self.signup()
+        self.assertEqual(response.status_code, 503)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+
+from fake_ollama import FakeOllama
+from run import compare, percentile
+from services.llm import LLMClient
+
+
+class TestFakeOllama(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeOllama(latency=0, token_rate=10000).start()
+        cls.client = LLMClient(cls.fake.url)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake.stop()
+
+    def test_generate_reports_eval_stats_and_context(self):
+        data = self.client.generate("Produce EXACTLY 5 distinct problem statements", context=[7])
+        self.assertEqual(len(data['response'].splitlines()), 5)
+        self.assertEqual(data['context'][0], 7)
+        self.assertGreater(data['eval_count'], 0)
+
+    def test_stream_joins_to_titles(self):
+        chunks = list(self.client.stream("beginner python ML"))
+        self.assertTrue(chunks[-1]['done'])
+        text = ''.join(c['response'] for c in chunks)
+        self.assertEqual(len(text.splitlines()), 10)
+        self.assertTrue(text.startswith('1. '))
+
+
+class TestReport(unittest.TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([3], 95), 3)
+
+    def test_compare_ignores_small_changes(self):
+        baseline = {'throughput': 10, 'endpoints': {'get-chat': {'p95_ms': 1}, 'chatbot:titles': {'p95_ms': 100}}}
+        report = {'throughput': 9, 'endpoints': {'get-chat': {'p95_ms': 3}, 'chatbot:titles': {'p95_ms': 200}}}
+        self.assertEqual(compare(report, baseline, 0.25), ['chatbot:titles p95 100.0 -> 200.0 ms'])
+
+
+if __name__ == '__main__':
+    unittest.main()
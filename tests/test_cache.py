@@ -0,0 +1,87 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from services.cache import MongoCacheBackend, ResponseCache, SQLiteCacheBackend, cache_key, normalize_prompt
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_normalized_prompts_share_entry(self):
+        cache = ResponseCache()
+        cache.set('titles', 'Beginner  Python ML, 2 weeks', '1. Spam Filter')
+        self.assertEqual(cache.get('titles', 'beginner python ml,\n2 weeks'), '1. Spam Filter')
+        self.assertIsNone(cache.get('problems', 'beginner python ml, 2 weeks'))
+        self.assertEqual(normalize_prompt('  A,  b\nC '), 'a, b c')
+
+    def test_punctuation_tells_stacks_apart(self):
+        keys = {cache_key('titles', f"beginner {language} web 2 weeks") for language in ('C++', 'C#', 'C')}
+        self.assertEqual(len(keys), 3)
+        self.assertNotEqual(cache_key('titles', 'intermediate .NET api'), cache_key('titles', 'intermediate NET api'))
+        self.assertNotEqual(cache_key('titles', 'Node.js chat'), cache_key('titles', 'node js chat'))
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(max_entries=2)
+        cache.set('titles', 'a', '1')
+        cache.set('titles', 'b', '2')
+        cache.get('titles', 'a')
+        cache.set('titles', 'c', '3')
+        self.assertIsNone(cache.get('titles', 'b'))
+        self.assertEqual(cache.get('titles', 'a'), '1')
+
+    def test_ttl_expiry(self):
+        cache = ResponseCache(ttl=60)
+        with mock.patch('services.cache.time.time', return_value=1000):
+            cache.set('titles', 'a', '1')
+        with mock.patch('services.cache.time.time', return_value=1061):
+            self.assertIsNone(cache.get('titles', 'a'))
+
+    def test_sqlite_backend_survives_restart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cache.db')
+            ResponseCache(backend=SQLiteCacheBackend(path, ttl=60)).set('overview', 'p', 'text')
+            cache = ResponseCache(backend=SQLiteCacheBackend(path, ttl=60))
+            self.assertEqual(cache.get('overview', 'p'), 'text')
+
+    def test_similar_profile_hit(self):
+        vectors = {'beginner python ml 2 weeks': [1.0, 0.0], 'python ml beginner two weeks': [0.99, 0.05],
+                   'advanced rust blockchain': [0.0, 1.0]}
+        cache = ResponseCache(embed=vectors.get, similarity=0.95)
+        cache.set('titles', 'prompt one', '1. Spam Filter', semantic_text='beginner python ML 2 weeks')
+        self.assertEqual(cache.get('titles', 'prompt two', semantic_text='Python ML beginner  two weeks'), '1. Spam Filter')
+        self.assertIsNone(cache.get('titles', 'prompt three', semantic_text='advanced Rust blockchain'))
+
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class TestMongoCacheBackend(unittest.TestCase):
+    def setUp(self):
+        # A host clock hours away from UTC
+        self.addCleanup(time.tzset)
+        mock.patch.dict(os.environ, {'TZ': 'America/New_York'}).start()
+        self.addCleanup(mock.patch.stopall)
+        time.tzset()
+
+    def test_age_measured_in_utc(self):
+        collection = mongomock.MongoClient().db.response_cache
+        backend = MongoCacheBackend(collection, ttl=3600)
+        backend.set('fresh', 'titles', '1. Spam Filter')
+        stored = collection.find_one()['created_at']
+        self.assertLess(abs(stored - datetime.now(timezone.utc).replace(tzinfo=None)), timedelta(minutes=1))
+        self.assertEqual(backend.get('fresh'), '1. Spam Filter')
+        collection.insert_one({'_id': 'stale', 'response': 'old',
+                               'created_at': datetime.now(timezone.utc) - timedelta(seconds=3700)})
+        self.assertIsNone(backend.get('stale'))
+
+
+if __name__ == '__main__':
+    unittest.main()
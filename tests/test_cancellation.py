@@ -0,0 +1,246 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+os.environ.setdefault('MONGO_ENSURE_INDEXES', '0')
+
+import app as app_module
+from fake_ollama import FakeOllama
+from services.cache import ResponseCache
+from services.cancellation import CANCELLED, CancelToken, GenerationCancelled, GenerationRegistry
+from services.llm import AsyncLLMClient, LLMClient, httpx
+from services.singleflight import CoalescingLLMClient, SingleFlight
+from services.state_store import MemoryStateStore
+
+
+def wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def cancel_later(token, delay, reason='request'):
+    timer = threading.Timer(delay, token.cancel, args=(reason,))
+    timer.start()
+    return timer
+
+
+class TestCancelToken(unittest.TestCase):
+    def test_registry_supersedes_previous_generation(self):
+        generations = GenerationRegistry()
+        first = generations.start('chat')
+        second = generations.start('chat')
+        self.assertEqual(first.reason, 'superseded')
+        self.assertFalse(second.cancelled)
+        generations.finish('chat', first)
+        self.assertTrue(generations.cancel('chat'))
+        self.assertEqual(second.reason, 'request')
+        self.assertFalse(generations.cancel('chat'))
+
+    def test_callbacks_run_once(self):
+        token = CancelToken()
+        calls = []
+        token.on_cancel(lambda: calls.append('a'))
+        forget = token.on_cancel(lambda: calls.append('b'))
+        forget()
+        before = CANCELLED.value(reason='disconnect')
+        self.assertTrue(token.cancel('disconnect'))
+        self.assertFalse(token.cancel('request'))
+        token.on_cancel(lambda: calls.append('late'))
+        self.assertEqual(calls, ['a', 'late'])
+        self.assertEqual(CANCELLED.value(reason='disconnect'), before + 1)
+        with self.assertRaises(GenerationCancelled):
+            token.check()
+
+
+class TestCancelGeneration(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.slow = FakeOllama(latency=5, token_rate=50).start()
+        cls.fast = FakeOllama(latency=0.05, token_rate=20).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.slow.stop()
+        cls.fast.stop()
+
+    def assertFreed(self, client):
+        self.assertEqual(client.metrics()['in_flight'], 0)
+        self.assertEqual(client.metrics()['waiting'], 0)
+
+    def test_cancel_before_first_token_aborts_request(self):
+        client = LLMClient(self.slow.url)
+        token = CancelToken()
+        cancel_later(token, 0.2)
+        started = time.perf_counter()
+        with self.assertRaises(GenerationCancelled):
+            client.generate('Suggest projects', cancel=token)
+        self.assertLess(time.perf_counter() - started, 2)
+        self.assertFreed(client)
+
+    def test_cancel_midway_through_stream(self):
+        client = LLMClient(self.fast.url)
+        token = CancelToken()
+        chunks = []
+        with self.assertRaises(GenerationCancelled):
+            for chunk in client.stream('Suggest projects', cancel=token):
+                chunks.append(chunk)
+                if len(chunks) == 3:
+                    token.cancel()
+        self.assertEqual(len(chunks), 3)
+        self.assertFreed(client)
+        # The pooled connection is usable again
+        self.assertIn('Spam Email Classifier', client.generate('Suggest projects')['response'])
+
+    def test_cancelled_caller_leaves_queue(self):
+        client = LLMClient(self.fast.url, max_in_flight=1, queue_timeout=30)
+        token = CancelToken()
+        with client.slot():
+            cancel_later(token, 0.1)
+            with self.assertRaises(GenerationCancelled):
+                client.generate('Suggest projects', cancel=token)
+        self.assertEqual(client.metrics()['rejected'], 0)
+        self.assertFreed(client)
+
+    def test_coalesced_caller_cancels_only_itself(self):
+        client = CoalescingLLMClient(LLMClient(self.fast.url), SingleFlight())
+        token = CancelToken()
+        results = []
+        thread = threading.Thread(target=lambda: results.append(client.generate('Suggest projects',
+                                                                                cancel=CancelToken())))
+        thread.start()
+        cancel_later(token, 0.1)
+        with self.assertRaises(GenerationCancelled):
+            client.generate('Suggest projects', cancel=token)
+        thread.join(5)
+        self.assertIn('Spam Email Classifier', results[0]['response'])
+
+    @unittest.skipIf(httpx is None, "httpx is not installed")
+    def test_async_cancel_from_another_thread(self):
+        async def main():
+            client = AsyncLLMClient(self.slow.url)
+            token = CancelToken()
+            cancel_later(token, 0.2)
+            try:
+                with self.assertRaises(GenerationCancelled):
+                    await client.generate('Suggest projects', cancel=token)
+                self.assertFreed(client)
+            finally:
+                await client.aclose()
+
+        started = time.perf_counter()
+        asyncio.run(main())
+        self.assertLess(time.perf_counter() - started, 2)
+
+
+class TestCancelEndpoint(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeOllama(latency=5).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake.stop()
+
+    def setUp(self):
+        app_module.app.config['TESTING'] = True
+        self.store = mock.patch.object(app_module, 'chat_store').start()
+        self.store.get_chat.return_value = None
+        mock.patch.object(app_module, 'conversation_store', MemoryStateStore()).start()
+        mock.patch.object(app_module, 'response_cache', ResponseCache()).start()
+        mock.patch.object(app_module, 'llm_client', LLMClient(self.fake.url)).start()
+        mock.patch.object(app_module, 'generations', GenerationRegistry()).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def client(self):
+        client = app_module.app.test_client()
+        with client.session_transaction() as sess:
+            sess['email'] = 'test@example.com'
+        return client
+
+    def chat_in_background(self, **body):
+        """Send a message from another thread; returns once its generation reached Ollama"""
+        responses = []
+
+        def chat():
+            response = self.client().post('/chatbot', json={
+                'message': 'something fun', 'chat_id': '65f000000000000000000001', **body
+            })
+            responses.append((response.status_code, response.get_json(silent=True), response.get_data(as_text=True)))
+
+        thread = threading.Thread(target=chat)
+        thread.start()
+        deadline = time.monotonic() + 5
+        while not app_module.llm_client.metrics()['in_flight'] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return thread, responses
+
+    def test_cancel_endpoint_stops_generation(self):
+        thread, responses = self.chat_in_background()
+        cancelled = self.client().post('/cancel', json={'chat_id': '65f000000000000000000001'})
+        self.assertTrue(cancelled.json['cancelled'])
+        thread.join(2)
+        self.assertFalse(thread.is_alive())
+        status, data, _ = responses[0]
+        self.assertEqual(status, 409)
+        self.assertEqual(data['reply_type'], 'cancelled')
+        self.store.append_message.assert_not_called()
+        self.assertEqual(app_module.generations.count(), 0)
+        self.assertFalse(self.client().post('/cancel', json={'chat_id': '65f000000000000000000001'}).json['cancelled'])
+
+    def test_new_chats_do_not_cancel_each_other(self):
+        thread, responses = self.chat_in_background(chat_id=None)
+        # Another tab starting a new chat gets a chat of its own
+        response = self.client().post('/chatbot', json={'message': 'hi'})
+        self.assertIsNotNone(response.json['chat_id'])
+        self.assertEqual(app_module.generations.count(), 1)
+        self.assertEqual(self.client().post('/cancel', json={}).status_code, 400)
+        self.assertEqual(app_module.generations.count(), 1)
+        # The first turn's chat id only reached the server, so stop it there
+        app_module.generations.cancel(next(iter(app_module.generations._tokens)))
+        thread.join(2)
+        self.assertEqual(responses[0][0], 409)
+
+    def test_cancel_stops_coalesced_generation(self):
+        llm_client = CoalescingLLMClient(LLMClient(self.fake.url, max_in_flight=1, queue_timeout=30), SingleFlight())
+        app_module.llm_client = llm_client
+        thread, responses = self.chat_in_background()
+        # A different chat's turn waits for the only slot
+        queued = []
+        other = threading.Thread(target=lambda: queued.append(self.client().post('/chatbot', json={
+            'message': 'something else', 'chat_id': '65f000000000000000000002'}).status_code))
+        other.start()
+        self.assertTrue(wait_until(lambda: llm_client.metrics()['waiting'], timeout=5))
+
+        # The queued generation leaves the queue without ever reaching Ollama
+        self.client().post('/cancel', json={'chat_id': '65f000000000000000000002'})
+        other.join(2)
+        self.assertEqual(queued, [409])
+        self.assertTrue(wait_until(lambda: not llm_client.metrics()['waiting'], timeout=1))
+        # The running one gives its slot back right away, not at Ollama's next chunk
+        self.client().post('/cancel', json={'chat_id': '65f000000000000000000001'})
+        thread.join(2)
+        self.assertEqual(responses[0][0], 409)
+        self.assertTrue(wait_until(lambda: not llm_client.metrics()['in_flight'], timeout=1))
+        self.assertEqual(llm_client.metrics()['completed'], 1)
+        self.assertEqual(llm_client.flights.in_flight(), 0)
+
+    def test_newer_message_supersedes_stream(self):
+        thread, responses = self.chat_in_background(stream=True)
+        before = CANCELLED.value(reason='superseded')
+        # A greeting needs no LLM call but still replaces the reply being generated
+        self.client().post('/chatbot', json={'message': 'hi', 'chat_id': '65f000000000000000000001'})
+        thread.join(2)
+        self.assertIn('"reply_type": "cancelled"', responses[0][2])
+        self.assertEqual(CANCELLED.value(reason='superseded'), before + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from services import catalog as catalog_module
+from services.catalog import ProjectCatalog, grow, profile_tags, time_bucket
+
+PROFILE = {'skill_level': 'beginner', 'language': 'Python', 'domain': 'Machine Learning', 'time_available': '2 weeks'}
+TAGS = {'skill_level': 'beginner', 'language': 'Python', 'domain': 'Machine Learning', 'time_available': '1-2 weeks'}
+
+
+def project(title):
+    return {'title': title, 'problems': [f"{title} problem {i}" for i in range(1, 6)], 'reason': f"{title} fits you."}
+
+
+@unittest.skipIf(catalog_module.np is None, "NumPy is not installed")
+class TestProjectCatalog(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.catalog = ProjectCatalog(path=self.dir.name)
+        for i in range(12):
+            self.catalog.add(project(f"ML Project {i}"), TAGS)
+        self.catalog.add(project("Spam Email Classifier"), TAGS)
+        self.catalog.add(project("Java Chat Server"), {**TAGS, 'language': 'Java'})
+        self.catalog.save()
+
+    def test_time_buckets(self):
+        self.assertEqual(time_bucket('2 weeks'), '1-2 weeks')
+        self.assertEqual(time_bucket('3-4 weeks'), '2-4 weeks')
+        self.assertEqual(time_bucket('a month'), '1-2 months')
+        self.assertEqual(time_bucket('6 months'), '2+ months')
+        self.assertEqual(profile_tags(PROFILE), TAGS)
+
+    def test_recommend_from_memory_mapped_vectors(self):
+        loaded = ProjectCatalog.load(self.dir.name)
+        self.assertIsInstance(loaded.vectors, catalog_module.np.memmap)
+        projects = loaded.recommend(PROFILE, "beginner python ML, something with spam email")
+        self.assertEqual(len(projects), 10)
+        # Every profile field matches; the message's words put the spam project first
+        self.assertEqual(projects[0]['title'], 'Spam Email Classifier')
+        self.assertNotIn('Java Chat Server', [p['title'] for p in projects])
+        self.assertEqual(len(projects[0]['problems']), 5)
+
+    def test_no_answer_without_confidence(self):
+        self.assertIsNone(self.catalog.recommend({**PROFILE, 'time_available': None}))
+        self.assertIsNone(self.catalog.recommend({**PROFILE, 'language': 'Java'}))
+        shown = [f"ML Project {i}" for i in range(5)]
+        self.assertIsNone(self.catalog.recommend(PROFILE, exclude=shown))
+        self.assertEqual(len(self.catalog.recommend(PROFILE, exclude=shown[:3])), 10)
+
+    def test_add_widens_tags_of_known_title(self):
+        self.assertFalse(self.catalog.add(project("spam email classifier"), {**TAGS, 'skill_level': 'intermediate'}))
+        entry = next(e for e in self.catalog.entries if e['title'] == 'Spam Email Classifier')
+        self.assertEqual(entry['tags']['skill_level'], ['beginner', 'intermediate'])
+
+    def test_profile_values_have_their_own_columns(self):
+        columns = [catalog_module.tag_index(field, value)
+                   for field, values in catalog_module.TAG_VALUES.items() for value in values]
+        self.assertEqual(len(set(columns)), len(columns))
+        self.assertLess(max(columns), catalog_module.TAG_DIM)
+        self.assertNotIn(catalog_module.tag_index('language', 'Kotlin'), columns)
+        # Java once shared a hashed column with the Web domain, and so matched Python web projects
+        web = {**TAGS, 'domain': 'Web', 'time_available': '2-4 weeks'}
+        for i in range(10):
+            self.catalog.add(project(f"Web Project {i}"), web)
+        self.catalog.save()
+        self.assertIsNone(self.catalog.recommend({**PROFILE, 'language': 'Java', 'time_available': '3 weeks'}))
+
+    def test_stale_vectors_are_rebuilt(self):
+        self.catalog.add(project("Another One"), TAGS)
+        with open(os.path.join(self.dir.name, 'projects.json'), 'w') as f:
+            json.dump(self.catalog.entries, f)
+        self.assertEqual(ProjectCatalog.load(self.dir.name).vectors.shape[0], 15)
+
+    def test_grow_fills_uncovered_profiles(self):
+        llm = mock.Mock()
+        llm.generate.return_value = {'response': '{"question": "", "projects": [%s]}' % ', '.join(
+            '{"title": "Generated %d", "problems": ["a", "b", "c", "d", "e"], "reason": "Fits."}' % i for i in range(10))}
+        catalog = ProjectCatalog(path=self.dir.name)
+        self.assertEqual(grow(catalog, llm, limit=2), 10)
+        self.assertEqual(llm.generate.call_count, 2)
+        self.assertIn('format', llm.generate.call_args.kwargs)
+        first = dict(zip(catalog_module.FIELDS, (options[0] for options in catalog_module.GROW_OPTIONS.values())))
+        self.assertTrue(catalog.covers(first))
+
+
+if __name__ == '__main__':
+    unittest.main()
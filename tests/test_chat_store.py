@@ -0,0 +1,121 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from services.chat_store import ChatStore, decode_cursor, encode_cursor
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+CHAT_ID = '65f000000000000000000001'
+
+
+class TestChatStore(unittest.TestCase):
+    def setUp(self):
+        self.chats = mock.Mock()
+        self.messages = mock.Mock()
+        self.store = ChatStore(self.chats, self.messages)
+
+    def test_append_writes_single_message(self):
+        self.chats.find_one_and_update.return_value = {'_id': ObjectId(CHAT_ID), 'email': 'a@b.c', 'message_count': 7}
+        entry = {'user_message': 'hi', 'bot_reply': 'hello', 'reply_type': 'clarify'}
+        self.assertEqual(self.store.append_message(CHAT_ID, 'a@b.c', entry), 6)
+
+        update = self.chats.find_one_and_update.call_args[0][1]
+        self.assertEqual(update['$inc'], {'message_count': 1})
+        doc = self.messages.insert_one.call_args[0][0]
+        self.assertEqual((doc['seq'], doc['chat_id'], doc['bot_reply']), (6, ObjectId(CHAT_ID), 'hello'))
+        self.assertNotIn('seq', entry)
+
+    def test_append_to_missing_chat(self):
+        self.chats.find_one_and_update.return_value = None
+        self.assertIsNone(self.store.append_message(CHAT_ID, 'a@b.c', {'bot_reply': 'x'}))
+        self.messages.insert_one.assert_not_called()
+
+    def test_first_message_creates_chat(self):
+        self.chats.find_one_and_update.return_value = {'_id': ObjectId(CHAT_ID), 'email': 'a@b.c', 'message_count': 1}
+        self.assertEqual(self.store.append_message(CHAT_ID, 'a@b.c', {'bot_reply': 'x'}, create=True), 0)
+        (query, update), kwargs = self.chats.find_one_and_update.call_args
+        self.assertEqual(query, {'_id': ObjectId(CHAT_ID), 'email': 'a@b.c'})
+        self.assertEqual(update['$setOnInsert']['chat_name'], 'New Chat')
+        # The empty_chat_ttl index reads created_at as UTC
+        self.assertEqual(update['$setOnInsert']['created_at'].tzinfo, timezone.utc)
+        self.assertTrue(kwargs['upsert'])
+
+        # The id of another user's chat
+        self.chats.find_one_and_update.side_effect = DuplicateKeyError('dup')
+        self.assertIsNone(self.store.append_message(CHAT_ID, 'x@b.c', {'bot_reply': 'x'}, create=True))
+
+    def test_legacy_array_migrated_before_append(self):
+        legacy = [{'user_message': 'a', 'bot_reply': 'b'}, {'user_message': 'c', 'bot_reply': 'd'}]
+        self.chats.find_one_and_update.side_effect = [
+            {'_id': ObjectId(CHAT_ID), 'email': 'a@b.c', 'message_count': 1, 'messages': legacy},
+            # Numbers reserved again once migrated
+            {'_id': ObjectId(CHAT_ID), 'email': 'a@b.c', 'message_count': 3},
+        ]
+        self.assertEqual(self.store.append_message(CHAT_ID, 'a@b.c', {'bot_reply': 'new'}), 2)
+        moved = self.messages.insert_many.call_args[0][0]
+        self.assertEqual([m['seq'] for m in moved], [0, 1])
+        self.assertFalse(self.messages.insert_many.call_args[1]['ordered'])
+        query, update = self.chats.update_one.call_args[0]
+        self.assertEqual(query, {'_id': ObjectId(CHAT_ID), 'messages': {'$exists': True}})
+        self.assertEqual(update, {'$unset': {'messages': ''}, '$set': {'message_count': 2}})
+
+    @unittest.skipIf(mongomock is None, "mongomock is not installed")
+    def test_racing_migrations_number_messages_apart(self):
+        db = mongomock.MongoClient().db
+        db.messages.create_index([('chat_id', 1), ('seq', 1)], unique=True)
+        legacy = [{'user_message': 'a', 'bot_reply': 'b'}, {'user_message': 'c', 'bot_reply': 'd'}]
+        db.chats.insert_one({'_id': ObjectId(CHAT_ID), 'email': 'a@b.c', 'messages': legacy})
+        store = ChatStore(db.chats, db.messages)
+        # Both requests saw the array; the first one migrates and appends before the second migrates
+        stale = db.chats.find_one()
+        self.assertEqual(store.append_message(CHAT_ID, 'a@b.c', {'bot_reply': 'first'}), 2)
+        store._migrate_legacy(stale)
+        self.assertEqual(store.append_message(CHAT_ID, 'a@b.c', {'bot_reply': 'second'}), 3)
+        self.assertEqual([m['seq'] for m in db.messages.find().sort('seq', 1)], [0, 1, 2, 3])
+        self.assertEqual(store.get_chat(CHAT_ID, 'a@b.c')['message_count'], 4)
+
+    def test_search_uses_text_index_of_user(self):
+        found = [{'chat_id': ObjectId(CHAT_ID), 'seq': 2, 'score': 1.2}]
+        self.messages.find.return_value.sort.return_value.limit.return_value = found
+        self.chats.find.return_value = [{'_id': ObjectId(CHAT_ID), 'chat_name': 'ML ideas'}]
+        self.assertEqual(self.store.search_messages('a@b.c', 'spam'), (found, {CHAT_ID: 'ML ideas'}))
+        query, projection = self.messages.find.call_args[0]
+        self.assertEqual(query, {'email': 'a@b.c', '$text': {'$search': 'spam'}})
+        self.assertEqual(projection['score'], {'$meta': 'textScore'})
+
+    def test_history_cursor_round_trip(self):
+        chat = {'_id': ObjectId(CHAT_ID), 'updated_at': datetime(2024, 5, 1, 12, 30, 0, 123000)}
+        self.assertEqual(decode_cursor(encode_cursor(chat)), (chat['updated_at'], chat['_id']))
+        with self.assertRaises(ValueError):
+            decode_cursor('not-a-cursor')
+
+    def test_list_chats_returns_next_cursor_only_when_more(self):
+        chats = [{'_id': ObjectId(), 'updated_at': datetime(2024, 5, day)} for day in (3, 2, 1)]
+        find = self.chats.find.return_value.sort.return_value.limit
+        find.return_value = chats
+        page, cursor = self.store.list_chats('a@b.c', limit=2)
+        self.assertEqual(page, chats[:2])
+        self.assertEqual(decode_cursor(cursor), (chats[1]['updated_at'], chats[1]['_id']))
+
+        find.return_value = chats[:1]
+        self.assertEqual(self.store.list_chats('a@b.c', limit=2), (chats[:1], None))
+        # Empty chats are not listed, while chats without a message_count are until it is backfilled
+        self.assertEqual(self.chats.find.call_args[0][0]['message_count'], {'$not': {'$lte': 0}})
+        self.store.counts_backfilled = True
+        self.store.list_chats('a@b.c', limit=2)
+        self.assertEqual(self.chats.find.call_args[0][0]['message_count'], {'$gt': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
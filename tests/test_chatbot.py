@@ -0,0 +1,255 @@
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+os.environ.setdefault('MONGO_ENSURE_INDEXES', '0')
+
+import app as app_module
+from services import catalog as catalog_module
+from services.cache import ResponseCache
+from services.chat_store import ChatStore
+from services.prefetch import Prefetcher
+from services.state_store import MemoryStateStore
+
+
+class TestChatbot(unittest.TestCase):
+    def setUp(self):
+        app_module.app.config['TESTING'] = True
+        self.client = app_module.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['email'] = 'test@example.com'
+        self.chats = mock.patch.object(app_module, 'chats_collection').start()
+        self.store = mock.patch.object(app_module, 'chat_store', spec=ChatStore).start()
+        self.store.get_chat.return_value = None
+        self.conversations = mock.patch.object(app_module, 'conversation_store', MemoryStateStore()).start()
+        self.schedule_chat_name = mock.patch.object(app_module, 'schedule_chat_name').start()
+        mock.patch.object(app_module, 'response_cache', ResponseCache()).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_greeting_needs_no_llm(self):
+        with mock.patch.object(app_module, 'query_llm') as query_llm:
+            response = self.client.post('/chatbot', json={'message': 'hi'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Project Recommender', response.json['reply'])
+        query_llm.assert_not_called()
+        # A greeting alone creates no chat, but the chat id it hands out is kept for the next turn
+        self.store.append_message.assert_not_called()
+        history, _ = app_module.load_conversation('test@example.com', response.json['chat_id'])
+        self.assertEqual(history[0]['reply_type'], 'greeting')
+
+    def test_streamed_titles(self):
+        tokens = ['1. Spam', ' Filter\n', '2. Digit', ' Recognizer\n']
+        with mock.patch.object(app_module, 'stream_llm', return_value=iter(tokens)):
+            response = self.client.post('/chatbot', json={
+                'message': 'beginner python ML 2 weeks',
+                'chat_id': '65f000000000000000000001',
+                'stream': True
+            })
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        events = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([e['text'] for e in events[:-1]], tokens)
+        self.assertEqual(events[-1]['type'], 'done')
+        self.assertEqual(events[-1]['reply_type'], 'titles')
+        self.assertEqual(events[-1]['reply'], ''.join(tokens).strip())
+        self.store.append_message.assert_called_once()
+
+        # The parsed titles feed the next (selection) turn
+        history, context = app_module.load_conversation('test@example.com', '65f000000000000000000001')
+        plan = app_module.plan_turn('2', history, context.render())
+        self.assertEqual(plan['reply_type'], 'problems')
+        self.assertEqual(plan['selected_title'], 'Digit Recognizer')
+
+    def test_new_chat_created_by_first_message(self):
+        chat_id = self.client.post('/new-chat').json['chat_id']
+        self.client.post('/chatbot', json={'message': 'hi', 'chat_id': chat_id})
+        self.store.append_message.assert_not_called()
+        with mock.patch.object(app_module, 'query_llm', return_value='Which language do you prefer?'):
+            response = self.client.post('/chatbot', json={'message': 'I want a project', 'chat_id': chat_id})
+        self.assertEqual(response.json['chat_id'], chat_id)
+        self.store.append_message.assert_called_once()
+        self.assertEqual(self.store.append_message.call_args[0][0], chat_id)
+        self.assertTrue(self.store.append_message.call_args[1]['create'])
+
+    def test_repeated_prompt_served_from_cache(self):
+        with mock.patch.object(app_module, 'query_llm', return_value='1. Spam Filter\n2. Digit Recognizer') as query_llm:
+            for chat_id in ('65f000000000000000000001', '65f000000000000000000002'):
+                response = self.client.post('/chatbot', json={
+                    'message': 'Beginner python ML, 2 weeks',
+                    'chat_id': chat_id
+                })
+                self.assertIn('Spam Filter', response.json['reply'])
+        query_llm.assert_called_once()
+
+    def test_chat_named_once_in_background(self):
+        chat_id = '65f000000000000000000001'
+        with mock.patch.object(app_module, 'query_llm', return_value='Which language do you prefer?'):
+            self.client.post('/chatbot', json={'message': 'I want a project', 'chat_id': chat_id})
+            self.client.post('/chatbot', json={'message': 'something in ML', 'chat_id': chat_id})
+        self.schedule_chat_name.assert_called_once_with('test@example.com', chat_id, 'I want a project')
+
+    def test_conversations_kept_per_chat(self):
+        with mock.patch.object(app_module, 'query_llm', return_value='1. Spam Filter\n2. Digit Recognizer'):
+            self.client.post('/chatbot', json={'message': 'python ML', 'chat_id': '65f000000000000000000001'})
+        self.assertEqual(app_module.load_conversation('test@example.com', '65f000000000000000000002')[0], [])
+        self.assertEqual(len(app_module.load_conversation('test@example.com', '65f000000000000000000001')[0]), 1)
+
+    def test_evicted_conversation_rebuilt_from_messages(self):
+        self.store.get_chat.return_value = {'message_count': 50}
+        self.store.get_messages.return_value = [{'user_message': 'x', 'bot_reply': 'y', 'reply_type': 'clarify'}]
+        history, context = app_module.load_conversation('test@example.com', '65f000000000000000000003')
+        self.assertEqual(history[0]['bot_reply'], 'y')
+        self.assertIn('Assistant: y', context.render())
+        self.assertEqual(self.store.get_messages.call_args.kwargs['start'], 10)
+
+    def test_followup_turn_reuses_llm_context(self):
+        chat_id = '65f000000000000000000001'
+        llm = mock.Mock(model=app_module.llm_client.model)
+        llm.generate.side_effect = [
+            {'response': '1. Spam Filter\n2. Digit Recognizer', 'context': [1, 2, 3]},
+            {'response': '1. Detect spam\n2. Rank emails', 'context': [1, 2, 3, 4]},
+        ]
+        with mock.patch.object(app_module, 'llm_client', llm):
+            self.client.post('/chatbot', json={'message': 'beginner python ML', 'chat_id': chat_id})
+            self.client.post('/chatbot', json={'message': '1', 'chat_id': chat_id})
+        first, second = llm.generate.call_args_list
+        self.assertNotIn('context', first.kwargs)
+        self.assertEqual(second.kwargs['context'], [1, 2, 3])
+        self.assertNotIn(app_module.SYSTEM_PROMPT, second.args[0])
+        self.assertIn('Spam Filter', second.args[0])
+        _, context = app_module.load_conversation('test@example.com', chat_id)
+        self.assertEqual(context.llm_session['context'], [1, 2, 3, 4])
+
+    def test_rejected_llm_context_resends_full_prompt(self):
+        llm = mock.Mock(model=app_module.llm_client.model)
+        llm.generate.side_effect = [
+            app_module.requests.exceptions.HTTPError('500'),
+            {'response': 'ok', 'context': [9]},
+        ]
+        session = {'context': [1, 2], 'model': llm.model}
+        with mock.patch.object(app_module, 'llm_client', llm):
+            text = app_module.query_llm('full prompt', session=session, followup_prompt='tail')
+        self.assertEqual(text, 'ok')
+        self.assertEqual(llm.generate.call_args.args[0], 'full prompt')
+        self.assertNotIn('context', llm.generate.call_args.kwargs)
+        self.assertEqual(session['context'], [9])
+
+    def test_session_leaves_room_for_turn_and_reply(self):
+        model = app_module.llm_client.model
+        tail = 'x' * 30
+        limit = app_module.LLM_NUM_CTX - app_module.LLM_NUM_PREDICT
+        self.assertLessEqual(app_module.LLM_SESSION_MAX_TOKENS, limit)
+        fits = {'context': [0] * (limit - app_module.estimate_tokens(tail)), 'model': model}
+        self.assertTrue(app_module.session_usable(fits, tail))
+        full = {'context': fits['context'] + [0], 'model': model}
+        self.assertFalse(app_module.session_usable(full, tail))
+        self.assertTrue(app_module.session_usable(full, ''))
+
+    def test_turn_timed_and_exported(self):
+        with mock.patch.object(app_module, 'query_llm', return_value='1. Spam Filter\n2. Digit Recognizer'):
+            response = self.client.post('/chatbot', json={'message': 'python ML', 'chat_id': '65f000000000000000000001'})
+        self.assertIn('llm;dur=', response.headers['Server-Timing'])
+        metrics = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('chatbot_request_seconds_count{reply_type="titles",stream="false"}', metrics)
+        self.assertIn('chatbot_stage_seconds_count{stage="save"}', metrics)
+        self.assertIn('conversation_state_entries 1.0', metrics)
+
+    def test_selected_title_served_from_prefetch(self):
+        chat_id = '65f000000000000000000001'
+        mock.patch.object(app_module, 'PREFETCH_PROBLEMS', 2).start()
+        mock.patch.object(app_module, 'problem_prefetcher', Prefetcher()).start()
+        replies = {'titles': '1. Spam Filter\n2. Digit Recognizer\n3. Chess AI', 'problems': '1. Too much spam\n2. Slow review'}
+        calls = []
+
+        def fake_llm(prompt, timeout=120, **kwargs):
+            calls.append(prompt)
+            return replies['problems'] if 'Selected project title' in prompt else replies['titles']
+
+        with mock.patch.object(app_module, 'query_llm', side_effect=fake_llm):
+            self.client.post('/chatbot', json={'message': 'beginner python ML', 'chat_id': chat_id})
+            # A prefetch still queued when the title is selected is dropped, so let both run first
+            app_module.problem_prefetcher.executor.shutdown(wait=True)
+            response = self.client.post('/chatbot', json={'message': '2', 'chat_id': chat_id})
+        self.assertIn('Too much spam', response.json['reply'])
+        self.assertIn('Digit Recognizer', response.json['reply'])
+        # One titles call plus one prefetch per top title; the selection itself made no call
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(self.store.set_prefetched.call_count, 2)
+
+    def test_structured_titles_serve_selection_turns(self):
+        chat_id = '65f000000000000000000001'
+        mock.patch.object(app_module, 'STRUCTURED_GENERATION', True).start()
+        projects = [{'title': t, 'problems': [f"{t} problem {i}" for i in range(1, 6)], 'reason': f"{t} fits you."}
+                    for t in ('Spam Filter', 'Digit Recognizer')]
+        llm = mock.Mock(model=app_module.llm_client.model)
+        llm.generate.side_effect = [{'response': 'not json'}, {'response': json.dumps({'question': '', 'projects': projects})}]
+        with mock.patch.object(app_module, 'llm_client', llm):
+            titles = self.client.post('/chatbot', json={'message': 'beginner python ML', 'chat_id': chat_id})
+            problems = self.client.post('/chatbot', json={'message': '2', 'chat_id': chat_id})
+            overview = self.client.post('/chatbot', json={'message': '3', 'chat_id': chat_id})
+        # One retry after the malformed reply, then no LLM calls for the selections
+        self.assertEqual(llm.generate.call_count, 2)
+        self.assertIn('format', llm.generate.call_args.kwargs)
+        self.assertEqual(titles.json['reply'], '1. Spam Filter\n2. Digit Recognizer')
+        self.assertIn('3. Digit Recognizer problem 3', problems.json['reply'])
+        self.assertIn('Digit Recognizer problem 3', overview.json['reply'])
+        self.assertIn('Digit Recognizer fits you.', overview.json['reply'])
+
+    @unittest.skipIf(catalog_module.np is None, "NumPy is not installed")
+    def test_catalog_answers_complete_profile(self):
+        chat_id = '65f000000000000000000001'
+        catalog = catalog_module.ProjectCatalog()
+        tags = {'skill_level': 'beginner', 'language': 'Python', 'domain': 'Machine Learning', 'time_available': '1-2 weeks'}
+        for i in range(10):
+            catalog.add({'title': f"Catalog Project {i}", 'problems': [f"Problem {i}.{j}" for j in range(1, 6)],
+                         'reason': 'Fits you.'}, tags)
+        catalog.vectors = catalog_module.np.stack([catalog_module.entry_vector(e) for e in catalog.entries])
+        mock.patch.object(app_module, 'project_catalog', catalog).start()
+        with mock.patch.object(app_module, 'query_llm', return_value='Which language do you prefer?') as query_llm:
+            clarify = self.client.post('/chatbot', json={'message': 'beginner ML, 2 weeks', 'chat_id': chat_id})
+            titles = self.client.post('/chatbot', json={'message': 'Python', 'chat_id': chat_id})
+            problems = self.client.post('/chatbot', json={'message': '3', 'chat_id': chat_id})
+        # Only the incomplete profile needed the LLM
+        query_llm.assert_called_once()
+        self.assertEqual(clarify.json['reply'], 'Which language do you prefer?')
+        self.assertTrue(titles.json['reply'].startswith('1. Catalog Project 0\n2. Catalog Project 1'))
+        self.assertIn('3. Problem 2.3', problems.json['reply'])
+
+    def test_incomplete_structured_project_asks_llm_for_problems(self):
+        plan = app_module.plan_turn('1', [{
+            'user_message': 'python ML', 'bot_reply': '1. Spam Filter', 'reply_type': 'titles',
+            'projects': [{'title': 'Spam Filter', 'problems': ['Only one'], 'reason': ''}]
+        }], '')
+        self.assertEqual(plan['reply_type'], 'problems')
+        self.assertIn('Spam Filter', plan['prompt'])
+
+    def test_get_chat_pages_back_to_the_first_message(self):
+        self.store.get_chat.return_value = {'_id': '65f000000000000000000001', 'message_count': 50}
+        self.store.get_messages.return_value = [{'seq': n, 'user_message': 'm', 'bot_reply': 'r'} for n in range(10)]
+        response = self.client.get('/get-chat/65f000000000000000000001?before=10&limit=30')
+        self.assertEqual((response.json['start'], response.json['has_more']), (0, False))
+        self.assertEqual(self.store.get_messages.call_args.kwargs['limit'], 10)
+        self.store.get_messages.reset_mock()
+        for before in (0, -5):
+            response = self.client.get(f'/get-chat/65f000000000000000000001?before={before}')
+            self.assertEqual(response.json, {'messages': [], 'start': 0, 'has_more': False})
+        self.store.get_messages.assert_not_called()
+
+    def test_name_chat_keeps_user_renames(self):
+        with mock.patch.object(app_module, 'generate_chat_name', return_value='ML'):
+            app_module.name_chat('test@example.com', '65f000000000000000000001', 'ML please')
+        query, update = self.chats.update_one.call_args[0]
+        self.assertEqual(query['chat_name'], 'New Chat')
+        self.assertEqual(update, {'$set': {'chat_name': 'ML'}})
+
+    def test_problems_padded_when_parsing_fails(self):
+        plan = {'reply_type': 'problems', 'prompt': '...', 'selected_title': 'Spam Filter'}
+        entry = app_module.finish_turn(plan, '1', '1. Only one')
+        self.assertEqual(len(entry['problems']), 5)
+        self.assertEqual(entry['problems'][0], 'Only one')
+
+
+if __name__ == '__main__':
+    unittest.main()
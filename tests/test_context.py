@@ -0,0 +1,46 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from services.context import ConversationContext, extract_profile
+
+
+class TestConversationContext(unittest.TestCase):
+    def test_extract_profile(self):
+        self.assertEqual(extract_profile("I'm a beginner in Python, want an ML project for 2 weeks"), {
+            'skill_level': 'beginner',
+            'language': 'Python',
+            'domain': 'Machine Learning',
+            'time_available': '2 weeks',
+        })
+        self.assertEqual(extract_profile('1-2 months, advanced, javascript web app'), {
+            'skill_level': 'highly skilled',
+            'language': 'JavaScript',
+            'domain': 'Web',
+            'time_available': '1-2 months',
+        })
+        self.assertEqual(extract_profile('tell me a joke'), {})
+
+    def test_old_turns_summarized_as_profile(self):
+        context = ConversationContext(window=2)
+        context.add({'user_message': 'beginner python', 'bot_reply': 'Which domain?'})
+        context.add({'user_message': 'computer vision', 'bot_reply': 'How much time?'})
+        context.add({'user_message': '3 weeks', 'bot_reply': '1. Face Detector'})
+        rendered = context.render()
+        self.assertNotIn('User: beginner python', rendered)
+        self.assertIn('User: 3 weeks', rendered)
+        for line in ('Skill level: beginner', 'Language: Python', 'Domain: Computer Vision', 'Time available: 3 weeks'):
+            self.assertIn(line, rendered)
+
+    def test_round_trip_keeps_rendering(self):
+        context = ConversationContext.from_history([{'user_message': 'hi', 'bot_reply': 'hello'}])
+        restored = ConversationContext.from_dict(context.to_dict())
+        self.assertEqual(restored.render(), context.render())
+        restored.add({'user_message': 'python', 'bot_reply': 'ok'})
+        self.assertIn('User: python', restored.render())
+
+
+if __name__ == '__main__':
+    unittest.main()
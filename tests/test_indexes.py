@@ -0,0 +1,30 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from services.indexes import INDEXES, ensure_indexes, plan_stages
+
+
+class TestIndexes(unittest.TestCase):
+    def test_plan_stages_flags_nested_scans(self):
+        plan = {'stage': 'SORT', 'inputStage': {'stage': 'FETCH', 'inputStage': {'stage': 'COLLSCAN'}}}
+        self.assertEqual(plan_stages(plan), ['SORT', 'FETCH', 'COLLSCAN'])
+
+    def test_plan_stages_with_multiple_inputs(self):
+        plan = {'stage': 'OR', 'inputStages': [{'stage': 'IXSCAN'}, {'stage': 'IXSCAN'}]}
+        self.assertEqual(plan_stages(plan), ['OR', 'IXSCAN', 'IXSCAN'])
+
+    def test_empty_chats_expire_and_retired_index_dropped(self):
+        ttl = next(model.document for model in INDEXES['chats'] if model.document['name'] == 'empty_chat_ttl')
+        self.assertEqual(ttl['partialFilterExpression'], {'message_count': 0})
+        db = mock.MagicMock()
+        db['chats'].index_information.return_value = {'_id_': {}, 'email_updated_at_id': {}}
+        ensure_indexes(db)
+        db['chats'].drop_index.assert_called_once_with('email_updated_at_id')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+os.environ.setdefault('MONGO_ENSURE_INDEXES', '0')
+
+import app as app_module
+from services.intent import IntentModel, normalize_choice, training_examples
+
+MODEL_PATH = os.path.join(os.path.dirname(__file__), '..', 'backend', 'db', 'intent_model.json')
+TITLES = {'user_message': 'python ML', 'bot_reply': "1. Spam Filter\n2. Digit Recognizer\n3. Chatbot",
+          'reply_type': 'titles'}
+
+
+class TestIntentModel(unittest.TestCase):
+    def test_normalize_choice(self):
+        self.assertEqual(normalize_choice('2'), 1)
+        self.assertEqual(normalize_choice('#3'), 2)
+        self.assertEqual(normalize_choice("I'll take the second one"), 1)
+        self.assertEqual(normalize_choice('option two'), 1)
+        self.assertEqual(normalize_choice('the last one', count=5), 4)
+        self.assertIsNone(normalize_choice('the last one'))
+        self.assertIsNone(normalize_choice('another one'))
+        self.assertIsNone(normalize_choice('python, 2 weeks'))
+        self.assertIsNone(normalize_choice('2 or 3'))
+        self.assertIsNone(normalize_choice('7', count=5))
+
+    def test_scaffold_normalize_choice_agrees(self):
+        path = os.path.join(os.path.dirname(__file__), '..', 'ai-project-recommender', 'backend', 'recommender', 'utils.py')
+        spec = importlib.util.spec_from_file_location('scaffold_utils', path)
+        utils = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(utils)
+        # The scaffold keeps its own copy (it ships without services/), limited to five choices
+        for text in ('3rd', 'third', 'the second one', 'option two', '#5', 'I pick 2'):
+            self.assertEqual(utils.normalize_choice(text), str(normalize_choice(text, count=5) + 1))
+        for text in ('6', 'another one', 'python, 2 weeks'):
+            self.assertIsNone(utils.normalize_choice(text))
+
+    def test_shipped_model_loads_fast(self):
+        started = time.perf_counter()
+        model = IntentModel.load(MODEL_PATH)
+        self.assertLess(time.perf_counter() - started, 0.05)
+        self.assertEqual(model.predict('hello there')[0], 'greeting')
+        self.assertEqual(model.predict('what is the weather in paris')[0], 'off_topic')
+        self.assertEqual(model.predict('the second one')[0], 'select')
+        self.assertEqual(model.predict('beginner python machine learning, 2 weeks')[0], 'project')
+
+    def test_save_and_load(self):
+        model = IntentModel.train(training_examples()[::5], epochs=3)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'model.json')
+            model.save(path)
+            loaded = IntentModel.load(path)
+        self.assertEqual(loaded.probabilities('option two'), model.probabilities('option two'))
+
+    def test_default_path_found_from_any_directory(self):
+        cwd = os.getcwd()
+        self.addCleanup(os.chdir, cwd)
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.dict(os.environ), \
+                mock.patch.object(app_module, 'INTENT_MODE', 'shadow'):
+            os.environ.pop('INTENT_MODEL_PATH', None)
+            os.chdir(tmp)
+            self.assertIsInstance(app_module.build_intent_model(), IntentModel)
+
+    def test_missing_model_warns(self):
+        with mock.patch.dict(os.environ, {'INTENT_MODEL_PATH': 'db/missing.json'}), \
+                mock.patch.object(app_module, 'INTENT_MODE', 'on'), \
+                self.assertLogs(app_module.app.logger, 'WARNING') as logs:
+            self.assertIsNone(app_module.build_intent_model())
+        self.assertIn(os.path.join(app_module.BACKEND_DIR, 'db', 'missing.json'), logs.output[0])
+
+
+class TestIntentRouting(unittest.TestCase):
+    def setUp(self):
+        mock.patch.object(app_module, 'intent_model', IntentModel.load(MODEL_PATH)).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_off_topic_answered_locally(self):
+        with mock.patch.object(app_module, 'INTENT_MODE', 'on'):
+            plan = app_module.plan_turn('tell me a joke', [TITLES])
+        self.assertIsNone(plan['prompt'])
+        entry = app_module.finish_turn(plan, 'tell me a joke', app_module.stored_turn_text(plan))
+        self.assertEqual(entry['bot_reply'], app_module.OFF_TOPIC_REPLY)
+        self.assertEqual(app_module.observed_intent(entry), 'off_topic')
+
+    def test_selection_by_ordinal(self):
+        problems = {'user_message': '2', 'reply_type': 'problems', 'selected_title': 'Digit Recognizer',
+                    'bot_reply': "1. Read digits\n2. Read cheques"}
+        with mock.patch.object(app_module, 'INTENT_MODE', 'on'):
+            plan = app_module.plan_turn('the third one', [TITLES])
+            self.assertEqual(plan['selected_title'], 'Chatbot')
+            # The most recent list is the one selected from
+            plan = app_module.plan_turn("let's go with the second one", [TITLES, problems])
+            self.assertEqual(plan['selected_problem'], 'Read cheques')
+            # "another one" asks for more titles
+            self.assertIn('prompt', app_module.plan_turn('another one', [TITLES]))
+            self.assertNotIn('selected_title', app_module.plan_turn('another one', [TITLES]))
+
+    def test_shadow_mode_only_records(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            log = os.path.join(tmp, 'shadow.jsonl')
+            with mock.patch.object(app_module, 'INTENT_MODE', 'shadow'), \
+                    mock.patch.object(app_module, 'INTENT_SHADOW_LOG', log):
+                plan = app_module.plan_turn('tell me a joke', [TITLES])
+                self.assertIsNotNone(plan['prompt'])
+                before = app_module.INTENT_SHADOW.value(intent='off_topic', outcome='agree')
+                entry = app_module.finish_turn(plan, 'tell me a joke', app_module.OFF_TOPIC_REPLY)
+                app_module.record_intent(plan['intent'], entry)
+            self.assertEqual(app_module.INTENT_SHADOW.value(intent='off_topic', outcome='agree'), before + 1)
+            with open(log) as f:
+                logged = json.loads(f.readline())
+        self.assertEqual((logged['text'], logged['label'], logged['predicted']), ('tell me a joke', 'off_topic', 'off_topic'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import asyncio
+import os
+import sys
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from services.llm import LLMClient, LLMBusyError, httpx
+from services.router import build_async_llm_client, build_llm_client
+
+
+class TestLLMClient(unittest.TestCase):
+    def test_rejects_when_queue_full(self):
+        client = LLMClient('http://ollama.test/api/generate', max_in_flight=1, max_queue=0)
+        with client.slot():
+            with self.assertRaises(LLMBusyError):
+                with client.slot():
+                    pass
+        self.assertEqual(client.metrics()['rejected'], 1)
+        self.assertEqual(client.metrics()['completed'], 1)
+
+    def test_waiting_caller_gets_freed_slot(self):
+        client = LLMClient('http://ollama.test/api/generate', max_in_flight=1, max_queue=1, queue_timeout=5)
+        entered = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            with client.slot():
+                entered.set()
+                release.wait(5)
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        entered.wait(5)
+        threading.Timer(0.05, release.set).start()
+        with client.slot():
+            self.assertEqual(client.metrics()['in_flight'], 1)
+        holder.join()
+        self.assertEqual(client.metrics()['rejected'], 0)
+
+    def test_generate_uses_pooled_session(self):
+        client = LLMClient('http://ollama.test/api/generate', model='llama3')
+        with mock.patch.object(client.session, 'post') as post:
+            post.return_value.json.return_value = {'response': 'ok'}
+            self.assertEqual(client.generate('hello')['response'], 'ok')
+        payload = post.call_args.kwargs['json']
+        self.assertEqual(payload, {'model': 'llama3', 'prompt': 'hello', 'stream': False})
+
+    def test_model_options_sent_with_every_request(self):
+        client = LLMClient('http://ollama.test/api/generate', model_options={'num_ctx': 4096, 'num_predict': 1024})
+        with mock.patch.object(client.session, 'post') as post:
+            post.return_value.json.return_value = {'response': 'ok'}
+            client.generate('hello', context=[1, 2])
+        payload = post.call_args.kwargs['json']
+        self.assertEqual(payload['options'], {'num_ctx': 4096, 'num_predict': 1024})
+        self.assertEqual(payload['context'], [1, 2])
+
+
+    @unittest.skipIf(httpx is None, "httpx is not installed")
+    def test_async_client_shares_slots_with_sync_client(self):
+        urls = ['http://a.test/api/generate', 'http://b.test/api/generate']
+        sync_client = build_llm_client(urls, max_in_flight=1)
+        async_client = build_async_llm_client(urls, share_with=sync_client, max_in_flight=1, queue_timeout=0.05)
+        self.assertEqual([b.client.slots for b in async_client.backends], [b.client.slots for b in sync_client.backends])
+
+        async def take_slot(client):
+            async with client.slot():
+                pass
+
+        client = async_client.backends[0].client
+        with sync_client.backends[0].client.slot():
+            self.assertTrue(client.saturated())
+            with self.assertRaises(LLMBusyError):
+                asyncio.run(take_slot(client))
+        asyncio.run(take_slot(client))
+        self.assertEqual(client.metrics()['completed'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from services.metrics import Registry, record_generation, span, LLM_TOKENS, STAGE_SECONDS
+from services.profiler import SamplingProfiler
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_exposition(self):
+        registry = Registry()
+        latency = registry.histogram('req_seconds', "Latency", ['kind'], buckets=(0.1, 1))
+        latency.observe(0.05, kind='a')
+        latency.observe(0.5, kind='a')
+        text = registry.render()
+        self.assertIn('# TYPE req_seconds histogram', text)
+        self.assertIn('req_seconds_bucket{kind="a",le="0.1"} 1', text)
+        self.assertIn('req_seconds_bucket{kind="a",le="+Inf"} 2', text)
+        self.assertIn('req_seconds_count{kind="a"} 2', text)
+
+    def test_counter_and_callback_gauge(self):
+        registry = Registry()
+        registry.counter('hits_total', "Hits", ['route']).inc(route='/x"y')
+        registry.gauge('items', "Items", callback=lambda: 3)
+        text = registry.render()
+        self.assertIn('hits_total{route="/x\\"y"} 1.0', text)
+        self.assertIn('items 3.0', text)
+
+    def test_span_records_stage(self):
+        spans = []
+        before = STAGE_SECONDS.count(stage='test-stage')
+        with span('test-stage', spans):
+            pass
+        self.assertEqual(STAGE_SECONDS.count(stage='test-stage'), before + 1)
+        self.assertEqual(spans[0][0], 'test-stage')
+
+    def test_record_generation_counts_tokens(self):
+        before = LLM_TOKENS.value()
+        record_generation({'eval_count': 40, 'eval_duration': 2e9}, 2.5, 'generate')
+        self.assertEqual(LLM_TOKENS.value(), before + 40)
+
+
+class TestSamplingProfiler(unittest.TestCase):
+    def test_samples_target_thread(self):
+        def busy_wait():
+            end = time.time() + 0.1
+            while time.time() < end:
+                pass
+
+        worker = threading.Thread(target=busy_wait)
+        worker.start()
+        profiler = SamplingProfiler(worker.ident, interval=0.002).start()
+        worker.join()
+        profiler.stop()
+        self.assertGreater(profiler.samples, 0)
+        self.assertIn('busy_wait', profiler.collapsed())
+
+
+if __name__ == '__main__':
+    unittest.main()
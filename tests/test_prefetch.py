@@ -0,0 +1,116 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from services.cancellation import CancelToken
+from services.prefetch import Prefetcher
+
+
+class TestPrefetcher(unittest.TestCase):
+    def test_take_returns_result_and_cancels_rest(self):
+        prefetcher = Prefetcher(workers=1)
+        started, gate = threading.Event(), threading.Event()
+        ran = []
+        prefetcher.schedule('chat', {
+            'a': lambda cancel: started.set() or gate.wait(1) and 'A',
+            'b': lambda cancel: ran.append('b') or 'B',
+        })
+        started.wait(1)
+        gate.set()
+        self.assertEqual(prefetcher.take('chat', 'a', timeout=1), 'A')
+        prefetcher.executor.shutdown(wait=True)
+        self.assertEqual(ran, [])
+        self.assertIsNone(prefetcher.take('chat', 'b'))
+
+    def test_reschedule_replaces_batch(self):
+        prefetcher = Prefetcher(workers=1)
+        prefetcher.schedule('chat', {'a': lambda cancel: 'old'})
+        prefetcher.schedule('chat', {'a': lambda cancel: 'new'})
+        prefetcher.executor.shutdown(wait=True)
+        self.assertEqual(prefetcher.take('chat', 'a', timeout=1), 'new')
+
+    def test_failed_job_gives_none(self):
+        prefetcher = Prefetcher()
+        prefetcher.schedule('chat', {'a': lambda cancel: 1 / 0})
+        self.assertIsNone(prefetcher.take('chat', 'a', timeout=1))
+
+    def test_bounded_groups(self):
+        prefetcher = Prefetcher(max_groups=2)
+        for group in ('x', 'y', 'z'):
+            prefetcher.schedule(group, {'a': lambda cancel, group=group: group})
+        prefetcher.executor.shutdown(wait=True)
+        self.assertIsNone(prefetcher.take('x', 'a', timeout=1))
+        self.assertEqual(prefetcher.take('z', 'a', timeout=1), 'z')
+
+    def test_queued_job_not_waited_for(self):
+        prefetcher = Prefetcher(workers=1)
+        gate = threading.Event()
+        ran = []
+        prefetcher.schedule('other', {'a': lambda cancel: gate.wait(1)})
+        prefetcher.schedule('chat', {'a': lambda cancel: ran.append('a') or 'A'})
+        started = time.perf_counter()
+        self.assertIsNone(prefetcher.take('chat', 'a', timeout=5))
+        self.assertLess(time.perf_counter() - started, 0.5)
+        gate.set()
+        prefetcher.executor.shutdown(wait=True)
+        self.assertEqual(ran, [])
+
+    def test_wait_ends_when_cancelled(self):
+        prefetcher = Prefetcher(workers=1)
+        started, gate = threading.Event(), threading.Event()
+        prefetcher.schedule('chat', {'a': lambda cancel: started.set() or gate.wait(5) and 'A'})
+        started.wait(1)
+        cancel = CancelToken()
+        threading.Timer(0.05, cancel.cancel).start()
+        begun = time.perf_counter()
+        self.assertIsNone(prefetcher.take('chat', 'a', timeout=5, cancel=cancel))
+        self.assertLess(time.perf_counter() - begun, 1)
+        gate.set()
+
+    def test_cancel_aborts_running_jobs(self):
+        prefetcher = Prefetcher(workers=2)
+        started = {'a': threading.Event(), 'b': threading.Event()}
+        tokens = {}
+
+        def job(key):
+            def run(cancel):
+                tokens[key] = cancel
+                started[key].set()
+                aborted = threading.Event()
+                cancel.on_cancel(aborted.set)
+                return None if aborted.wait(5) else key.upper()
+            return run
+
+        prefetcher.schedule('chat', {'a': job('a'), 'b': job('b')})
+        for event in started.values():
+            event.wait(1)
+        # 'b' is already generating: taking 'a' aborts it instead of letting it run on
+        prefetcher.take('chat', 'a', timeout=0.01)
+        self.assertEqual(tokens['b'].reason, 'prefetch')
+        self.assertFalse(tokens['a'].cancelled)
+        prefetcher.cancel('chat')
+        self.assertFalse(tokens['a'].cancelled)
+        tokens['a'].cancel()
+
+        started['a'].clear()
+        prefetcher.schedule('chat', {'a': job('a')})
+        started['a'].wait(1)
+        prefetcher.cancel('chat')
+        self.assertEqual(tokens['a'].reason, 'prefetch')
+
+        # A job claimed by a turn is aborted with the turn
+        started['a'].clear()
+        prefetcher.schedule('chat', {'a': job('a')})
+        started['a'].wait(1)
+        turn = CancelToken()
+        threading.Timer(0.05, turn.cancel, args=('user',)).start()
+        self.assertIsNone(prefetcher.take('chat', 'a', timeout=5, cancel=turn))
+        self.assertEqual(tokens['a'].reason, 'user')
+        prefetcher.executor.shutdown(wait=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+
+from fake_ollama import FakeOllama
+from services.llm import LLMClient
+from services.router import LLMRouter, build_llm_client
+
+DEAD_URL = 'http://127.0.0.1:1/api/generate'
+
+
+class TestLLMRouter(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fakes = [FakeOllama(latency=0.05, token_rate=10000).start() for _ in range(2)]
+
+    @classmethod
+    def tearDownClass(cls):
+        for fake in cls.fakes:
+            fake.stop()
+
+    def router(self, urls, **options):
+        return LLMRouter([LLMClient(url, max_in_flight=8) for url in urls], **options)
+
+    def test_spreads_concurrent_requests(self):
+        router = self.router([fake.url for fake in self.fakes])
+        threads = [threading.Thread(target=router.generate, args=("beginner python ML",)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([b.requests for b in router.backends], [4, 4])
+        self.assertEqual(router.metrics()['completed'], 8)
+
+    def test_route_key_sticks_to_backend(self):
+        router = self.router([fake.url for fake in self.fakes])
+        router.generate("warm up other backend")
+        for _ in range(3):
+            router.generate("beginner python ML", route_key='chat-1')
+        self.assertEqual(sorted(b.requests for b in router.backends), [1, 3])
+
+    def test_unreachable_backend_fails_over_and_opens_circuit(self):
+        router = self.router([DEAD_URL, self.fakes[0].url], failure_threshold=2, cooldown=60)
+        for _ in range(3):
+            data = router.generate("beginner python ML", route_key='chat-1')
+            self.assertIn('Spam Email Classifier', data['response'])
+        dead = router.backends[0]
+        self.assertEqual(dead.errors, 1)
+        router.backends[1].client.url = DEAD_URL
+        for _ in range(2):
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                router.generate("beginner python ML")
+        self.assertFalse(any(b.available(time.time()) for b in router.backends))
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            router.pick()
+
+    def test_stream_fails_over_before_first_token(self):
+        router = self.router([DEAD_URL, self.fakes[0].url])
+        router.backends[1].requests = 1  # make the dead backend the first choice
+        text = ''.join(chunk.get('response', '') for chunk in router.stream("beginner python ML"))
+        self.assertIn('Spam Email Classifier', text)
+        self.assertEqual([b.outstanding for b in router.backends], [0, 0])
+
+    def test_health_check_takes_backend_out_of_rotation(self):
+        fake = FakeOllama(latency=0).start()
+        router = self.router([fake.url, self.fakes[0].url])
+        router.check_health(timeout=1)
+        self.assertTrue(all(b.healthy for b in router.backends))
+        fake.stop()
+        router.check_health(timeout=1)
+        self.assertEqual([b.healthy for b in router.backends], [False, True])
+        router.generate("beginner python ML")
+        self.assertEqual(router.backends[0].requests, 0)
+
+    def test_single_url_builds_plain_client(self):
+        self.assertIsInstance(build_llm_client([self.fakes[0].url]), LLMClient)
+        router = build_llm_client([fake.url for fake in self.fakes], failure_threshold=5)
+        self.assertIsInstance(router, LLMRouter)
+        self.assertEqual(router.failure_threshold, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+os.environ.setdefault('MONGO_ENSURE_INDEXES', '0')
+
+from bson import ObjectId
+
+import app as app_module
+from services.search import search_result, search_terms, snippet, term_pattern
+
+CHAT_ID = '65f000000000000000000001'
+
+
+class TestSnippets(unittest.TestCase):
+    def test_terms_skip_negated_words(self):
+        self.assertEqual(search_terms('Spam classifier -email spam'), ['spam', 'classifier'])
+
+    def test_snippet_centred_on_match(self):
+        pattern = term_pattern(['classifiers'])
+        text = 'Filler words before. ' * 10 + 'A spam email classifier using naive Bayes.' + ' More words after.' * 10
+        result = snippet(text, pattern, width=80)
+        self.assertTrue(result.startswith('…') and result.endswith('…'))
+        self.assertIn('classifier', result)
+        self.assertLessEqual(len(result), 82)
+        self.assertEqual(snippet('Short reply', pattern), 'Short reply')
+
+    def test_result_picks_best_field(self):
+        message = {'chat_id': ObjectId(CHAT_ID), 'seq': 4, 'score': 2.5, 'user_message': '2',
+                   'selected_title': 'Spam Email Classifier', 'bot_reply': 'Selected project: Spam Email Classifier'}
+        result = search_result(message, term_pattern(['spam']), {CHAT_ID: 'ML ideas'})
+        self.assertEqual(result, {'chat_id': CHAT_ID, 'chat_name': 'ML ideas', 'seq': 4, 'field': 'selected_title',
+                                  'snippet': 'Spam Email Classifier', 'score': 2.5})
+
+
+class TestSearchEndpoint(unittest.TestCase):
+    def setUp(self):
+        app_module.app.config['TESTING'] = True
+        self.client = app_module.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['email'] = 'test@example.com'
+        self.store = mock.patch.object(app_module, 'chat_store').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_search_returns_ranked_snippets(self):
+        self.store.search_messages.return_value = (
+            [{'chat_id': ObjectId(CHAT_ID), 'seq': 1, 'score': 1.5, 'bot_reply': '1. Spam Filter\n2. Chess AI'}],
+            {CHAT_ID: 'ML ideas'}
+        )
+        response = self.client.get('/search?q=spam&limit=500')
+        self.assertEqual(response.json['results'][0]['seq'], 1)
+        self.assertEqual(response.json['results'][0]['snippet'], '1. Spam Filter 2. Chess AI')
+        self.store.search_messages.assert_called_once_with('test@example.com', 'spam', limit=50)
+
+    def test_empty_query_rejected(self):
+        self.assertEqual(self.client.get('/search?q=%20-').status_code, 400)
+        self.store.search_messages.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,210 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from services.singleflight import (AsyncSingleFlight, CoalescingLLMClient, MongoFlightStore, SingleFlight,
+                                   flight_key)
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+def run_threads(target, count):
+    results = [None] * count
+    threads = [threading.Thread(target=lambda i=i: results.__setitem__(i, target())) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_share_one_generation(self):
+        flights = SingleFlight()
+        calls = []
+
+        def generate():
+            calls.append(1)
+            time.sleep(0.2)
+            return {'response': 'titles'}
+
+        results = run_threads(lambda: flights.do('key', generate), 5)
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, [{'response': 'titles'}] * 5)
+        self.assertEqual(flights.in_flight(), 0)
+        # Finished flights are not reused
+        flights.do('key', generate)
+        self.assertEqual(len(calls), 2)
+
+    def test_error_reaches_every_caller(self):
+        flights = SingleFlight()
+
+        def fail():
+            time.sleep(0.1)
+            raise TimeoutError("slow model")
+
+        def call():
+            try:
+                return flights.do('key', fail)
+            except TimeoutError as e:
+                return str(e)
+
+        self.assertEqual(run_threads(call, 3), ['slow model'] * 3)
+
+    def test_stream_is_shared_from_the_first_chunk(self):
+        flights = SingleFlight()
+        started = threading.Event()
+        calls = []
+
+        def chunks(cancel):
+            calls.append(1)
+            for token in ('1. Spam', ' Filter', '\n2. Chess'):
+                yield {'response': token}
+                started.set()
+                time.sleep(0.05)
+
+        first = flights.stream('key', chunks)
+        self.assertEqual(next(first), {'response': '1. Spam'})
+        started.wait(1)
+        late = list(flights.stream('key', chunks))
+        self.assertEqual([c['response'] for c in late], ['1. Spam', ' Filter', '\n2. Chess'])
+        self.assertEqual(len(list(first)), 2)
+        self.assertEqual(calls, [1])
+
+    def test_stream_stops_once_every_caller_left(self):
+        flights = SingleFlight()
+        closed = threading.Event()
+
+        def chunks(cancel):
+            try:
+                while True:
+                    yield {'response': 'token'}
+                    time.sleep(0.01)
+            finally:
+                closed.set()
+
+        stream = flights.stream('key', chunks)
+        next(stream)
+        stream.close()
+        self.assertTrue(closed.wait(1))
+
+    def test_abandoned_stream_is_cancelled(self):
+        flights = SingleFlight()
+        tokens = []
+
+        def chunks(cancel):
+            tokens.append(cancel)
+            yield {'response': 'token'}
+            # Blocked until the generation is cancelled, like a request waiting on Ollama
+            cancel.on_cancel(lambda: None)
+            while not cancel.cancelled:
+                time.sleep(0.01)
+            cancel.check()
+
+        stream = flights.stream('key', chunks)
+        next(stream)
+        stream.close()
+        self.assertEqual(tokens[0].reason, 'abandoned')
+        self.assertEqual(flights.in_flight(), 0)
+        # A new caller starts a new generation instead of joining the cancelled one
+        self.assertEqual(next(flights.stream('key', chunks)), {'response': 'token'})
+        self.assertEqual(len(tokens), 2)
+
+    def test_client_skips_chat_specific_generations(self):
+        client = mock.Mock(model='llama3')
+        client.generate.return_value = {'response': 'ok'}
+        coalescing = CoalescingLLMClient(client, SingleFlight())
+        coalescing.generate("Prompt", format={'type': 'object'})
+        coalescing.generate("Prompt", context=[1, 2])
+        self.assertEqual(client.generate.call_count, 2)
+        self.assertEqual(coalescing.model, 'llama3')
+        self.assertEqual(flight_key('generate', 'llama3', "beginner python", {}),
+                         flight_key('generate', 'llama3', "beginner python", {}))
+        self.assertNotEqual(flight_key('generate', 'llama3', "Beginner  Python", {}),
+                            flight_key('generate', 'llama3', "beginner python", {}))
+        self.assertNotEqual(flight_key('generate', 'llama3', "beginner C++ web", {}),
+                            flight_key('generate', 'llama3', "beginner C# web", {}))
+        self.assertNotEqual(flight_key('generate', 'llama3', "beginner python", {'format': 'json'}),
+                            flight_key('generate', 'llama3', "beginner python", {}))
+
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class TestSharedFlights(unittest.TestCase):
+    def setUp(self):
+        collection = mongomock.MongoClient().db.llm_flights
+        self.workers = [SingleFlight(MongoFlightStore(collection), poll_interval=0.01) for _ in range(2)]
+
+    def test_lease_expiry_in_utc(self):
+        self.addCleanup(time.tzset)
+        with mock.patch.dict(os.environ, {'TZ': 'America/New_York'}):
+            time.tzset()
+            self.assertTrue(self.workers[0].store.claim('key'))
+        expires_at = self.workers[0].store.get('key')['expires_at']
+        lease = expires_at - datetime.now(timezone.utc).replace(tzinfo=None)
+        self.assertTrue(timedelta(seconds=290) < lease <= timedelta(seconds=300))
+        self.assertFalse(self.workers[1].store.claim('key'))
+
+    def test_other_worker_waits_for_result(self):
+        calls = []
+
+        def generate(worker):
+            calls.append(worker)
+            time.sleep(0.2)
+            return {'response': f'from {worker}'}
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(self.workers[0].do('key', lambda: generate(0))))
+        thread.start()
+        time.sleep(0.05)
+        results.append(self.workers[1].do('key', lambda: generate(1)))
+        thread.join(5)
+        self.assertEqual(calls, [0])
+        self.assertEqual(results, [{'response': 'from 0'}, {'response': 'from 0'}])
+
+    def test_failed_claim_is_taken_over(self):
+        def fail():
+            raise ValueError("bad")
+
+        with self.assertRaises(ValueError):
+            self.workers[0].do('key', fail)
+        self.assertEqual(self.workers[1].do('key', lambda: 'fresh'), 'fresh')
+
+
+class TestAsyncSingleFlight(unittest.TestCase):
+    def test_do_and_stream(self):
+        flights = AsyncSingleFlight()
+        calls = []
+
+        async def generate():
+            calls.append('generate')
+            await asyncio.sleep(0.05)
+            return 'titles'
+
+        async def chunks(cancel):
+            calls.append('stream')
+            for token in ('a', 'b'):
+                await asyncio.sleep(0.01)
+                yield token
+
+        async def collect():
+            return [chunk async for chunk in flights.stream('stream', chunks)]
+
+        async def main():
+            return await asyncio.gather(flights.do('key', generate), flights.do('key', generate), collect(), collect())
+
+        self.assertEqual(asyncio.run(main()), ['titles', 'titles', ['a', 'b'], ['a', 'b']])
+        self.assertEqual(calls, ['generate', 'stream'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import os
+import subprocess
+import sys
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+os.environ.setdefault('MONGO_ENSURE_INDEXES', '0')
+
+import requests
+
+import app as app_module
+from fake_ollama import FakeOllama
+from services.llm import LLMClient
+from services.router import LLMRouter
+from services.warmup import ModelWarmUp
+
+
+class FlakyClient:
+    url, model, keep_alive, model_options = 'http://ollama.test/api/generate', 'llama3', None, {}
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def warm_up(self, timeout=300):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise requests.exceptions.ConnectionError('connection refused')
+        return 1.5
+
+
+class TestModelWarmUp(unittest.TestCase):
+    def test_empty_prompt_with_keep_alive(self):
+        fake = FakeOllama(latency=0, token_rate=10000).start()
+        self.addCleanup(fake.stop)
+        client = LLMClient(fake.url, keep_alive='30m')
+        with mock.patch.object(client.session, 'post', wraps=client.session.post) as post:
+            self.assertEqual(client.warm_up(), 0)
+        self.assertEqual(post.call_args[1]['json'], {'model': 'llama3', 'prompt': '', 'stream': False, 'keep_alive': '30m'})
+        self.assertEqual(client.metrics()['completed'], 0)
+
+    def test_retried_until_loaded(self):
+        warmup = ModelWarmUp(FlakyClient(failures=2), retry_interval=0)
+        self.assertFalse(warmup.ready)
+        self.assertTrue(warmup.start())
+        self.assertFalse(warmup.start())
+        warmup._thread.join(5)
+        self.assertTrue(warmup.ready)
+        self.assertEqual(warmup.status()['attempts'], 3)
+        self.assertEqual(warmup.status()['load_seconds'], 1.5)
+
+    def test_disabled_is_ready(self):
+        warmup = ModelWarmUp(FlakyClient(failures=1), enabled=False)
+        self.assertFalse(warmup.start())
+        self.assertTrue(warmup.ready)
+
+    def test_router_warms_up_every_backend(self):
+        down, up = FlakyClient(failures=1), FlakyClient(failures=0)
+        self.assertEqual(LLMRouter([down, up]).warm_up(), 1.5)
+        self.assertEqual((down.calls, up.calls), (1, 1))
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            LLMRouter([FlakyClient(failures=1)]).warm_up()
+
+
+class TestStartup(unittest.TestCase):
+    def setUp(self):
+        app_module.app.config['TESTING'] = True
+        self.client = app_module.app.test_client()
+        self.warmup = ModelWarmUp(FlakyClient(failures=0))
+        mock.patch.object(app_module, 'model_warmup', self.warmup).start()
+        mock.patch.object(app_module, 'started_pid', None).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_ready_once_started_and_warmed_up(self):
+        # Without create_app (flask run), the first request starts the process
+        with mock.patch.object(self.warmup, 'start'):
+            response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 503)
+        self.assertTrue(response.get_json()['started'])
+        self.assertEqual(response.get_json()['warmup']['state'], 'pending')
+
+        self.warmup.start()
+        self.warmup._thread.join(5)
+        response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(response.get_json()['import_seconds'], 0)
+        self.assertIn('app_startup_seconds{phase="startup"}', self.client.get('/metrics').get_data(as_text=True))
+
+    def test_create_app_starts_the_process(self):
+        self.assertIs(app_module.create_app(), app_module.app)
+        self.assertEqual(app_module.started_pid, os.getpid())
+        self.assertFalse(app_module.start_process())
+
+    def test_started_once_per_process(self):
+        with mock.patch.object(app_module, 'WRITE_BEHIND', True), \
+                mock.patch.object(app_module.chat_store, 'replay', create=True, return_value=0) as replay:
+            self.assertTrue(app_module.start_process())
+            self.assertFalse(app_module.start_process())
+            self.assertEqual(replay.call_count, 1)
+            # A worker forked after startup only restarts its background threads
+            app_module.started_pid = os.getpid() + 1
+            with mock.patch.object(self.warmup, 'start') as start:
+                self.client.get('/healthz')
+            start.assert_called_once()
+            self.assertEqual(replay.call_count, 1)
+        self.assertEqual(app_module.started_pid, os.getpid())
+
+    def test_import_needs_no_mongodb(self):
+        # Nothing listens on port 1; touching MongoDB during the import would fail it
+        env = {**os.environ, 'MONGO_URI': 'mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=500',
+               'STATE_STORE_BACKEND': 'mongo', 'RESPONSE_CACHE_BACKEND': 'mongo', 'LLM_COALESCE': '1',
+               'MONGO_ENSURE_INDEXES': '1', 'LLM_WARMUP': '0'}
+        script = ("import app; "
+                  "assert app.flight_store and app.response_cache.backend and app.SHARED_STATE; "
+                  "assert not app.mongo_client.resolved")
+        result = subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(app_module.__file__), env=env,
+                                capture_output=True, text=True, timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+    def test_store_indexes_created_on_startup(self):
+        stores = [mock.Mock(), mock.Mock(), mock.Mock()]
+        with mock.patch.object(app_module, 'ensure_indexes') as ensure_indexes, \
+                mock.patch.object(app_module, 'conversation_store', stores[0]), \
+                mock.patch.object(app_module.response_cache, 'backend', stores[1]), \
+                mock.patch.object(app_module, 'flight_store', stores[2]):
+            app_module.ensure_all_indexes()
+        ensure_indexes.assert_called_once_with(app_module.db)
+        for store in stores:
+            store.ensure_index.assert_called_once_with()
+
+    def test_counts_backfilled_without_index_creation(self):
+        with mock.patch.object(app_module, 'MONGO_ENSURE_INDEXES', False), \
+                mock.patch.object(app_module.chat_store, 'counts_backfilled', False), \
+                mock.patch.object(app_module, 'ensure_indexes') as ensure_indexes, \
+                mock.patch.object(app_module, 'backfill_message_counts', return_value=True) as backfill:
+            running = set(threading.enumerate())
+            app_module.start_process()
+            for thread in set(threading.enumerate()) - running:
+                if thread.name == 'ensure-indexes':
+                    thread.join(5)
+            backfill.assert_called_once_with(app_module.db)
+            ensure_indexes.assert_not_called()
+            self.assertTrue(app_module.chat_store.counts_backfilled)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import os
+import sys
+import unittest
+from datetime import timezone
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from services.state_store import MemoryStateStore, MongoStateStore
+
+
+class TestMemoryStateStore(unittest.TestCase):
+    def test_bounded_lru(self):
+        store = MemoryStateStore(max_entries=2)
+        store.set('a', [1])
+        store.set('b', [2])
+        store.get('a')
+        store.set('c', [3])
+        self.assertIsNone(store.get('b'))
+        self.assertEqual(store.get('a'), [1])
+        self.assertEqual(store.count(), 2)
+
+    def test_idle_entries_expire(self):
+        store = MemoryStateStore(ttl=10)
+        with mock.patch('services.state_store.time.time', return_value=100):
+            store.set('a', [])
+        with mock.patch('services.state_store.time.time', return_value=111):
+            self.assertIsNone(store.get('a'))
+        self.assertEqual(store.count(), 0)
+
+
+class TestMongoStateStore(unittest.TestCase):
+    def test_expiry_timestamp_is_utc(self):
+        collection = mock.Mock()
+        MongoStateStore(collection).set('a', [1])
+        updated_at = collection.update_one.call_args[0][1]['$set']['updated_at']
+        self.assertEqual(updated_at.tzinfo, timezone.utc)
+
+
+if __name__ == '__main__':
+    unittest.main()
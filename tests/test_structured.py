@@ -0,0 +1,45 @@
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from services.structured import find_project, is_complete, parse_projects
+
+
+def project(title, problems=5):
+    return {'title': title, 'problems': [f"{title} problem {i}" for i in range(problems)], 'reason': 'Fits you.'}
+
+
+class TestParseProjects(unittest.TestCase):
+    def test_valid_reply(self):
+        data = parse_projects(json.dumps({'question': '', 'projects': [project('Spam Filter'), project('Chess AI')]}))
+        self.assertEqual([p['title'] for p in data['projects']], ['Spam Filter', 'Chess AI'])
+        self.assertTrue(is_complete(find_project(data['projects'], 'Chess AI')))
+
+    def test_repairs_items(self):
+        raw = json.dumps({'question': 'ignored', 'projects': [
+            {'title': '1. **Spam Filter**', 'problems': ['1. A', 'a', '2) B', 7, ''], 'reason': ' Good '},
+            {'title': 'spam filter', 'problems': [], 'reason': ''},
+            'not a project',
+            {'problems': ['no title']},
+        ] + [project(f"P{i}") for i in range(12)]})
+        data = parse_projects(raw)
+        self.assertEqual(len(data['projects']), 10)
+        first = data['projects'][0]
+        self.assertEqual(first, {'title': 'Spam Filter', 'problems': ['A', 'B'], 'reason': 'Good'})
+        self.assertFalse(is_complete(first))
+        self.assertEqual(data['question'], '')
+
+    def test_clarifying_question(self):
+        data = parse_projects('{"question": "Which language?", "projects": []}')
+        self.assertEqual(data, {'question': 'Which language?', 'projects': []})
+
+    def test_unusable(self):
+        for raw in ('not json', '[]', '{"question": "", "projects": []}'):
+            self.assertIsNone(parse_projects(raw))
+
+
+if __name__ == '__main__':
+    unittest.main()
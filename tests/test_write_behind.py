@@ -0,0 +1,249 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from bson import ObjectId
+from pymongo import InsertOne
+from pymongo.errors import AutoReconnect, BulkWriteError, DuplicateKeyError
+
+from services.chat_store import ChatStore
+from services.write_behind import WriteBehindChatStore
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+class BulkCollection:
+    """
+    mongomock collection running bulk_write one write model at a time (mongomock's own
+    bulk_write does not take the models of current pymongo versions)
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def bulk_write(self, requests, ordered=True):
+        errors = []
+        for index, request in enumerate(requests):
+            try:
+                if isinstance(request, InsertOne):
+                    self.collection.insert_one(dict(request._doc))
+                else:
+                    self.collection.update_one(request._filter, request._doc, upsert=bool(request._upsert))
+            except DuplicateKeyError as e:
+                errors.append({'index': index, 'code': 11000, 'errmsg': str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'writeConcernErrors': []})
+
+
+def entry(n):
+    return {'user_message': f'message {n}', 'bot_reply': f'reply {n}', 'reply_type': 'clarify'}
+
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class TestWriteBehindChatStore(unittest.TestCase):
+    def setUp(self):
+        db = mongomock.MongoClient().db
+        self.chats, self.messages = BulkCollection(db.chats), BulkCollection(db.messages)
+        self.messages.create_index([('chat_id', 1), ('seq', 1)], unique=True)
+        self.journal = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.journal)
+
+    def store(self, **kwargs):
+        # A long interval keeps the background thread from flushing during the test
+        store = WriteBehindChatStore(self.chats, self.messages, self.journal, interval=60, **kwargs)
+        self.addCleanup(store.close)
+        return store
+
+    def test_turns_coalesced_into_one_flush(self):
+        store = self.store()
+        chat_id = '65f000000000000000000001'
+        with mock.patch.object(self.chats, 'find_one_and_update') as reserve:
+            for n in range(3):
+                self.assertIsNotNone(store.append_message(chat_id, 'a@b.c', entry(n), create=True))
+        # Nothing reaches MongoDB on the turn; the messages wait in the journal
+        reserve.assert_not_called()
+        self.assertIsNone(self.chats.find_one())
+        self.assertEqual(self.messages.count_documents({}), 0)
+        self.assertEqual(store.metrics()['pending_chats'], 1)
+
+        with mock.patch.object(self.messages, 'bulk_write', wraps=self.messages.bulk_write) as bulk_write:
+            self.assertEqual(store.flush(), 3)
+        self.assertEqual(len(bulk_write.call_args[0][0]), 3)
+        chat = self.chats.find_one()
+        self.assertEqual((str(chat['_id']), chat['email'], chat['message_count']), (chat_id, 'a@b.c', 3))
+        self.assertEqual([m['user_message'] for m in self.messages.find().sort('seq', 1)],
+                         [f'message {n}' for n in range(3)])
+        self.assertEqual(os.listdir(self.journal), [])
+
+    def test_reads_see_pending_writes(self):
+        store = self.store()
+        chat_id = '65f000000000000000000001'
+        store.append_message(chat_id, 'a@b.c', entry(0), create=True)
+        self.assertEqual(store.get_chat(chat_id, 'a@b.c')['message_count'], 1)
+        self.assertEqual(store.get_messages(chat_id, 'a@b.c')[0]['bot_reply'], 'reply 0')
+        self.assertIsNone(store.append_message(chat_id, 'other@b.c', entry(1)))
+
+    def test_reads_flush_only_what_they_read(self):
+        store = self.store()
+        read, other = '65f000000000000000000001', '65f000000000000000000002'
+        store.append_message(read, 'a@b.c', entry(0), create=True)
+        store.append_message(other, 'x@b.c', entry(0), create=True)
+        store.set_prefetched(other, 'x@b.c', 'k1', 'problems')
+        self.assertEqual(store.get_chat(read, 'a@b.c')['message_count'], 1)
+        self.assertEqual(store.metrics()['pending_chats'], 1)
+        # Pending prefetched replies are answered from memory
+        self.assertEqual(store.get_prefetched(other, 'x@b.c', 'k1'), 'problems')
+        self.assertEqual(store.metrics()['pending_writes'], 2)
+        self.assertEqual([str(chat['_id']) for chat in store.list_chats('x@b.c')[0]], [other])
+        self.assertEqual(store.metrics()['pending_writes'], 0)
+
+        # Flushed writes stay journalled until the whole journal is flushed, and replay harmlessly
+        self.assertNotEqual(os.listdir(self.journal), [])
+        replayed = self.store()
+        self.assertEqual(replayed.replay(), 3)
+        replayed.flush()
+        self.assertEqual(self.messages.count_documents({}), 2)
+        self.assertEqual([chat['message_count'] for chat in self.chats.find()], [1, 1])
+        self.assertEqual(os.listdir(self.journal), [])
+
+    def test_workers_number_messages_of_one_chat_apart(self):
+        chat_id = '65f000000000000000000001'
+        ChatStore(self.chats, self.messages).append_message(chat_id, 'a@b.c', entry(0), create=True)
+        workers = [self.store(), self.store()]
+        for n in range(1, 5):
+            workers[n % 2].append_message(chat_id, 'a@b.c', entry(n))
+        self.assertIsNone(workers[0].append_message('65f0000000000000000000ff', 'a@b.c', entry(1)))
+        for worker in workers:
+            worker.flush()
+        messages = list(self.messages.find().sort('seq', 1))
+        self.assertEqual([m['seq'] for m in messages], [0, 1, 2, 3, 4])
+        self.assertEqual(sorted(m['user_message'] for m in messages), [f'message {n}' for n in range(5)])
+        self.assertEqual(self.chats.find_one()['message_count'], 5)
+
+    def test_first_message_creates_chat(self):
+        store = self.store()
+        chat_id = '65f000000000000000000001'
+        self.assertIsNotNone(store.append_message(chat_id, 'a@b.c', entry(0), create=True))
+        self.assertIsNone(store.append_message(chat_id, 'x@b.c', entry(0), create=True))
+        store.flush()
+        self.assertEqual(store.list_chats('a@b.c')[0][0]['chat_name'], 'New Chat')
+
+    def test_writes_to_another_users_chat_are_dropped(self):
+        chat_id = '65f000000000000000000001'
+        ChatStore(self.chats, self.messages).append_message(chat_id, 'a@b.c', entry(0), create=True)
+        store = self.store()
+        store.append_message(chat_id, 'x@b.c', entry(1), create=True)
+        store.set_prefetched(chat_id, 'x@b.c', 'k1', 'problems')
+        store.flush()
+        chat = self.chats.find_one()
+        self.assertEqual((chat['email'], chat['message_count'], chat.get('prefetched')), ('a@b.c', 1, None))
+        self.assertEqual(self.messages.count_documents({}), 1)
+        self.assertEqual(store.metrics()['pending_writes'], 0)
+
+    def test_journal_replayed_after_crash(self):
+        chat_id = '65f000000000000000000001'
+        crashed = WriteBehindChatStore(self.chats, self.messages, self.journal, interval=60)
+        crashed.append_message(chat_id, 'a@b.c', entry(0), create=True)
+        crashed.set_prefetched(chat_id, 'a@b.c', 'k1', 'problems')
+
+        store = self.store()
+        self.assertEqual(store.replay(), 2)
+        store.flush()
+        chat = self.chats.find_one()
+        self.assertEqual((chat['message_count'], chat['prefetched']), (1, {'k1': 'problems'}))
+        self.assertEqual(self.messages.count_documents({}), 1)
+        store.append_message(chat_id, 'a@b.c', entry(1))
+        store.flush()
+        self.assertEqual([m['seq'] for m in self.messages.find().sort('seq', 1)], [0, 1])
+
+    def test_replaying_flushed_writes_is_harmless(self):
+        store = self.store()
+        chat_id = '65f000000000000000000001'
+        store.append_message(chat_id, 'a@b.c', entry(0), create=True)
+        # Crash after the bulk writes but before the journal is removed
+        saved = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, saved)
+        for name in os.listdir(self.journal):
+            shutil.copy(os.path.join(self.journal, name), saved)
+        store.flush()
+        store.append_message(chat_id, 'a@b.c', entry(1))
+        store.flush()
+        for name in os.listdir(saved):
+            shutil.copy(os.path.join(saved, name), self.journal)
+
+        replayed = self.store()
+        self.assertEqual(replayed.replay(), 1)
+        replayed.flush()
+        self.assertEqual(self.chats.find_one()['message_count'], 2)
+        self.assertEqual(self.messages.count_documents({}), 2)
+
+    def test_replay_keeps_journalled_numbers(self):
+        store = self.store()
+        chat_id = '65f000000000000000000001'
+        store.append_message(chat_id, 'a@b.c', entry(0), create=True)
+        # Crash once the numbers are journalled and the messages stored, before the journal is removed
+        with mock.patch('services.write_behind.os.remove'):
+            store.flush()
+
+        replayed = self.store()
+        self.assertEqual(replayed.replay(), 1)
+        with mock.patch.object(self.chats, 'find_one_and_update') as reserve:
+            replayed.flush()
+        reserve.assert_not_called()
+        self.assertEqual(self.chats.find_one()['message_count'], 1)
+        self.assertEqual(self.messages.count_documents({}), 1)
+
+    def test_conflicting_message_is_not_dropped(self):
+        store = self.store()
+        chat_id = '65f000000000000000000001'
+        store.append_message(chat_id, 'a@b.c', entry(0), create=True)
+        # Another message already holds the number: not a replay of this one
+        self.messages.insert_one({'chat_id': ObjectId(chat_id), 'seq': 0, 'email': 'a@b.c', 'user_message': 'other'})
+        with self.assertRaises(BulkWriteError):
+            store.flush()
+        self.assertEqual(store.metrics()['pending_writes'], 1)
+        self.assertNotEqual(os.listdir(self.journal), [])
+
+    def test_failed_flush_stays_pending(self):
+        store = self.store()
+        chat_id = '65f000000000000000000001'
+        store.append_message(chat_id, 'a@b.c', entry(0), create=True)
+        with mock.patch.object(self.messages, 'bulk_write', side_effect=AutoReconnect('down')):
+            with self.assertRaises(AutoReconnect):
+                store.flush()
+        store.append_message(chat_id, 'a@b.c', entry(1))
+        self.assertEqual(store.metrics()['pending_writes'], 2)
+        self.assertEqual(store.metrics()['failed_flushes'], 1)
+        store.close()
+        # The message numbered by the failed flush keeps its number
+        self.assertEqual([m['seq'] for m in self.messages.find().sort('seq', 1)], [0, 1])
+        self.assertEqual(self.chats.find_one()['message_count'], 2)
+        self.assertEqual(os.listdir(self.journal), [])
+
+    def test_prefetched_replies_cleared_in_order(self):
+        store = self.store()
+        chat_id = '65f000000000000000000001'
+        store.append_message(chat_id, 'a@b.c', entry(0), create=True)
+        store.set_prefetched(chat_id, 'a@b.c', 'k1', 'old')
+        store.flush()
+        store.clear_prefetched(chat_id, 'a@b.c')
+        store.set_prefetched(chat_id, 'a@b.c', 'k2', 'new')
+        self.assertIsNone(store.get_prefetched(chat_id, 'a@b.c', 'k1'))
+        self.assertEqual(store.get_prefetched(chat_id, 'a@b.c', 'k2'), 'new')
+
+
+if __name__ == '__main__':
+    unittest.main()